@@ -6,29 +6,165 @@ Retailer: Loaded from environment variables
 
 import requests
 import json
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from datetime import datetime, timedelta
+from urllib.parse import urlparse
 from config import Config
+from aggregation import as_number
+from columnar import InvoiceLines
+from fast_json import decode_invoice_page
+from invoice_store import InvoiceStore, invoice_modified_date, DATETIME_FORMAT
+from pagination import DriftGuard, is_last_page, remaining_page_offsets
+from prefetch import PrefetchWorker
+from product_catalog import ProductCatalog
+from query_cache import ReportQuery, get_shared_result_cache
+from snapshot import write_snapshot
+from timeseries import ProductTimeSeries, percent_change
+from sketches import APPROX_METRICS, ApproximateProductRanking
+from rate_limiter import RateLimiter, RateLimitedAdapter, RateLimitedRetry
+from telemetry import get_logger, get_shared_telemetry
+from token_manager import TokenManager
+
+logger = get_logger(Config.LOG_LEVEL)
+
+# Tên chỉ số trong báo cáo xếp hạng gần đúng và báo cáo xu hướng
+METRIC_LABELS = {
+    'total_quantity': 'SỐ LƯỢNG BÁN',
+    'total_revenue': 'DOANH THU',
+    'invoice_count': 'SỐ ĐƠN HÀNG'
+}
 
 class KiotVietAPI:
-    def __init__(self):
-        # Load configuration from environment variables
-        try:
-            Config.validate()
-        except ValueError as e:
-            print(f"❌ Configuration Error: {e}")
-            print("💡 Please check your .env file")
-            raise
+    def __init__(self, retailer=None, client_id=None, client_secret=None, cache_db_path=None):
+        """Mặc định dùng retailer trong .env; truyền thông tin riêng để kết nối retailer khác (fan-out nhiều cửa hàng)"""
+        if retailer is None:
+            # Load configuration from environment variables
+            try:
+                Config.validate()
+            except ValueError as e:
+                print(f"❌ Configuration Error: {e}")
+                print("💡 Please check your .env file")
+                raise
         
         # Thông tin kết nối từ config
-        self.retailer = Config.RETAILER
-        self.client_id = Config.CLIENT_ID
-        self.client_secret = Config.CLIENT_SECRET
+        self.retailer = retailer or Config.RETAILER
+        self.client_id = client_id or Config.CLIENT_ID
+        self.client_secret = client_secret or Config.CLIENT_SECRET
         self.base_url = Config.BASE_URL
         self.auth_url = Config.AUTH_URL
-        self.access_token = None
         
+        # Số luồng tải trang song song tối đa
+        self.fetch_concurrency = Config.FETCH_CONCURRENCY
+        
+        # Chia kỳ dài thành các cửa sổ tải độc lập (mỗi cửa sổ có checkpoint riêng)
+        self.sync_window = Config.SYNC_WINDOW
+        self.sync_window_concurrency = Config.SYNC_WINDOW_CONCURRENCY
+        
+        # Số lượt duyệt lại tối đa khi phát hiện hóa đơn bị bỏ sót do lệch phân trang
+        self.drift_max_passes = Config.DRIFT_MAX_PASSES
+        
+        # Giới hạn tốc độ gọi API, dùng chung giữa các luồng và các tiến trình cùng retailer
+        self.rate_limiter = RateLimiter(
+            rate=Config.RATE_LIMIT_PER_SECOND,
+            burst=Config.RATE_LIMIT_BURST,
+            state_path=Config.RATE_LIMIT_STATE_PATH or None,
+            key=self.retailer
+        )
+        
+        # Số liệu từng request và thời gian theo giai đoạn, dùng chung trong tiến trình
+        self.telemetry = get_shared_telemetry(Config.METRICS_EXPORT_PATH or None)
+        
+        # Session dùng chung: giữ kết nối keep-alive và tự thử lại khi lỗi tạm thời
+        self.timeout = Config.HTTP_TIMEOUT
+        self.session = self._create_session()
+        
+        # Token được lưu kèm hạn dùng, làm mới trước khi hết hạn và lưu ra đĩa
+        self.token_manager = TokenManager(
+            fetch_token=self._request_access_token,
+            cache_path=Config.TOKEN_CACHE_PATH or None,
+            cache_key=f"{self.auth_url}|{self.client_id}",
+            refresh_margin=Config.TOKEN_REFRESH_MARGIN
+        )
+        
+        # Giải mã trang hóa đơn: orjson nếu có, chỉ giữ các trường báo cáo dùng tới
+        self.fast_json = Config.FAST_JSON_ENABLED
+        self.invoice_projection = Config.INVOICE_PROJECTION
+        
+        # Kho hóa đơn cục bộ (bật bằng CACHE_ENABLED)
+        self.invoice_store = InvoiceStore(
+            cache_db_path or Config.CACHE_DB_PATH, Config.AGGREGATION_PROCESSES, Config.FAST_JSON_ENABLED
+        ) if Config.CACHE_ENABLED else None
+        
+        # Danh mục sản phẩm (giá vốn, tồn kho) lưu cùng file với kho hóa đơn, làm mới sau PRODUCT_CATALOG_TTL giây
+        self.product_catalog = ProductCatalog((cache_db_path or Config.CACHE_DB_PATH) if Config.CACHE_ENABLED else None)
+        self.product_catalog_ttl = Config.PRODUCT_CATALOG_TTL
+        
+        # Bảng tổng hợp theo sản phẩm: kỳ -> (bảng, thời điểm tính). Kỳ đã kết thúc dùng mãi,
+        # kỳ đang diễn ra chỉ dùng lại trong warm_table_max_age giây (bật khi chạy prefetch)
+        self._sales_tables = {}
+        self._sales_table_locks = {}
+        self._sales_table_locks_lock = threading.Lock()
+        self.warm_table_max_age = 0
+        self.prefetcher = None
+        
+        # Cache kết quả câu hỏi (LRU), dùng chung cho mọi KiotVietAPI trong tiến trình
+        self.result_cache = get_shared_result_cache(Config.QUERY_CACHE_SIZE)
+        self.query_cache_ttl = Config.QUERY_CACHE_TTL
+        
+        # Sai số tối đa của xếp hạng gần đúng (tỷ lệ so với tổng của chỉ số)
+        self.approx_top_epsilon = Config.APPROX_TOP_EPSILON
+        
+        # Số lần tải thiếu dữ liệu (trang lỗi, cửa sổ chưa đồng bộ xong) theo từng luồng, để
+        # bảng tổng hợp và kết quả tính từ dữ liệu thiếu không bị giữ như kết quả đầy đủ
+        self._fetch_state = threading.local()
+        
+    def fetch_failures(self):
+        """Số lần tải thiếu dữ liệu của luồng hiện tại (so sánh trước/sau một lần tính để biết có đủ không)"""
+        return getattr(self._fetch_state, 'failures', 0)
+    
+    def _record_fetch_failure(self):
+        """Ghi nhận một lần tải thiếu dữ liệu của luồng hiện tại"""
+        self._fetch_state.failures = self.fetch_failures() + 1
+    
+    def _create_session(self):
+        """Tạo requests.Session với connection pool, chính sách retry/backoff và rate limiter"""
+        retry = RateLimitedRetry(
+            total=Config.HTTP_MAX_RETRIES,
+            backoff_factor=Config.HTTP_BACKOFF_FACTOR,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET', 'POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        retry.rate_limiter = self.rate_limiter
+        adapter = RateLimitedAdapter(
+            self.rate_limiter,
+            pool_connections=2,
+            pool_maxsize=max(self.fetch_concurrency * self.sync_window_concurrency, 1),
+            max_retries=retry
+        )
+        
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    @property
+    def access_token(self):
+        """Access Token hiện tại (có thể None nếu chưa xác thực)"""
+        return self.token_manager.access_token
+    
     def get_access_token(self):
-        """Lấy Access Token từ KiotViet"""
+        """Đảm bảo có Access Token còn hạn (dùng lại token đã lưu, tự làm mới khi sắp hết hạn)"""
+        return self.token_manager.get_token() is not None
+    
+    def _request_access_token(self):
+        """Lấy Access Token mới từ KiotViet, trả về (access_token, expires_in) hoặc None"""
         headers = {
             "Content-Type": "application/x-www-form-urlencoded"
         }
@@ -41,51 +177,86 @@ class KiotVietAPI:
         }
         
         try:
-            print("🔑 Đang xác thực với KiotViet API...")
-            response = requests.post(self.auth_url, headers=headers, data=data)
+            logger.info("🔑 Đang xác thực với KiotViet API...")
+            response = self._send('POST', self.auth_url, phase='auth', headers=headers, data=data)
             
-            print(f"📡 Status Code: {response.status_code}")
+            logger.info(f"📡 Status Code: {response.status_code}")
             
             if response.status_code == 200:
                 token_data = response.json()
-                self.access_token = token_data.get("access_token")
+                access_token = token_data.get("access_token")
                 
-                if self.access_token:
-                    print("✅ Đã kết nối thành công với KiotViet API")
-                    print(f"🎫 Token: {self.access_token[:20]}...")
-                    return True
+                if access_token:
+                    logger.info("✅ Đã kết nối thành công với KiotViet API")
+                    logger.info(f"🎫 Token: {access_token[:20]}...")
+                    return access_token, token_data.get("expires_in")
                 else:
-                    print("❌ Không thể lấy Access Token từ response")
-                    print(f"Response: {response.text}")
-                    return False
+                    logger.error("❌ Không thể lấy Access Token từ response")
+                    logger.error(f"Response: {response.text}")
+                    return None
             else:
-                print(f"❌ Lỗi HTTP {response.status_code}: {response.text}")
-                return False
+                logger.error(f"❌ Lỗi HTTP {response.status_code}: {response.text}")
+                return None
                 
         except requests.exceptions.RequestException as e:
-            print(f"❌ Lỗi kết nối: {e}")
-            return False
+            logger.error(f"❌ Lỗi kết nối: {e}")
+            return None
         except Exception as e:
-            print(f"❌ Lỗi không xác định: {e}")
-            return False
+            logger.error(f"❌ Lỗi không xác định: {e}")
+            return None
     
-    def get_headers(self):
+    def get_headers(self, access_token=None):
         """Tạo headers cho API requests"""
         return {
             "Retailer": self.retailer,
-            "Authorization": f"Bearer {self.access_token}",
+            "Authorization": f"Bearer {access_token or self.access_token}",
             "Content-Type": "application/json"
         }
     
-    def get_invoices(self, from_date, to_date, page_size=100, current_item=0):
-        """Lấy danh sách hóa đơn trong khoảng thời gian"""
-        if not self.access_token:
-            if not self.get_access_token():
+    def _send(self, method, url, phase='fetch', page=None, **kwargs):
+        """Gửi HTTP request qua session, ghi telemetry: độ trễ, status, dung lượng, số lần thử lại, trang"""
+        endpoint = urlparse(url).path or '/'
+        started = time.perf_counter()
+        
+        with self.telemetry.phase(phase):
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                size = len(response.content)
+            except requests.exceptions.RequestException:
+                self.telemetry.record_request(endpoint, None, time.perf_counter() - started, 0, page=page)
+                raise
+        
+        latency = time.perf_counter() - started
+        retry_state = getattr(response.raw, 'retries', None)
+        retries = len(retry_state.history) if retry_state else 0
+        self.telemetry.record_request(endpoint, response.status_code, latency, size, retries, page)
+        logger.debug(f"🌐 {method} {endpoint}{f' trang {page}' if page else ''}: {response.status_code}, "
+                     f"{latency:.3f}s, {size / 1024:.1f}KB, thử lại {retries} lần")
+        return response
+    
+    def _authorized_get(self, url, params, page=None):
+        """Gửi GET kèm token; nếu bị 401 thì xác thực lại một lần rồi gửi lại"""
+        access_token = self.token_manager.get_token()
+        if not access_token:
+            return None
+        
+        response = self._send('GET', url, page=page, headers=self.get_headers(access_token), params=params)
+        
+        if response.status_code == 401:
+            logger.warning("🔑 Token bị từ chối (401), đang xác thực lại...")
+            self.token_manager.invalidate(access_token)
+            access_token = self.token_manager.get_token()
+            if not access_token:
                 return None
+            response = self._send('GET', url, page=page, headers=self.get_headers(access_token), params=params)
         
+        return response
+    
+    def get_invoices(self, from_date, to_date, page_size=100, current_item=0):
+        """Lấy danh sách hóa đơn trong khoảng thời gian"""
         url = f"{self.base_url}/invoices"
         params = {
-            "lastModifiedFrom": from_date.strftime("%Y-%m-%dT00:00:00"),
+            "lastModifiedFrom": from_date.strftime(DATETIME_FORMAT),
             "lastModifiedTo": to_date.strftime("%Y-%m-%dT23:59:59"),
             "pageSize": page_size,
             "currentItem": current_item,
@@ -93,313 +264,626 @@ class KiotVietAPI:
         }
         
         try:
-            response = requests.get(url, headers=self.get_headers(), params=params)
+            response = self._authorized_get(url, params, page=current_item // page_size + 1)
+            if response is None:
+                return None
             response.raise_for_status()
-            return response.json()
+            with self.telemetry.phase('decode'):
+                invoices_data = decode_invoice_page(response.content, self.fast_json, self.invoice_projection)
+            
+            # Ghi trang vừa tải vào kho cục bộ
+            if self.invoice_store and invoices_data.get('data'):
+                with self.telemetry.phase('store'):
+                    self.invoice_store.save_invoices(invoices_data['data'])
+            
+            return invoices_data
         except requests.exceptions.RequestException as e:
-            print(f"❌ Lỗi khi lấy hóa đơn: {e}")
+            logger.error(f"❌ Lỗi khi lấy hóa đơn: {e}")
             return None
     
-    def get_products(self, page_size=100, current_item=0):
-        """Lấy danh sách sản phẩm"""
-        if not self.access_token:
-            if not self.get_access_token():
-                return None
-        
+    def get_products(self, page_size=100, current_item=0, modified_from=None):
+        """Lấy danh sách sản phẩm (modified_from: chỉ lấy sản phẩm thay đổi từ mốc này, kèm id đã xóa)"""
         url = f"{self.base_url}/products"
         params = {
             "pageSize": page_size,
             "currentItem": current_item,
             "includeInventory": True
         }
+        if modified_from:
+            params["lastModifiedFrom"] = modified_from.strftime(DATETIME_FORMAT)
+            params["includeRemoveIds"] = True
         
         try:
-            response = requests.get(url, headers=self.get_headers(), params=params)
+            response = self._authorized_get(url, params, page=current_item // page_size + 1)
+            if response is None:
+                return None
             response.raise_for_status()
-            return response.json()
+            with self.telemetry.phase('decode'):
+                return response.json()
         except requests.exceptions.RequestException as e:
-            print(f"❌ Lỗi khi lấy sản phẩm: {e}")
+            logger.error(f"❌ Lỗi khi lấy sản phẩm: {e}")
             return None
-    
-    def get_top_selling_products(self, month=None, year=2025, top_n=10):
-        """Lấy top sản phẩm bán chạy nhất trong tháng hoặc năm"""
-        if month:
-            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm bán chạy nhất tháng {month}/{year}...")
-            # Tính toán khoảng thời gian cho tháng
-            from_date = datetime(year, month, 1)
-            if month == 12:
-                to_date = datetime(year + 1, 1, 1) - timedelta(days=1)
-            else:
-                to_date = datetime(year, month + 1, 1) - timedelta(days=1)
-        else:
-            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm bán chạy nhất năm {year}...")
-            # Tính toán khoảng thời gian cho cả năm
-            from_date = datetime(year, 1, 1)
-            to_date = datetime(year, 12, 31)
+
+    def iter_pages(self, fetch_page, page_size=100, max_workers=None):
+        """Duyệt lần lượt từng trang của một API phân trang (generator)
+        
+        Trang đầu được tải trước để đọc `total`, các trang còn lại được tải song song
+        với tối đa `max_workers` luồng nhưng vẫn trả về theo đúng thứ tự. Chỉ giữ tối đa
+        `max_workers` trang trong bộ nhớ cùng lúc. Trang tải lỗi được trả về là None.
+        """
+        max_workers = max_workers or self.fetch_concurrency
+        
+        logger.info("📄 Đang tải dữ liệu... (trang 1)")
+        first_page = fetch_page(0)
+        yield first_page
         
-        print(f"📅 Từ ngày: {from_date.strftime('%d/%m/%Y')}")
-        print(f"📅 Đến ngày: {to_date.strftime('%d/%m/%Y')}")
+        offsets = remaining_page_offsets(first_page, page_size)
+        if offsets is None:
+            # API không trả về total: tải tuần tự cho đến trang cuối
+            yield from self._iter_remaining_pages_serial(fetch_page, page_size)
+            return
         
-        # Lấy tất cả hóa đơn trong tháng
-        all_invoices = []
-        current_item = 0
-        page_size = 100
+        remaining_pages = len(offsets)
+        if remaining_pages <= 0:
+            return
+        offsets = iter(offsets)
+        
+        logger.info(f"📄 Đang tải {remaining_pages} trang còn lại ({min(max_workers, remaining_pages)} luồng song song)...")
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=threading.current_thread().name) as executor:
+            pending = deque(executor.submit(fetch_page, offset) for offset in islice(offsets, max_workers))
+            try:
+                while pending:
+                    with self.telemetry.phase('wait'):
+                        page = pending.popleft().result()
+                    
+                    # Giữ cửa sổ tải trước luôn đủ max_workers trang
+                    next_offset = next(offsets, None)
+                    if next_offset is not None:
+                        pending.append(executor.submit(fetch_page, next_offset))
+                    
+                    yield page
+            finally:
+                for future in pending:
+                    future.cancel()
+    
+    def _iter_remaining_pages_serial(self, fetch_page, page_size):
+        """Tải tuần tự các trang sau trang đầu (dùng khi không biết tổng số bản ghi)"""
+        current_item = page_size
         
         while True:
-            print(f"📄 Đang tải hóa đơn... (trang {current_item//page_size + 1})")
-            invoices_data = self.get_invoices(from_date, to_date, page_size, current_item)
-            
-            if not invoices_data or not invoices_data.get('data'):
-                break
-            
-            all_invoices.extend(invoices_data['data'])
+            logger.info(f"📄 Đang tải dữ liệu... (trang {current_item//page_size + 1})")
+            page = fetch_page(current_item)
+            yield page
             
             # Kiểm tra xem còn dữ liệu không
-            if len(invoices_data['data']) < page_size:
+            if is_last_page(page, page_size):
                 break
             
             current_item += page_size
+    
+    def fetch_all_pages(self, fetch_page, page_size=100, max_workers=None):
+        """Tải tất cả các trang của một API phân trang, trả về (danh sách bản ghi, đã tải đủ hay chưa)"""
+        items = []
+        complete = True
         
-        print(f"📊 Đã tải {len(all_invoices)} hóa đơn")
+        for page in self.iter_pages(fetch_page, page_size, max_workers):
+            if page is None:
+                complete = False
+                continue
+            items.extend(page.get('data') or [])
         
-        # Tính toán số lượng bán cho từng sản phẩm
-        product_sales = {}
+        return items, complete
+    
+    def _iter_invoice_pages(self, from_date, to_date, page_size=100):
+        """Duyệt các trang hóa đơn trong khoảng thời gian, có chống lệch phân trang
         
-        for invoice in all_invoices:
-            if invoice.get('invoiceDetails'):
-                for detail in invoice['invoiceDetails']:
-                    product_id = detail.get('productId')
-                    product_name = detail.get('productName', 'Không xác định')
-                    quantity = detail.get('quantity', 0)
-                    price = detail.get('price', 0)
-                    
-                    if product_id not in product_sales:
-                        product_sales[product_id] = {
-                            'name': product_name,
-                            'total_quantity': 0,
-                            'total_revenue': 0,
-                            'invoice_count': 0
-                        }
-                    
-                    product_sales[product_id]['total_quantity'] += quantity
-                    product_sales[product_id]['total_revenue'] += quantity * price
-                    product_sales[product_id]['invoice_count'] += 1
+        Hóa đơn bị sửa trong lúc đang phân trang theo currentItem làm các bản ghi dịch chỗ:
+        có hóa đơn bị trả về hai lần, có hóa đơn bị bỏ sót. DriftGuard bỏ bản trùng; hóa đơn
+        mới làm `total` tăng thì đi tiếp tới cuối mới, `total` giảm thì tải lại riêng các trang
+        ngay trước chỗ giảm. Chỉ khi vẫn thiếu so với `total` mới duyệt lại cả cửa sổ
+        (tối đa DRIFT_MAX_PASSES lượt).
+        """
+        guard = DriftGuard(page_size)
+        fetch_page = lambda current_item: self.get_invoices(from_date, to_date, page_size, current_item)
         
-        # Sắp xếp theo số lượng bán
-        sorted_products = sorted(
-            product_sales.items(),
-            key=lambda x: x[1]['total_quantity'],
-            reverse=True
-        )
+        for attempt in range(1 + self.drift_max_passes):
+            guard.start_pass()
+            for index, page in enumerate(self.iter_pages(fetch_page, page_size)):
+                if page is None:
+                    # Trang lỗi đã làm kết quả thiếu, duyệt lại cũng không bù được
+                    yield None
+                    return
+                
+                yield guard.filter(page, index * page_size)
+                
+                # Lượt bù chỉ cần chạy đến khi đủ số hóa đơn
+                if attempt and guard.complete():
+                    return
+            
+            # Hóa đơn mới được thêm vào cuối trong lúc duyệt: đi tiếp tới cuối mới
+            while guard.next_offset is not None:
+                offset = guard.next_offset
+                page = fetch_page(offset)
+                if page is None:
+                    yield None
+                    return
+                yield guard.filter(page, offset)
+            
+            gaps = guard.take_gaps()
+            if gaps:
+                logger.warning(f"⚠️ Lệch phân trang: {guard.describe()}, tải lại {len(gaps)} trang quanh chỗ thiếu...")
+            for offset in gaps:
+                page = fetch_page(offset)
+                if page is None:
+                    yield None
+                    return
+                yield guard.filter(page)
+            
+            if guard.complete():
+                return
+            
+            if attempt < self.drift_max_passes:
+                logger.warning(f"⚠️ Lệch phân trang: {guard.describe()}, duyệt lại để lấp chỗ trống...")
         
-        # Sắp xếp theo số lượng hóa đơn
-        sorted_products_by_invoice = sorted(
-            product_sales.items(),
-            key=lambda x: x[1]['invoice_count'],
-            reverse=True
-        )
+        logger.warning(f"⚠️ Vẫn lệch phân trang sau {1 + self.drift_max_passes} lượt duyệt: {guard.describe()}")
+        yield None
+    
+    @staticmethod
+    def split_period(from_date, to_date, window='month'):
+        """Chia khoảng thời gian thành các cửa sổ độc lập theo 'month' hoặc 'day'
         
-        # Lấy top N sản phẩm
-        top_products = sorted_products[:top_n]
+        Mỗi cửa sổ là cặp (from_date, to_date) theo cùng quy ước với get_invoices
+        (to_date là ngày cuối, tính đến 23:59:59).
+        """
+        windows = []
+        start = from_date
+        while start.date() <= to_date.date():
+            if window == 'day':
+                end = datetime(start.year, start.month, start.day)
+            elif start.month == 12:
+                end = datetime(start.year + 1, 1, 1) - timedelta(days=1)
+            else:
+                end = datetime(start.year, start.month + 1, 1) - timedelta(days=1)
+            end = min(end, datetime(to_date.year, to_date.month, to_date.day))
+            windows.append((start, end))
+            start = end + timedelta(days=1)
+        return windows
+    
+    def _sync_window(self, from_date, to_date):
+        """Đồng bộ một cửa sổ thời gian, trả về 'cached', 'synced' hoặc 'failed'"""
+        period_end = to_date.replace(hour=23, minute=59, second=59)
+        state = self.invoice_store.get_sync_state(from_date, to_date)
         
-        # Hiển thị kết quả
-        if month:
-            period_text = f"THÁNG {month}/{year}"
+        # Cửa sổ đã đóng và đã đồng bộ sau khi kết thúc: không còn gì để tải
+        if state and state['synced_at'] > period_end:
+            return 'cached'
+        
+        modified_from = state['watermark'] if state else from_date
+        if state:
+            logger.info(f"🔄 Đồng bộ hóa đơn thay đổi từ {modified_from.strftime('%d/%m/%Y %H:%M:%S')}")
+        
+        synced_at = datetime.now()
+        watermark = modified_from
+        complete = True
+        
+        # get_invoices đã ghi từng trang vào kho, ở đây chỉ cần tính mốc mới
+        for page in self._iter_invoice_pages(modified_from, to_date):
+            if page is None:
+                complete = False
+                continue
+            for invoice in page.get('data') or []:
+                modified_date = invoice_modified_date(invoice)
+                if modified_date:
+                    watermark = max(watermark, datetime.strptime(modified_date, DATETIME_FORMAT))
+        
+        if not complete:
+            # Không ghi checkpoint để lần sau tải lại cửa sổ này
+            return 'failed'
+        
+        self.invoice_store.set_sync_state(from_date, to_date, watermark, synced_at)
+        return 'synced'
+    
+    def sync_invoices(self, from_date, to_date):
+        """Đồng bộ tăng dần hóa đơn của một kỳ vào kho cục bộ theo mốc lastModified
+        
+        Kỳ được chia thành các cửa sổ (SYNC_WINDOW) tải song song, mỗi cửa sổ xong thì
+        ghi checkpoint vào kho. Lần chạy sau chỉ tải lại các cửa sổ còn thiếu.
+        """
+        windows = self.split_period(from_date, to_date, self.sync_window)
+        
+        if len(windows) > 1:
+            logger.info(f"🗂️ Chia kỳ thành {len(windows)} cửa sổ theo {self.sync_window}")
+        # Luồng con mang tên luồng gọi để log của luồng chạy nền (prefetch) vẫn nhận ra được
+        with ThreadPoolExecutor(max_workers=self.sync_window_concurrency, thread_name_prefix=threading.current_thread().name) as executor:
+            with self.telemetry.phase('wait'):
+                results = list(executor.map(lambda window: self._sync_window(*window), windows))
+        
+        cached = results.count('cached')
+        failed = results.count('failed')
+        if cached:
+            logger.info(f"💾 Dùng dữ liệu hóa đơn đã lưu cho {cached}/{len(windows)} cửa sổ đã đồng bộ đầy đủ")
+        if failed:
+            logger.warning(f"⚠️ Còn {failed}/{len(windows)} cửa sổ chưa đồng bộ xong, chạy lại để tải tiếp phần còn thiếu")
+            self._record_fetch_failure()
+            return False
+        return True
+    
+    def iter_invoices(self, from_date, to_date):
+        """Duyệt lần lượt từng hóa đơn trong khoảng thời gian (generator, không giữ cả kỳ trong bộ nhớ)"""
+        if self.invoice_store:
+            self.sync_invoices(from_date, to_date)
+            yield from self.invoice_store.iter_invoices(from_date, to_date)
+            return
+        
+        # Không có kho thì tải lần lượt từng cửa sổ, tránh currentItem quá sâu
+        for window_from, window_to in self.split_period(from_date, to_date, self.sync_window):
+            for page in self._iter_invoice_pages(window_from, window_to):
+                if page is None:
+                    logger.warning("⚠️ Một trang hóa đơn vẫn lỗi sau khi thử lại, kết quả có thể thiếu dữ liệu")
+                    self._record_fetch_failure()
+                    continue
+                yield from page.get('data') or []
+    
+    def get_all_invoices(self, from_date, to_date):
+        """Lấy tất cả hóa đơn trong khoảng thời gian (qua kho cục bộ nếu CACHE_ENABLED)"""
+        return list(self.iter_invoices(from_date, to_date))
+    
+    def sync_products(self, force=False):
+        """Đồng bộ danh mục sản phẩm (giá vốn, tồn kho) vào catalog cục bộ
+        
+        Lần đầu tải toàn bộ /products song song, các lần sau chỉ tải sản phẩm thay đổi từ
+        mốc modifiedDate lần trước. Trong PRODUCT_CATALOG_TTL giây sau lần đồng bộ gần nhất
+        thì dùng luôn danh mục đã lưu, không gọi API.
+        """
+        state = self.product_catalog.get_sync_state()
+        if state and not force and (datetime.now() - state['synced_at']).total_seconds() < self.product_catalog_ttl:
+            return True
+        
+        modified_from = state['watermark'] if state else None
+        if modified_from:
+            logger.info(f"🔄 Đồng bộ sản phẩm thay đổi từ {modified_from.strftime('%d/%m/%Y %H:%M:%S')}")
         else:
-            period_text = f"NĂM {year}"
-            
-        print(f"\n🏆 TOP {top_n} SẢN PHẨM BÁN CHẠY NHẤT {period_text}")
-        print("=" * 80)
+            logger.info("📦 Đang tải danh mục sản phẩm...")
         
-        for i, (product_id, data) in enumerate(top_products, 1):
-            print(f"{i:2d}. {data['name'][:50]}")
-            print(f"    📦 Số lượng bán: {data['total_quantity']:,}")
-            print(f"    💰 Doanh thu: {data['total_revenue']:,.0f} VNĐ")
-            print(f"    📋 Số hóa đơn: {data['invoice_count']}")
-            print("-" * 60)
+        synced_at = datetime.now()
+        watermark = modified_from or datetime(2000, 1, 1)
+        complete = True
+        changed = 0
         
-        return top_products
+        for page in self.iter_pages(lambda current_item: self.get_products(100, current_item, modified_from)):
+            if page is None:
+                complete = False
+                continue
+            products = page.get('data') or []
+            changed += self.product_catalog.save_products(products, page.get('removeId') or [])
+            for product in products:
+                modified_date = (product.get('modifiedDate') or product.get('createdDate') or '')[:19]
+                if modified_date:
+                    watermark = max(watermark, datetime.strptime(modified_date, DATETIME_FORMAT))
+        
+        logger.info(f"📦 Danh mục có {len(self.product_catalog)} sản phẩm ({changed} thay đổi)")
+        if not complete:
+            # Không ghi mốc để lần sau tải lại phần còn thiếu
+            logger.warning("⚠️ Danh mục sản phẩm chưa tải đủ, giá vốn/tồn kho có thể thiếu")
+            self._record_fetch_failure()
+            return False
+        
+        self.product_catalog.set_sync_state(watermark, synced_at)
+        return True
     
-    def get_top_products_by_revenue(self, month=None, year=2025, top_n=10):
-        """Lấy top sản phẩm mang lại doanh thu/lợi nhuận nhiều nhất trong tháng hoặc năm"""
+    @staticmethod
+    def get_period(month=None, year=2025):
+        """Tính khoảng thời gian (from_date, to_date) của một tháng hoặc cả năm"""
         if month:
-            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm mang lại doanh thu nhiều nhất tháng {month}/{year}...")
-            # Tính toán khoảng thời gian cho tháng
             from_date = datetime(year, month, 1)
             if month == 12:
                 to_date = datetime(year + 1, 1, 1) - timedelta(days=1)
             else:
                 to_date = datetime(year, month + 1, 1) - timedelta(days=1)
         else:
-            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm mang lại doanh thu nhiều nhất năm {year}...")
-            # Tính toán khoảng thời gian cho cả năm
             from_date = datetime(year, 1, 1)
             to_date = datetime(year, 12, 31)
+        return from_date, to_date
+    
+    @staticmethod
+    def get_period_text(month=None, year=2025):
+        """Tên kỳ báo cáo để hiển thị"""
+        if month:
+            return f"THÁNG {month}/{year}"
+        return f"NĂM {year}"
+    
+    def _sales_table_lock(self, key):
+        """Khóa riêng cho từng kỳ: luồng hỏi và luồng prefetch không tải cùng một kỳ hai lần"""
+        with self._sales_table_locks_lock:
+            return self._sales_table_locks.setdefault(key, threading.Lock())
+    
+    def get_product_sales(self, from_date, to_date, refresh=False):
+        """Lấy bảng tổng hợp theo sản phẩm của một kỳ (tải và tổng hợp một lần cho mọi bảng xếp hạng)
         
-        print(f"📅 Từ ngày: {from_date.strftime('%d/%m/%Y')}")
-        print(f"📅 Đến ngày: {to_date.strftime('%d/%m/%Y')}")
-        
-        # Lấy tất cả hóa đơn trong khoảng thời gian
-        all_invoices = []
-        current_item = 0
-        page_size = 100
+        refresh=True: bỏ qua bảng đã tính và tính lại (prefetch dùng để làm mới kỳ đang diễn ra).
+        """
+        key = (from_date, to_date)
+        closed = to_date.date() < datetime.now().date()
         
-        while True:
-            print(f"📄 Đang tải hóa đơn... (trang {current_item//page_size + 1})")
-            invoices_data = self.get_invoices(from_date, to_date, page_size, current_item)
+        with self._sales_table_lock(key):
+            entry = self._sales_tables.get(key)
+            if entry is not None and not refresh:
+                table, computed_at = entry
+                if closed or time.time() - computed_at < self.warm_table_max_age:
+                    logger.info("💾 Dùng bảng tổng hợp đã tính cho kỳ này")
+                    return table
             
-            if not invoices_data or not invoices_data.get('data'):
-                break
+            logger.info(f"📅 Từ ngày: {from_date.strftime('%d/%m/%Y')}")
+            logger.info(f"📅 Đến ngày: {to_date.strftime('%d/%m/%Y')}")
             
-            all_invoices.extend(invoices_data['data'])
+            failures = self.fetch_failures()
+            if self.invoice_store:
+                # Đồng bộ phần thay đổi rồi cộng các tổng hợp theo ngày, không duyệt lại hóa đơn gốc
+                self.sync_invoices(from_date, to_date)
+                with self.telemetry.phase('aggregate'):
+                    table = self.invoice_store.get_sales_table(from_date, to_date)
+                logger.info(f"📊 Tổng hợp từ {table.invoice_total} hóa đơn đã lưu")
+            else:
+                # Chuyển hóa đơn sang dạng cột trong lúc tải, rồi tổng hợp bằng group-by vector hóa
+                with self.telemetry.phase('aggregate'):
+                    lines = InvoiceLines.from_invoices(self.iter_invoices(from_date, to_date))
+                    logger.info(f"📊 Đã tải {lines.invoice_total} hóa đơn ({len(lines)} dòng chi tiết)")
+                    table = lines.to_sales_table()
             
-            # Kiểm tra xem còn dữ liệu không
-            if len(invoices_data['data']) < page_size:
-                break
+            # Bảng tính từ dữ liệu thiếu không được giữ, lần hỏi sau tải lại phần còn thiếu.
+            # Kỳ đang diễn ra chỉ được giữ khi có prefetch làm mới định kỳ
+            if self.fetch_failures() != failures:
+                self._sales_tables.pop(key, None)
+            elif closed or self.warm_table_max_age:
+                self._sales_tables[key] = (table, time.time())
             
-            current_item += page_size
+            return table
+    
+    def export_snapshot(self, path, month=None, year=2025, compress=False):
+        """Tải hóa đơn của một kỳ và ghi các dòng chi tiết ra file snapshot dạng cột, trả về số byte
         
-        print(f"📊 Đã tải {len(all_invoices)} hóa đơn")
+        Mở lại bằng snapshot.read_snapshot để phân tích mà không cần gọi API hay parse JSON.
+        """
+        from_date, to_date = self.get_period(month, year)
+        if to_date.date() >= datetime.now().date():
+            logger.warning(f"⚠️ {self.get_period_text(month, year)} chưa kết thúc, snapshot sẽ thiếu hóa đơn phát sinh sau này")
         
-        # Tính toán doanh thu cho từng sản phẩm
-        product_sales = {}
+        with self.telemetry.phase('aggregate'):
+            lines = InvoiceLines.from_invoices(self.iter_invoices(from_date, to_date))
+        logger.info(f"📊 Đã tải {lines.invoice_total} hóa đơn ({len(lines)} dòng chi tiết)")
         
-        for invoice in all_invoices:
-            if invoice.get('invoiceDetails'):
-                for detail in invoice['invoiceDetails']:
-                    product_id = detail.get('productId')
-                    product_name = detail.get('productName', 'Không xác định')
-                    quantity = detail.get('quantity', 0)
-                    price = detail.get('price', 0)
-                    
-                    if product_id not in product_sales:
-                        product_sales[product_id] = {
-                            'name': product_name,
-                            'total_quantity': 0,
-                            'total_revenue': 0,
-                            'invoice_count': 0
-                        }
-                    
-                    product_sales[product_id]['total_quantity'] += quantity
-                    product_sales[product_id]['total_revenue'] += quantity * price
-                    product_sales[product_id]['invoice_count'] += 1
+        with self.telemetry.phase('store'):
+            return write_snapshot(path, lines, {
+                'retailer': self.retailer,
+                'period': self.get_period_text(month, year),
+                'from_date': from_date.strftime(DATETIME_FORMAT),
+                'to_date': to_date.strftime(DATETIME_FORMAT),
+                'created_at': datetime.now().strftime(DATETIME_FORMAT)
+            }, compress=compress)
+    
+    def start_prefetch(self, periods=(), interval=None, max_periods=None):
+        """Bật luồng nền giữ sẵn tháng hiện tại, các kỳ (month, year) trong periods và các kỳ vừa hỏi"""
+        if self.prefetcher is None:
+            interval = interval or Config.PREFETCH_INTERVAL
+            # Cho phép trễ một lượt làm mới (lượt làm mới có thể mất vài giây)
+            self.warm_table_max_age = 2 * interval
+            self.prefetcher = PrefetchWorker(self, interval, max_periods or Config.PREFETCH_MAX_PERIODS)
+            for month, year in periods:
+                self.prefetcher.track(month, year)
+            self.prefetcher.start()
+        return self.prefetcher
+    
+    def _get_period_sales(self, month, year):
+        """Bảng tổng hợp theo sản phẩm của một tháng hoặc cả năm"""
+        from_date, to_date = self.get_period(month, year)
+        return self.get_product_sales(from_date, to_date)
+    
+    def get_product_sales_with_catalog(self, from_date, to_date):
+        """Bảng tổng hợp theo sản phẩm đã ghép danh mục: có thêm giá vốn, lợi nhuận, tồn kho"""
+        table = self.get_product_sales(from_date, to_date)
+        self.sync_products()
+        with self.telemetry.phase('aggregate'):
+            return self.product_catalog.join_sales_table(table)
+    
+    def get_top_selling_products(self, month=None, year=2025, top_n=10, approximate=False):
+        """Lấy top sản phẩm bán chạy nhất trong tháng hoặc năm"""
+        if approximate:
+            return self.get_top_products_approximate('total_quantity', month, year, top_n)
         
-        # Sắp xếp theo doanh thu
-        sorted_products_by_revenue = sorted(
-            product_sales.items(),
-            key=lambda x: x[1]['total_revenue'],
-            reverse=True
-        )
+        if month:
+            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm bán chạy nhất tháng {month}/{year}...")
+        else:
+            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm bán chạy nhất năm {year}...")
         
-        # Lấy top N sản phẩm
-        top_products = sorted_products_by_revenue[:top_n]
+        # Sắp xếp theo số lượng bán
+        started = self.telemetry.start_report()
+        top_products = self._get_period_sales(month, year).top('total_quantity', top_n)
         
         # Hiển thị kết quả
+        with self.telemetry.phase('render'):
+            self._print_top_selling_products(top_products, month, year, top_n)
+        logger.info(self.telemetry.format_breakdown(started))
+        
+        return top_products
+    
+    def get_top_products_by_revenue(self, month=None, year=2025, top_n=10, approximate=False):
+        """Lấy top sản phẩm mang lại doanh thu nhiều nhất trong tháng hoặc năm"""
+        if approximate:
+            return self.get_top_products_approximate('total_revenue', month, year, top_n)
+        
         if month:
-            period_text = f"THÁNG {month}/{year}"
+            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm mang lại doanh thu nhiều nhất tháng {month}/{year}...")
         else:
-            period_text = f"NĂM {year}"
-            
-        print(f"\n🏆 TOP {top_n} SẢN PHẨM MANG LẠI DOANH THU NHIỀU NHẤT {period_text}")
-        print("=" * 80)
-        
-        total_revenue = sum(data['total_revenue'] for _, data in top_products)
+            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm mang lại doanh thu nhiều nhất năm {year}...")
         
-        for i, (product_id, data) in enumerate(top_products, 1):
-            revenue_percent = (data['total_revenue'] / total_revenue * 100) if total_revenue > 0 else 0
-            avg_price = data['total_revenue'] / data['total_quantity'] if data['total_quantity'] > 0 else 0
-            
-            print(f"{i:2d}. {data['name'][:50]}")
-            print(f"    💰 Doanh thu: {data['total_revenue']:,.0f} VNĐ ({revenue_percent:.1f}%)")
-            print(f"    📦 Tổng số lượng bán: {data['total_quantity']:,}")
-            print(f"    📋 Số đơn hàng: {data['invoice_count']}")
-            print(f"    💵 Giá trung bình: {avg_price:,.0f} VNĐ/sản phẩm")
-            print("-" * 60)
+        # Sắp xếp theo doanh thu
+        started = self.telemetry.start_report()
+        top_products = self._get_period_sales(month, year).top('total_revenue', top_n)
         
-        print(f"\n📈 Tổng doanh thu top {top_n}: {total_revenue:,.0f} VNĐ")
+        # Hiển thị kết quả
+        with self.telemetry.phase('render'):
+            self._print_top_products_by_revenue(top_products, month, year, top_n)
+        logger.info(self.telemetry.format_breakdown(started))
         
         return top_products
     
-    def get_top_products_by_invoice_count(self, month=None, year=2025, top_n=10):
+    def get_top_products_by_invoice_count(self, month=None, year=2025, top_n=10, approximate=False):
         """Lấy top sản phẩm có nhiều đơn hàng nhất trong tháng hoặc năm"""
+        if approximate:
+            return self.get_top_products_approximate('invoice_count', month, year, top_n)
+        
         if month:
             print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm có nhiều đơn hàng nhất tháng {month}/{year}...")
-            # Tính toán khoảng thời gian cho tháng
-            from_date = datetime(year, month, 1)
-            if month == 12:
-                to_date = datetime(year + 1, 1, 1) - timedelta(days=1)
-            else:
-                to_date = datetime(year, month + 1, 1) - timedelta(days=1)
         else:
             print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm có nhiều đơn hàng nhất năm {year}...")
-            # Tính toán khoảng thời gian cho cả năm
-            from_date = datetime(year, 1, 1)
-            to_date = datetime(year, 12, 31)
         
-        print(f"📅 Từ ngày: {from_date.strftime('%d/%m/%Y')}")
-        print(f"📅 Đến ngày: {to_date.strftime('%d/%m/%Y')}")
+        # Sắp xếp theo số lượng hóa đơn
+        started = self.telemetry.start_report()
+        top_products = self._get_period_sales(month, year).top('invoice_count', top_n)
         
-        # Lấy tất cả hóa đơn trong khoảng thời gian
-        all_invoices = []
-        current_item = 0
-        page_size = 100
+        # Hiển thị kết quả
+        with self.telemetry.phase('render'):
+            self._print_top_products_by_invoice_count(top_products, month, year, top_n)
+        logger.info(self.telemetry.format_breakdown(started))
         
-        while True:
-            print(f"📄 Đang tải hóa đơn... (trang {current_item//page_size + 1})")
-            invoices_data = self.get_invoices(from_date, to_date, page_size, current_item)
-            
-            if not invoices_data or not invoices_data.get('data'):
-                break
-            
-            all_invoices.extend(invoices_data['data'])
-            
-            # Kiểm tra xem còn dữ liệu không
-            if len(invoices_data['data']) < page_size:
-                break
-            
-            current_item += page_size
+        return top_products
+    
+    def get_top_products_by_profit(self, month=None, year=2025, top_n=10):
+        """Lấy top sản phẩm mang lại lợi nhuận (doanh thu - giá vốn) nhiều nhất trong tháng hoặc năm"""
+        if month:
+            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm mang lại lợi nhuận nhiều nhất tháng {month}/{year}...")
+        else:
+            print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm mang lại lợi nhuận nhiều nhất năm {year}...")
         
-        print(f"📊 Đã tải {len(all_invoices)} hóa đơn")
+        # Sắp xếp theo lợi nhuận, dùng giá vốn trong danh mục sản phẩm
+        started = self.telemetry.start_report()
+        from_date, to_date = self.get_period(month, year)
+        top_products = self.get_product_sales_with_catalog(from_date, to_date).top('total_profit', top_n)
         
-        # Tính toán số lượng đơn hàng cho từng sản phẩm
-        product_sales = {}
+        # Hiển thị kết quả
+        with self.telemetry.phase('render'):
+            self._print_top_products_by_profit(top_products, month, year, top_n)
+        logger.info(self.telemetry.format_breakdown(started))
         
-        for invoice in all_invoices:
-            if invoice.get('invoiceDetails'):
-                for detail in invoice['invoiceDetails']:
-                    product_id = detail.get('productId')
-                    product_name = detail.get('productName', 'Không xác định')
-                    quantity = detail.get('quantity', 0)
-                    price = detail.get('price', 0)
-                    
-                    if product_id not in product_sales:
-                        product_sales[product_id] = {
-                            'name': product_name,
-                            'total_quantity': 0,
-                            'total_revenue': 0,
-                            'invoice_count': 0
-                        }
-                    
-                    product_sales[product_id]['total_quantity'] += quantity
-                    product_sales[product_id]['total_revenue'] += quantity * price
-                    product_sales[product_id]['invoice_count'] += 1
+        return top_products
+    
+    def get_approximate_ranking(self, metric, from_date, to_date):
+        """Duyệt hóa đơn của một kỳ vào ApproximateProductRanking (bộ nhớ cố định, không in báo cáo)"""
+        logger.info(f"📅 Từ ngày: {from_date.strftime('%d/%m/%Y')}")
+        logger.info(f"📅 Đến ngày: {to_date.strftime('%d/%m/%Y')}")
         
-        # Sắp xếp theo số lượng hóa đơn
-        sorted_products_by_invoice = sorted(
-            product_sales.items(),
-            key=lambda x: x[1]['invoice_count'],
-            reverse=True
-        )
+        with self.telemetry.phase('aggregate'):
+            ranking = ApproximateProductRanking(metric, self.approx_top_epsilon)
+            ranking.add_invoices(self.iter_invoices(from_date, to_date))
+        logger.info(f"📊 Đã duyệt {ranking.invoice_total} hóa đơn, theo dõi {len(ranking)} sản phẩm "
+                    f"(sai số tối đa {ranking.error_bound():,.0f})")
+        return ranking
+    
+    def get_top_products_approximate(self, metric='total_revenue', month=None, year=2025, top_n=10):
+        """Top sản phẩm gần đúng theo một chỉ số: duyệt luồng hóa đơn một lần trong bộ nhớ cố định
         
-        # Lấy top N sản phẩm
-        top_products = sorted_products_by_invoice[:top_n]
+        Dùng cho dashboard cần nhanh: chỉ giữ khoảng 1/APPROX_TOP_EPSILON bộ đếm thay vì bảng
+        tổng hợp của mọi sản phẩm, mỗi kết quả kèm sai số tối đa của chỉ số xếp hạng.
+        """
+        period_text = self.get_period_text(month, year).lower()
+        print(f"🔍 Đang ước lượng top {top_n} sản phẩm theo {METRIC_LABELS[metric].lower()} {period_text} "
+              f"(sai số tối đa {self.approx_top_epsilon:.2%} tổng)...")
         
-        # Hiển thị kết quả
-        if month:
-            period_text = f"THÁNG {month}/{year}"
+        started = self.telemetry.start_report()
+        from_date, to_date = self.get_period(month, year)
+        top_products = self.get_approximate_ranking(metric, from_date, to_date).top(top_n)
+        
+        with self.telemetry.phase('render'):
+            self._print_approximate_top_products(top_products, month, year, top_n, metric)
+        logger.info(self.telemetry.format_breakdown(started))
+        
+        return top_products
+    
+    def get_product_series(self, from_date, to_date, bucket='month'):
+        """Chuỗi thời gian theo sản phẩm (ngày/tuần/tháng) của cả khoảng, tải và tổng hợp một lần
+        
+        Thay cho việc gọi get_product_sales cho từng tháng: cả khoảng chỉ phân trang một lần
+        (hoặc một truy vấn trên tổng hợp theo ngày của kho), mọi bucket được cộng trong cùng lượt duyệt.
+        """
+        logger.info(f"📅 Từ ngày: {from_date.strftime('%d/%m/%Y')}")
+        logger.info(f"📅 Đến ngày: {to_date.strftime('%d/%m/%Y')}")
+        
+        if self.invoice_store:
+            self.sync_invoices(from_date, to_date)
+            with self.telemetry.phase('aggregate'):
+                rows = self.invoice_store.get_daily_sales(from_date, to_date)
+                series = ProductTimeSeries.from_daily_rows(rows, from_date, to_date, bucket)
         else:
-            period_text = f"NĂM {year}"
+            with self.telemetry.phase('aggregate'):
+                series = ProductTimeSeries.from_invoices(self.iter_invoices(from_date, to_date), from_date, to_date, bucket)
+        
+        logger.info(f"📊 Chuỗi {len(series.keys)} {bucket} cho {len(series.products)} sản phẩm")
+        return series
+    
+    def get_sales_trend(self, metric='total_quantity', year=2025, bucket='month', top_n=10, compare_previous_year=True):
+        """Xu hướng theo thời gian của top sản phẩm trong năm, kèm tăng trưởng so với kỳ trước và cùng kỳ năm trước
+        
+        compare_previous_year=True tải luôn năm trước trong cùng một lần để tính YoY.
+        Trả về (ProductTimeSeries, danh sách (product_id, data) của top N theo tổng trong năm).
+        """
+        if metric not in METRIC_LABELS:
+            raise ValueError(f"Chỉ số không hợp lệ: {metric}")
+        
+        print(f"🔍 Đang tính xu hướng {METRIC_LABELS[metric].lower()} năm {year}"
+              f"{f' (so với năm {year - 1})' if compare_previous_year else ''}...")
+        
+        started = self.telemetry.start_report()
+        from_date, to_date = self.get_period(None, year)
+        fetch_from = self.get_period(None, year - 1)[0] if compare_previous_year else from_date
+        series = self.get_product_series(fetch_from, to_date, bucket)
+        
+        # Chỉ xếp hạng và hiển thị các bucket của năm được hỏi, năm trước chỉ dùng để so sánh
+        start = series.index_of(from_date)
+        top_products = series.top(metric, top_n, start)
+        
+        with self.telemetry.phase('render'):
+            self._print_sales_trend(series, top_products, metric, year, top_n, start)
+        logger.info(self.telemetry.format_breakdown(started))
+        
+        return series, top_products
+    
+    def _print_top_selling_products(self, top_products, month, year, top_n):
+        """Hiển thị top sản phẩm bán chạy nhất"""
+        period_text = self.get_period_text(month, year)
+        print(f"\n🏆 TOP {top_n} SẢN PHẨM BÁN CHẠY NHẤT {period_text}")
+        print("=" * 80)
+        
+        for i, (product_id, data) in enumerate(top_products, 1):
+            print(f"{i:2d}. {data['name'][:50]}")
+            print(f"    📦 Số lượng bán: {data['total_quantity']:,}")
+            print(f"    💰 Doanh thu: {data['total_revenue']:,.0f} VNĐ")
+            print(f"    📋 Số hóa đơn: {data['invoice_count']}")
+            print("-" * 60)
+    
+    def _print_top_products_by_revenue(self, top_products, month, year, top_n):
+        """Hiển thị top sản phẩm mang lại doanh thu nhiều nhất"""
+        period_text = self.get_period_text(month, year)
+        print(f"\n🏆 TOP {top_n} SẢN PHẨM MANG LẠI DOANH THU NHIỀU NHẤT {period_text}")
+        print("=" * 80)
+        
+        total_revenue = sum(data['total_revenue'] for _, data in top_products)
+        
+        for i, (product_id, data) in enumerate(top_products, 1):
+            revenue_percent = (data['total_revenue'] / total_revenue * 100) if total_revenue > 0 else 0
+            avg_price = data['total_revenue'] / data['total_quantity'] if data['total_quantity'] > 0 else 0
             
+            print(f"{i:2d}. {data['name'][:50]}")
+            print(f"    💰 Doanh thu: {data['total_revenue']:,.0f} VNĐ ({revenue_percent:.1f}%)")
+            print(f"    📦 Tổng số lượng bán: {data['total_quantity']:,}")
+            print(f"    📋 Số đơn hàng: {data['invoice_count']}")
+            print(f"    💵 Giá trung bình: {avg_price:,.0f} VNĐ/sản phẩm")
+            print("-" * 60)
+        
+        print(f"\n📈 Tổng doanh thu top {top_n}: {total_revenue:,.0f} VNĐ")
+    
+    def _print_top_products_by_invoice_count(self, top_products, month, year, top_n):
+        """Hiển thị top sản phẩm có nhiều đơn hàng nhất"""
+        period_text = self.get_period_text(month, year)
         print(f"\n🏆 TOP {top_n} SẢN PHẨM CÓ NHIỀU ĐƠN HÀNG NHẤT {period_text}")
         print("=" * 80)
         
@@ -409,12 +893,95 @@ class KiotVietAPI:
             print(f"    📦 Tổng số lượng bán: {data['total_quantity']:,}")
             print(f"    💰 Doanh thu: {data['total_revenue']:,.0f} VNĐ")
             print("-" * 60)
+    
+    def _print_top_products_by_profit(self, top_products, month, year, top_n):
+        """Hiển thị top sản phẩm mang lại lợi nhuận nhiều nhất, kèm tồn kho"""
+        period_text = self.get_period_text(month, year)
+        print(f"\n🏆 TOP {top_n} SẢN PHẨM MANG LẠI LỢI NHUẬN NHIỀU NHẤT {period_text}")
+        print("=" * 80)
         
-        return top_products
+        # Số ngày đã bán trong kỳ, để ước lượng tồn kho còn đủ bán bao lâu
+        from_date, to_date = self.get_period(month, year)
+        period_days = max((min(to_date, datetime.now()) - from_date).days + 1, 1)
+        
+        for i, (product_id, data) in enumerate(top_products, 1):
+            margin = (data['total_profit'] / data['total_revenue'] * 100) if data['total_revenue'] > 0 else 0
+            daily_quantity = data['total_quantity'] / period_days
+            
+            print(f"{i:2d}. {data['name'][:50]}")
+            if data['cost'] is None:
+                print(f"    💵 Lợi nhuận: {data['total_profit']:,.0f} VNĐ (chưa có giá vốn)")
+            else:
+                print(f"    💵 Lợi nhuận: {data['total_profit']:,.0f} VNĐ (biên lợi nhuận {margin:.1f}%)")
+            print(f"    💰 Doanh thu: {data['total_revenue']:,.0f} VNĐ")
+            print(f"    📦 Số lượng bán: {data['total_quantity']:,}")
+            if daily_quantity > 0:
+                print(f"    🏬 Tồn kho: {data['on_hand']:,} (đủ bán khoảng {data['on_hand'] / daily_quantity:,.0f} ngày)")
+            else:
+                print(f"    🏬 Tồn kho: {data['on_hand']:,}")
+            print("-" * 60)
     
-    def answer_question(self, question):
-        """Trả lời câu hỏi về dữ liệu"""
-        print(f"❓ Câu hỏi: {question}")
+    def _print_approximate_top_products(self, top_products, month, year, top_n, metric):
+        """Hiển thị top sản phẩm gần đúng kèm sai số của chỉ số xếp hạng"""
+        period_text = self.get_period_text(month, year)
+        print(f"\n🏆 TOP {top_n} SẢN PHẨM THEO {METRIC_LABELS[metric]} {period_text} (GẦN ĐÚNG)")
+        print("=" * 80)
+        
+        for i, (product_id, data) in enumerate(top_products, 1):
+            error = f" (sai số ≤ {data['error']:,.0f})" if data['error'] else ""
+            values = {
+                'total_quantity': f"{data['total_quantity']:,}",
+                'total_revenue': f"{data['total_revenue']:,.0f} VNĐ",
+                'invoice_count': f"{data['invoice_count']}"
+            }
+            values[metric] = f"{'≈ ' if data['error'] else ''}{values[metric]}{error}"
+            
+            print(f"{i:2d}. {'✅' if data['guaranteed'] else '❔'} {data['name'][:50]}")
+            print(f"    📦 Số lượng bán: {values['total_quantity']}")
+            print(f"    💰 Doanh thu: {values['total_revenue']}")
+            print(f"    📋 Số hóa đơn: {values['invoice_count']}")
+            print("-" * 60)
+        
+        print("\nℹ️ ✅ chắc chắn thuộc top, ❔ có thể đổi chỗ với sản phẩm khác trong phạm vi sai số")
+        print("ℹ️ Các chỉ số phụ tính từ lúc sản phẩm được theo dõi, có thể thấp hơn thực tế")
+    
+    def _print_sales_trend(self, series, top_products, metric, year, top_n, start):
+        """Hiển thị chuỗi theo từng bucket của top sản phẩm, kèm % so với kỳ trước và cùng kỳ năm trước"""
+        bucket_labels = {'day': 'NGÀY', 'week': 'TUẦN', 'month': 'THÁNG'}
+        print(f"\n📈 XU HƯỚNG {METRIC_LABELS[metric]} THEO {bucket_labels[series.bucket]} NĂM {year} - TOP {top_n} SẢN PHẨM")
+        print("=" * 80)
+        
+        def format_value(value):
+            return f"{value:,.0f} VNĐ" if metric == 'total_revenue' else f"{value:,}"
+        
+        def format_change(label, percent):
+            return f"  {label} {percent:+.1f}%" if percent is not None else f"  {label}    -"
+        
+        for i, (product_id, data) in enumerate(top_products, 1):
+            values = data[metric]
+            growth = series.growth(values)
+            yoy = series.yoy(values)
+            total = sum(values[start:])
+            previous_total = sum(values[:start])
+            
+            print(f"{i:2d}. {data['name'][:50]}")
+            if start:
+                change = percent_change(total, previous_total)
+                change_text = f" ({change:+.1f}% so với năm {year - 1})" if change is not None else ""
+                print(f"    📊 Tổng năm: {format_value(as_number(total))}{change_text}")
+            else:
+                print(f"    📊 Tổng năm: {format_value(as_number(total))}")
+            
+            for key, value, value_growth, value_yoy in islice(zip(series.keys, values, growth, yoy), start, None):
+                line = f"    {key:>10}: {format_value(value):>18}{format_change('kỳ trước', value_growth)}"
+                if start:
+                    line += format_change('cùng kỳ', value_yoy[1] if value_yoy else None)
+                print(line)
+            print("-" * 60)
+    
+    @staticmethod
+    def parse_question(question):
+        """Phân tích câu hỏi thành ReportQuery (metric, month, year, top_n), None nếu không hiểu"""
         question_lower = question.lower()
         
         # Phân tích câu hỏi để xác định loại thống kê
@@ -423,66 +990,132 @@ class KiotVietAPI:
             'số đơn', 'số hóa đơn', 'xuất hiện nhiều'
         ])
         
+        is_profit_query = any(phrase in question_lower for phrase in [
+            'lợi nhuận', 'profit', 'sinh lời', 'tiền lãi', 'lãi nhiều', 'lãi cao'
+        ])
+        
+        is_approximate_query = any(phrase in question_lower for phrase in [
+            'ước lượng', 'ước tính', 'gần đúng', 'xấp xỉ', 'approx'
+        ])
+        
         is_revenue_query = any(phrase in question_lower for phrase in [
-            'doanh thu', 'lợi nhuận', 'thu nhập', 'tiền', 'revenue', 'profit',
-            'mang lại nhiều', 'kiếm được nhiều', 'sinh lời'
+            'doanh thu', 'thu nhập', 'tiền', 'revenue',
+            'mang lại nhiều', 'kiếm được nhiều'
         ])
         
-        if "top" in question_lower:
-            # Tìm số lượng top
-            import re
-            numbers = re.findall(r'\d+', question)
-            top_n = int(numbers[0]) if numbers else 10
-            
-            # Kiểm tra xem là tháng hay năm
-            if "năm" in question_lower:
-                # Tìm năm
-                year_match = re.search(r'năm (\d{4})', question_lower)
-                year = int(year_match.group(1)) if year_match else 2024
-                
-                if is_invoice_count_query:
-                    return self.get_top_products_by_invoice_count(month=None, year=year, top_n=top_n)
-                elif is_revenue_query:
-                    return self.get_top_products_by_revenue(month=None, year=year, top_n=top_n)
-                else:
-                    return self.get_top_selling_products(month=None, year=year, top_n=top_n)
-            
-            elif "tháng" in question_lower:
-                # Tìm tháng
-                if "tháng 8" in question_lower:
-                    month = 8
-                else:
-                    month_match = re.search(r'tháng (\d+)', question_lower)
-                    month = int(month_match.group(1)) if month_match else 8
-                
-                # Tìm năm (nếu có)
-                year_match = re.search(r'(\d{4})', question_lower)
-                year = int(year_match.group(1)) if year_match else 2025
-                
-                if is_invoice_count_query:
-                    return self.get_top_products_by_invoice_count(month=month, year=year, top_n=top_n)
-                elif is_revenue_query:
-                    return self.get_top_products_by_revenue(month=month, year=year, top_n=top_n)
-                else:
-                    return self.get_top_selling_products(month=month, year=year, top_n=top_n)
-            
+        if "top" not in question_lower:
+            return None
+        
+        if is_invoice_count_query:
+            metric = 'invoice_count'
+        elif is_profit_query:
+            metric = 'total_profit'
+        elif is_revenue_query:
+            metric = 'total_revenue'
+        else:
+            metric = 'total_quantity'
+        
+        # Lợi nhuận cần ghép danh mục sản phẩm nên chỉ có bản chính xác
+        approximate = is_approximate_query and metric in APPROX_METRICS
+        
+        # Tìm số lượng top
+        numbers = re.findall(r'\d+', question)
+        top_n = int(numbers[0]) if numbers else 10
+        
+        # Kiểm tra xem là tháng hay năm
+        if "năm" in question_lower:
+            # Tìm năm
+            year_match = re.search(r'năm (\d{4})', question_lower)
+            year = int(year_match.group(1)) if year_match else 2024
+            return ReportQuery(metric, None, year, top_n, approximate)
+        
+        elif "tháng" in question_lower:
+            # Tìm tháng
+            if "tháng 8" in question_lower:
+                month = 8
             else:
-                # Mặc định là tháng hiện tại
-                if is_invoice_count_query:
-                    return self.get_top_products_by_invoice_count(month=8, year=2025, top_n=top_n)
-                elif is_revenue_query:
-                    return self.get_top_products_by_revenue(month=8, year=2025, top_n=top_n)
-                else:
-                    return self.get_top_selling_products(month=8, year=2025, top_n=top_n)
+                month_match = re.search(r'tháng (\d+)', question_lower)
+                month = int(month_match.group(1)) if month_match else 8
+            
+            # Tìm năm (nếu có)
+            year_match = re.search(r'(\d{4})', question_lower)
+            year = int(year_match.group(1)) if year_match else 2025
+            return ReportQuery(metric, month, year, top_n, approximate)
+        
+        # Mặc định là tháng hiện tại
+        return ReportQuery(metric, 8, 2025, top_n, approximate)
+    
+    def run_query(self, query):
+        """Chạy một ReportQuery, dùng kết quả đã lưu trong cache nếu có"""
+        report, printer = {
+            'total_quantity': (self.get_top_selling_products, self._print_top_selling_products),
+            'total_revenue': (self.get_top_products_by_revenue, self._print_top_products_by_revenue),
+            'invoice_count': (self.get_top_products_by_invoice_count, self._print_top_products_by_invoice_count),
+            'total_profit': (self.get_top_products_by_profit, self._print_top_products_by_profit)
+        }[query.metric]
+        if query.approximate:
+            report = lambda **kwargs: self.get_top_products_approximate(query.metric, **kwargs)
+            printer = lambda *args: self._print_approximate_top_products(*args, query.metric)
+        
+        if self.prefetcher:
+            self.prefetcher.track(query.month, query.year, catalog=query.metric == 'total_profit')
+        
+        cache_key = self.query_cache_key(query)
+        top_products = self.result_cache.get(cache_key)
+        if top_products is not None:
+            print("⚡ Trả lời từ cache")
+            with self.telemetry.phase('render'):
+                printer(top_products, query.month, query.year, query.top_n)
+            return top_products
+        
+        failures = self.fetch_failures()
+        top_products = report(month=query.month, year=query.year, top_n=query.top_n)
+        self.result_cache.set(cache_key, top_products, self.query_cache_ttl_for(query, complete=self.fetch_failures() == failures))
+        
+        return top_products
+    
+    def query_cache_key(self, query):
+        """Khóa cache kết quả của một ReportQuery (dùng chung giữa answer_question và report server)"""
+        return (self.retailer,) + tuple(query)
+    
+    def query_cache_ttl_for(self, query, complete=True):
+        """Thời gian giữ kết quả: kỳ đã kết thúc không bao giờ hết hạn, kỳ đang diễn ra giữ QUERY_CACHE_TTL giây
+        
+        Lợi nhuận dùng giá vốn hiện tại của danh mục nên luôn có hạn. Kết quả tính từ dữ liệu
+        tải thiếu (complete=False) cũng chỉ giữ QUERY_CACHE_TTL giây rồi tính lại.
+        """
+        _, to_date = self.get_period(query.month, query.year)
+        closed = to_date.date() < datetime.now().date() and query.metric != 'total_profit'
+        return None if closed and complete else self.query_cache_ttl
+    
+    def get_ranking(self, query):
+        """Tính top N của một ReportQuery mà không in báo cáo (dùng cho report server)"""
+        from_date, to_date = self.get_period(query.month, query.year)
+        if query.approximate:
+            return self.get_approximate_ranking(query.metric, from_date, to_date).top(query.top_n)
+        if query.metric == 'total_profit':
+            return self.get_product_sales_with_catalog(from_date, to_date).top(query.metric, query.top_n)
+        return self.get_product_sales(from_date, to_date).top(query.metric, query.top_n)
+    
+    def answer_question(self, question):
+        """Trả lời câu hỏi về dữ liệu"""
+        print(f"❓ Câu hỏi: {question}")
+        query = self.parse_question(question)
+        
+        if query:
+            return self.run_query(query)
         
         else:
             print("❓ Tôi chưa hiểu câu hỏi này. Hiện tại tôi có thể trả lời:")
             print("- Top X sản phẩm bán chạy nhất tháng Y (theo số lượng)")
             print("- Top X sản phẩm có nhiều đơn hàng nhất tháng Y")
-            print("- Top X sản phẩm mang lại doanh thu/lợi nhuận nhiều nhất tháng Y")
+            print("- Top X sản phẩm mang lại doanh thu nhiều nhất tháng Y")
+            print("- Top X sản phẩm mang lại lợi nhuận nhiều nhất tháng Y (doanh thu trừ giá vốn)")
             print("- Top X sản phẩm bán chạy nhất năm YYYY")
             print("- Top X sản phẩm có nhiều đơn hàng nhất năm YYYY")
-            print("- Top X sản phẩm mang lại doanh thu/lợi nhuận nhiều nhất năm YYYY")
+            print("- Top X sản phẩm mang lại doanh thu nhiều nhất năm YYYY")
+            print("- Top X sản phẩm mang lại lợi nhuận nhiều nhất năm YYYY")
+            print("- Ước lượng top X sản phẩm ... (xếp hạng gần đúng, nhanh và ít bộ nhớ hơn)")
             return None
 
 def main():
@@ -495,6 +1128,11 @@ def main():
     
     # Test kết nối
     if api.get_access_token():
+        if Config.PREFETCH_ENABLED:
+            # Giữ sẵn tháng hiện tại và kỳ của câu hỏi mặc định, làm mới trong nền
+            api.start_prefetch(periods=[(None, 2024)])
+            print(f"🔄 Đang tải sẵn dữ liệu trong nền (làm mới mỗi {Config.PREFETCH_INTERVAL}s)")
+        
         print("\n💡 Bạn có thể đặt câu hỏi như:")
         print("- Top 10 sản phẩm bán chạy nhất trong tháng 8")
         print("- Top 5 sản phẩm bán chạy nhất tháng 7")
@@ -508,6 +1146,8 @@ def main():
             question = input("❓ Nhập câu hỏi của bạn (hoặc 'quit' để thoát): ").strip()
             
             if question.lower() in ['quit', 'exit', 'thoat']:
+                if api.prefetcher:
+                    api.prefetcher.stop(timeout=5)
                 print("👋 Tạm biệt!")
                 break
             
@@ -0,0 +1,146 @@
+"""
+Aggregation Engine
+Tổng hợp số liệu bán hàng theo sản phẩm trong một lần duyệt hóa đơn
+Mọi bảng xếp hạng (số lượng, doanh thu, số đơn hàng) đều đọc từ cùng một bảng
+"""
+
+import heapq
+
+METRICS = ('total_quantity', 'total_revenue', 'invoice_count')
+
+
+class ProductSalesTable:
+    """Bảng tổng hợp theo sản phẩm: tổng số lượng, tổng doanh thu, số đơn hàng"""
+
+    # Các chỉ số có thể xếp hạng (bảng đã ghép danh mục sản phẩm có thêm lợi nhuận, tồn kho)
+    metrics = METRICS
+
+    def __init__(self):
+        self.products = {}
+        self.invoice_total = 0
+
+    def add_invoice(self, invoice):
+        """Cộng dồn các dòng chi tiết của một hóa đơn vào bảng"""
+        self.invoice_total += 1
+        if not invoice.get('invoiceDetails'):
+            return
+
+        products = self.products
+        for detail in invoice['invoiceDetails']:
+            product_id = detail.get('productId')
+            quantity = detail.get('quantity', 0)
+            price = detail.get('price', 0)
+
+            product = products.get(product_id)
+            if product is None:
+                product = products[product_id] = {
+                    'name': detail.get('productName', 'Không xác định'),
+                    'total_quantity': 0,
+                    'total_revenue': 0,
+                    'invoice_count': 0
+                }
+
+            product['total_quantity'] += quantity
+            product['total_revenue'] += quantity * price
+            product['invoice_count'] += 1
+
+    def add_invoices(self, invoices):
+        """Cộng dồn nhiều hóa đơn vào bảng"""
+        for invoice in invoices:
+            self.add_invoice(invoice)
+        return self
+
+    def top(self, metric, top_n=10):
+        """Lấy top N sản phẩm theo một chỉ số, trả về danh sách (product_id, data)"""
+        return self.rankings((metric,), top_n)[metric]
+
+    def rankings(self, metrics=METRICS, top_n=10):
+        """Lấy top N sản phẩm theo nhiều chỉ số trong một lần duyệt bảng"""
+        for metric in metrics:
+            if metric not in self.metrics:
+                raise ValueError(f"Chỉ số không hợp lệ: {metric}")
+
+        return top_n_by_keys(
+            self.products.items(),
+            {metric: self.rank_key(metric) for metric in metrics},
+            top_n
+        )
+
+    def rank_key(self, metric):
+        """Hàm lấy khóa xếp hạng của một chỉ số từ phần tử (product_id, data)"""
+        return lambda item: item[1][metric]
+
+    def __len__(self):
+        return len(self.products)
+
+
+def top_n_by_keys(items, keys, top_n):
+    """Chọn top N phần tử theo nhiều khóa trong một lần duyệt, O(n log k) thay vì sắp xếp toàn bộ
+
+    `keys` là dict {tên: hàm lấy khóa}. Kết quả mỗi khóa giống hệt
+    sorted(items, key=..., reverse=True)[:top_n], kể cả thứ tự các phần tử bằng nhau.
+    """
+    heaps = {name: [] for name in keys}
+    if top_n <= 0:
+        return heaps
+
+    key_funcs = list(keys.items())
+    for index, item in enumerate(items):
+        for name, key in key_funcs:
+            heap = heaps[name]
+            # -index: phần tử xuất hiện trước thắng khi bằng khóa (giống sort ổn định)
+            entry = (key(item), -index, item)
+            if len(heap) < top_n:
+                heapq.heappush(heap, entry)
+            elif entry[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, entry)
+
+    return {
+        name: [entry[2] for entry in sorted(heap, key=lambda entry: entry[:2], reverse=True)]
+        for name, heap in heaps.items()
+    }
+
+
+def merge_sales_tables(tables):
+    """Gộp bảng tổng hợp của nhiều cửa hàng thành một bảng chung cho cả chuỗi
+
+    `tables` là dict {tên cửa hàng: ProductSalesTable}. Mỗi retailer có id sản phẩm riêng
+    nên sản phẩm được ghép theo tên (bỏ khoảng trắng thừa, không phân biệt hoa thường).
+    Mỗi sản phẩm của bảng gộp có thêm 'shops': {tên cửa hàng: số liệu của cửa hàng đó}.
+    """
+    merged = ProductSalesTable()
+    for shop, table in tables.items():
+        merged.invoice_total += table.invoice_total
+        for data in table.products.values():
+            name = data['name']
+            key = ' '.join(str(name).split()).lower()
+
+            product = merged.products.get(key)
+            if product is None:
+                product = merged.products[key] = {
+                    'name': name,
+                    'total_quantity': 0,
+                    'total_revenue': 0,
+                    'invoice_count': 0,
+                    'shops': {}
+                }
+
+            for metric in METRICS:
+                product[metric] += data[metric]
+
+            shop_data = product['shops'].setdefault(shop, {metric: 0 for metric in METRICS})
+            for metric in METRICS:
+                shop_data[metric] += data[metric]
+
+    return merged
+
+
+def as_number(value):
+    """Đổi số thực nguyên (3.0) về int để hiển thị giống dữ liệu gốc"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def build_sales_table(invoices):
+    """Tạo bảng tổng hợp từ danh sách hóa đơn"""
+    return ProductSalesTable().add_invoices(invoices)
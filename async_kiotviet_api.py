@@ -0,0 +1,560 @@
+"""
+Async KiotViet API
+Phiên bản asyncio của KiotVietAPI (aiohttp) cho các dịch vụ tích hợp chạy trên event loop
+Giới hạn số request đồng thời, dùng chung token giữa các coroutine và trả dữ liệu phân trang
+qua async generator để một event loop tải được nhiều kỳ / nhiều endpoint cùng lúc
+
+Sử dụng:
+    async with AsyncKiotVietAPI() as api:
+        selling, revenue = await asyncio.gather(
+            api.get_top_selling_products(year=2024),
+            api.get_top_products_by_revenue(month=8, year=2025)
+        )
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from urllib.parse import urlparse
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp là tùy chọn, chỉ cần khi dùng AsyncKiotVietAPI
+    aiohttp = None
+
+from API_kiotviet_NTV import KiotVietAPI, logger
+from columnar import InvoiceLines
+from config import Config
+from fast_json import decode_invoice_page
+from invoice_store import DATETIME_FORMAT
+from pagination import DriftGuard, is_last_page, remaining_page_offsets
+from rate_limiter import RateLimiter
+from telemetry import get_shared_telemetry
+from token_manager import TokenManager
+
+# Status được thử lại với backoff (giống chính sách Retry của client đồng bộ)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Đánh dấu một cửa sổ đã tải xong trong hàng đợi trang
+_WINDOW_DONE = object()
+
+
+class AsyncKiotVietAPI:
+    # Dùng lại phần không phụ thuộc I/O của client đồng bộ
+    get_period = staticmethod(KiotVietAPI.get_period)
+    get_period_text = staticmethod(KiotVietAPI.get_period_text)
+    split_period = staticmethod(KiotVietAPI.split_period)
+    _print_top_selling_products = KiotVietAPI._print_top_selling_products
+    _print_top_products_by_revenue = KiotVietAPI._print_top_products_by_revenue
+    _print_top_products_by_invoice_count = KiotVietAPI._print_top_products_by_invoice_count
+
+    def __init__(self, max_concurrency=None):
+        if aiohttp is None:
+            raise ImportError("AsyncKiotVietAPI cần aiohttp: pip install aiohttp")
+
+        try:
+            Config.validate()
+        except ValueError as e:
+            print(f"❌ Configuration Error: {e}")
+            print("💡 Please check your .env file")
+            raise
+
+        # Thông tin kết nối từ config
+        self.retailer = Config.RETAILER
+        self.client_id = Config.CLIENT_ID
+        self.client_secret = Config.CLIENT_SECRET
+        self.base_url = Config.BASE_URL
+        self.auth_url = Config.AUTH_URL
+
+        # Số request đang bay tối đa (chung cho mọi coroutine dùng client này)
+        self.max_concurrency = max_concurrency or Config.ASYNC_MAX_CONCURRENCY
+        # Số trang được tải trước trong một lần duyệt phân trang
+        self.fetch_concurrency = Config.FETCH_CONCURRENCY
+        self.sync_window = Config.SYNC_WINDOW
+        self.sync_window_concurrency = Config.SYNC_WINDOW_CONCURRENCY
+        self.drift_max_passes = Config.DRIFT_MAX_PASSES
+
+        self.timeout = Config.HTTP_TIMEOUT
+        self.max_retries = Config.HTTP_MAX_RETRIES
+        self.backoff_factor = Config.HTTP_BACKOFF_FACTOR
+
+        # Cùng quota với client đồng bộ và các script khác của retailer
+        self.rate_limiter = RateLimiter(
+            rate=Config.RATE_LIMIT_PER_SECOND,
+            burst=Config.RATE_LIMIT_BURST,
+            state_path=Config.RATE_LIMIT_STATE_PATH or None,
+            key=self.retailer
+        )
+
+        # Token dùng chung file cache với client đồng bộ, OAuth được gọi bằng aiohttp
+        self.token_manager = TokenManager(
+            fetch_token=None,
+            cache_path=Config.TOKEN_CACHE_PATH or None,
+            cache_key=f"{self.auth_url}|{self.client_id}",
+            refresh_margin=Config.TOKEN_REFRESH_MARGIN
+        )
+
+        self.telemetry = get_shared_telemetry(Config.METRICS_EXPORT_PATH or None)
+
+        # Bảng tổng hợp của các kỳ đã kết thúc và các kỳ đang được tải (dùng chung giữa coroutine)
+        self._sales_tables = {}
+        self._sales_tasks = {}
+
+        # Tạo khi đã có event loop (lần request đầu tiên)
+        self._session = None
+        self._semaphore = None
+        self._auth_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Đóng connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        """ClientSession dùng chung với connection pool giới hạn theo max_concurrency"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._auth_lock = asyncio.Lock()
+        return self._session
+
+    def _backoff(self, attempt, retry_after=None):
+        """Thời gian chờ trước lần thử lại: ưu tiên Retry-After, không thì backoff lũy thừa"""
+        if retry_after:
+            try:
+                return max(float(retry_after), 0)
+            except ValueError:
+                pass
+        return self.backoff_factor * (2 ** attempt)
+
+    async def _acquire_rate_limit(self):
+        """Chờ token của rate limiter mà không chặn event loop"""
+        while True:
+            wait = self.rate_limiter.try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def _send(self, method, url, page=None, **kwargs):
+        """Gửi HTTP request, tự thử lại khi lỗi mạng/429/5xx, ghi telemetry
+
+        Trả về (status, body dạng bytes); lỗi mạng sau lần thử cuối được raise ra ngoài.
+        """
+        session = self._get_session()
+        endpoint = urlparse(url).path or '/'
+        started = time.perf_counter()
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire_rate_limit()
+            try:
+                async with self._semaphore:
+                    async with session.request(method, url, **kwargs) as response:
+                        body = await response.read()
+                        status = response.status
+                        retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    self.telemetry.record_request(endpoint, None, time.perf_counter() - started, 0, attempt, page)
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+
+            if status in RETRY_STATUSES and attempt < self.max_retries:
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+                continue
+            break
+
+        latency = time.perf_counter() - started
+        self.telemetry.record_request(endpoint, status, latency, len(body), attempt, page)
+        logger.debug(f"🌐 {method} {endpoint}{f' trang {page}' if page else ''}: {status}, "
+                     f"{latency:.3f}s, {len(body) / 1024:.1f}KB, thử lại {attempt} lần")
+        return status, body
+
+    @property
+    def access_token(self):
+        """Access Token hiện tại (có thể None nếu chưa xác thực)"""
+        return self.token_manager.access_token
+
+    async def get_access_token(self):
+        """Đảm bảo có Access Token còn hạn (dùng lại token đã lưu, tự làm mới khi sắp hết hạn)"""
+        return await self._get_token() is not None
+
+    async def _get_token(self):
+        """Token còn hạn; nhiều coroutine cùng cần token mới thì chỉ một coroutine gọi OAuth"""
+        if self.token_manager.is_valid():
+            return self.token_manager.access_token
+
+        self._get_session()
+        async with self._auth_lock:
+            if self.token_manager.is_valid():
+                return self.token_manager.access_token
+
+            result = await self._request_access_token()
+            if not result:
+                return None
+            self.token_manager.set_token(*result)
+            return self.token_manager.access_token
+
+    async def _request_access_token(self):
+        """Lấy Access Token mới từ KiotViet, trả về (access_token, expires_in) hoặc None"""
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+
+        data = {
+            "scopes": "PublicApi.Access",
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret
+        }
+
+        try:
+            logger.info("🔑 Đang xác thực với KiotViet API...")
+            status, body = await self._send('POST', self.auth_url, headers=headers, data=data)
+
+            logger.info(f"📡 Status Code: {status}")
+
+            if status == 200:
+                token_data = json.loads(body)
+                access_token = token_data.get("access_token")
+
+                if access_token:
+                    logger.info("✅ Đã kết nối thành công với KiotViet API")
+                    logger.info(f"🎫 Token: {access_token[:20]}...")
+                    return access_token, token_data.get("expires_in")
+                else:
+                    logger.error("❌ Không thể lấy Access Token từ response")
+                    logger.error(f"Response: {body.decode('utf-8', 'replace')}")
+                    return None
+            else:
+                logger.error(f"❌ Lỗi HTTP {status}: {body.decode('utf-8', 'replace')}")
+                return None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"❌ Lỗi kết nối: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"❌ Lỗi không xác định: {e}")
+            return None
+
+    def get_headers(self, access_token=None):
+        """Tạo headers cho API requests"""
+        return {
+            "Retailer": self.retailer,
+            "Authorization": f"Bearer {access_token or self.access_token}",
+            "Content-Type": "application/json"
+        }
+
+    async def _authorized_get(self, url, params, page=None, decode=json.loads):
+        """Gửi GET kèm token; nếu bị 401 thì xác thực lại một lần rồi gửi lại
+
+        Trả về dữ liệu đã giải mã bằng decode(body), None nếu lỗi.
+        """
+        access_token = await self._get_token()
+        if not access_token:
+            return None
+
+        try:
+            status, body = await self._send('GET', url, page=page, headers=self.get_headers(access_token), params=params)
+
+            if status == 401:
+                logger.warning("🔑 Token bị từ chối (401), đang xác thực lại...")
+                self.token_manager.invalidate(access_token)
+                access_token = await self._get_token()
+                if not access_token:
+                    return None
+                status, body = await self._send('GET', url, page=page, headers=self.get_headers(access_token), params=params)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"❌ Lỗi kết nối {urlparse(url).path}: {e}")
+            return None
+
+        if status != 200:
+            logger.error(f"❌ Lỗi HTTP {status} khi gọi {urlparse(url).path}")
+            return None
+
+        with self.telemetry.phase('decode'):
+            return decode(body)
+
+    async def get_invoices(self, from_date, to_date, page_size=100, current_item=0):
+        """Lấy danh sách hóa đơn trong khoảng thời gian"""
+        params = {
+            "lastModifiedFrom": from_date.strftime(DATETIME_FORMAT),
+            "lastModifiedTo": to_date.strftime("%Y-%m-%dT23:59:59"),
+            "pageSize": page_size,
+            "currentItem": current_item,
+            "includeInvoiceDetail": "true"
+        }
+        return await self._authorized_get(
+            f"{self.base_url}/invoices", params, page=current_item // page_size + 1,
+            decode=lambda body: decode_invoice_page(body, Config.FAST_JSON_ENABLED, Config.INVOICE_PROJECTION)
+        )
+
+    async def get_products(self, page_size=100, current_item=0):
+        """Lấy danh sách sản phẩm"""
+        params = {
+            "pageSize": page_size,
+            "currentItem": current_item,
+            "includeInventory": "true"
+        }
+        return await self._authorized_get(f"{self.base_url}/products", params, page=current_item // page_size + 1)
+
+    async def iter_pages(self, fetch_page, page_size=100):
+        """Duyệt lần lượt từng trang của một API phân trang (async generator)
+
+        Giống KiotVietAPI.iter_pages: trang đầu cho biết `total`, sau đó luôn có tối đa
+        FETCH_CONCURRENCY trang được tải trước nhưng trả về theo đúng thứ tự.
+        Trang tải lỗi được trả về là None.
+        """
+        logger.info("📄 Đang tải dữ liệu... (trang 1)")
+        first_page = await fetch_page(0)
+        yield first_page
+
+        offsets = remaining_page_offsets(first_page, page_size)
+        if offsets is None:
+            # API không trả về total: tải tuần tự cho đến trang cuối
+            current_item = page_size
+            while True:
+                logger.info(f"📄 Đang tải dữ liệu... (trang {current_item//page_size + 1})")
+                page = await fetch_page(current_item)
+                yield page
+                if is_last_page(page, page_size):
+                    return
+                current_item += page_size
+
+        if offsets:
+            logger.info(f"📄 Đang tải {len(offsets)} trang còn lại...")
+        offsets = iter(offsets)
+        pending = deque(asyncio.ensure_future(fetch_page(offset)) for offset in islice(offsets, self.fetch_concurrency))
+        try:
+            while pending:
+                page = await pending.popleft()
+
+                # Giữ cửa sổ tải trước luôn đủ FETCH_CONCURRENCY trang
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    pending.append(asyncio.ensure_future(fetch_page(next_offset)))
+
+                yield page
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _iter_invoice_pages(self, from_date, to_date, page_size=100):
+        """Duyệt các trang hóa đơn, bỏ bản trùng và tải lại chỗ thiếu so với `total`
+
+        Cùng cách chống lệch phân trang với KiotVietAPI._iter_invoice_pages.
+        """
+        guard = DriftGuard(page_size)
+        fetch_page = lambda current_item: self.get_invoices(from_date, to_date, page_size, current_item)
+
+        for attempt in range(1 + self.drift_max_passes):
+            guard.start_pass()
+            page_index = 0
+            async for page in self.iter_pages(fetch_page, page_size):
+                if page is None:
+                    # Trang lỗi đã làm kết quả thiếu, duyệt lại cũng không bù được
+                    yield None
+                    return
+
+                yield guard.filter(page, page_index * page_size)
+                page_index += 1
+
+                # Lượt bù chỉ cần chạy đến khi đủ số hóa đơn
+                if attempt and guard.complete():
+                    return
+
+            # Hóa đơn mới được thêm vào cuối trong lúc duyệt: đi tiếp tới cuối mới
+            while guard.next_offset is not None:
+                offset = guard.next_offset
+                page = await fetch_page(offset)
+                if page is None:
+                    yield None
+                    return
+                yield guard.filter(page, offset)
+
+            gaps = guard.take_gaps()
+            if gaps:
+                logger.warning(f"⚠️ Lệch phân trang: {guard.describe()}, tải lại {len(gaps)} trang quanh chỗ thiếu...")
+            for offset in gaps:
+                page = await fetch_page(offset)
+                if page is None:
+                    yield None
+                    return
+                yield guard.filter(page)
+
+            if guard.complete():
+                return
+
+            if attempt < self.drift_max_passes:
+                logger.warning(f"⚠️ Lệch phân trang: {guard.describe()}, duyệt lại để lấp chỗ trống...")
+
+        logger.warning(f"⚠️ Vẫn lệch phân trang sau {1 + self.drift_max_passes} lượt duyệt: {guard.describe()}")
+        yield None
+
+    async def _fill_window_queue(self, from_date, to_date, queue):
+        """Tải các trang của một cửa sổ vào hàng đợi có giới hạn, kết thúc bằng _WINDOW_DONE (hoặc lỗi)"""
+        try:
+            async for page in self._iter_invoice_pages(from_date, to_date):
+                await queue.put(page)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(_WINDOW_DONE)
+
+    async def _iter_window_pages(self, from_date, to_date):
+        """Duyệt các trang hóa đơn của kỳ theo đúng thứ tự cửa sổ (async generator)
+
+        Tối đa SYNC_WINDOW_CONCURRENCY cửa sổ được tải cùng lúc, mỗi cửa sổ chỉ giữ tối đa
+        FETCH_CONCURRENCY trang chờ xử lý, nên bộ nhớ không tăng theo độ dài kỳ.
+        Trang tải lỗi được trả về là None.
+        """
+        windows = iter(self.split_period(from_date, to_date, self.sync_window))
+        pending = deque()
+
+        def start_next_window():
+            window = next(windows, None)
+            if window is not None:
+                queue = asyncio.Queue(maxsize=max(self.fetch_concurrency, 1))
+                pending.append((queue, asyncio.ensure_future(self._fill_window_queue(*window, queue))))
+
+        for _ in range(self.sync_window_concurrency):
+            start_next_window()
+        try:
+            while pending:
+                queue, _ = pending[0]
+                while True:
+                    page = await queue.get()
+                    if page is _WINDOW_DONE:
+                        break
+                    if isinstance(page, Exception):
+                        raise page
+                    yield page
+                pending.popleft()
+                start_next_window()
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def iter_invoices(self, from_date, to_date):
+        """Duyệt lần lượt từng hóa đơn trong khoảng thời gian (async generator)"""
+        async for page in self._iter_window_pages(from_date, to_date):
+            if page is None:
+                logger.warning("⚠️ Một trang hóa đơn vẫn lỗi sau khi thử lại, kết quả có thể thiếu dữ liệu")
+                continue
+            for invoice in page.get('data') or []:
+                yield invoice
+
+    async def iter_products(self, page_size=100):
+        """Duyệt lần lượt từng sản phẩm (async generator)"""
+        async for page in self.iter_pages(
+            lambda current_item: self.get_products(page_size, current_item),
+            page_size
+        ):
+            if page is None:
+                logger.warning("⚠️ Một trang sản phẩm vẫn lỗi sau khi thử lại, kết quả có thể thiếu dữ liệu")
+                continue
+            for product in page.get('data') or []:
+                yield product
+
+    async def _build_product_sales(self, from_date, to_date):
+        """Tải song song các cửa sổ của kỳ, chuyển từng trang sang dạng cột theo thứ tự cửa sổ
+
+        Trả về (bảng tổng hợp, đã tải đủ hay chưa).
+        """
+        windows = self.split_period(from_date, to_date, self.sync_window)
+        if len(windows) > 1:
+            logger.info(f"🗂️ Chia kỳ thành {len(windows)} cửa sổ theo {self.sync_window}")
+
+        lines = InvoiceLines()
+        complete = True
+        async for page in self._iter_window_pages(from_date, to_date):
+            if page is None:
+                logger.warning("⚠️ Một trang hóa đơn vẫn lỗi sau khi thử lại, kết quả có thể thiếu dữ liệu")
+                complete = False
+                continue
+            with self.telemetry.phase('aggregate'):
+                for invoice in page.get('data') or []:
+                    lines.add_invoice(invoice)
+
+        logger.info(f"📊 Đã tải {lines.invoice_total} hóa đơn ({len(lines)} dòng chi tiết)")
+        with self.telemetry.phase('aggregate'):
+            return lines.to_sales_table(), complete
+
+    async def get_product_sales(self, from_date, to_date):
+        """Lấy bảng tổng hợp theo sản phẩm của một kỳ
+
+        Các coroutine hỏi cùng một kỳ trong lúc đang tải dùng chung một lần tải.
+        """
+        key = (from_date, to_date)
+        if key in self._sales_tables:
+            logger.info("💾 Dùng bảng tổng hợp đã tính cho kỳ này")
+            return self._sales_tables[key]
+
+        task = self._sales_tasks.get(key)
+        if task is None:
+            logger.info(f"📅 Từ ngày: {from_date.strftime('%d/%m/%Y')}")
+            logger.info(f"📅 Đến ngày: {to_date.strftime('%d/%m/%Y')}")
+            task = self._sales_tasks[key] = asyncio.ensure_future(self._build_product_sales(from_date, to_date))
+
+        try:
+            table, complete = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._sales_tasks.pop(key, None)
+
+        # Chỉ giữ lại bảng của kỳ đã kết thúc và đã tải đủ, kỳ đang diễn ra luôn được tính lại
+        if complete and to_date.date() < datetime.now().date():
+            self._sales_tables[key] = table
+
+        return table
+
+    async def _get_period_sales(self, month, year):
+        """Bảng tổng hợp theo sản phẩm của một tháng hoặc cả năm"""
+        from_date, to_date = self.get_period(month, year)
+        return await self.get_product_sales(from_date, to_date)
+
+    async def get_top_selling_products(self, month=None, year=2025, top_n=10):
+        """Lấy top sản phẩm bán chạy nhất trong tháng hoặc năm"""
+        print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm bán chạy nhất {self.get_period_text(month, year).lower()}...")
+
+        top_products = (await self._get_period_sales(month, year)).top('total_quantity', top_n)
+
+        with self.telemetry.phase('render'):
+            self._print_top_selling_products(top_products, month, year, top_n)
+
+        return top_products
+
+    async def get_top_products_by_revenue(self, month=None, year=2025, top_n=10):
+        """Lấy top sản phẩm mang lại doanh thu/lợi nhuận nhiều nhất trong tháng hoặc năm"""
+        print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm mang lại doanh thu nhiều nhất {self.get_period_text(month, year).lower()}...")
+
+        top_products = (await self._get_period_sales(month, year)).top('total_revenue', top_n)
+
+        with self.telemetry.phase('render'):
+            self._print_top_products_by_revenue(top_products, month, year, top_n)
+
+        return top_products
+
+    async def get_top_products_by_invoice_count(self, month=None, year=2025, top_n=10):
+        """Lấy top sản phẩm có nhiều đơn hàng nhất trong tháng hoặc năm"""
+        print(f"🔍 Đang tìm kiếm top {top_n} sản phẩm có nhiều đơn hàng nhất {self.get_period_text(month, year).lower()}...")
+
+        top_products = (await self._get_period_sales(month, year)).top('invoice_count', top_n)
+
+        with self.telemetry.phase('render'):
+            self._print_top_products_by_invoice_count(top_products, month, year, top_n)
+
+        return top_products
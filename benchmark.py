@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark
+Chạy các báo cáo chính với mock KiotViet server và đo thời gian, số request, dung lượng,
+bộ nhớ đỉnh, số hóa đơn/giây để phát hiện suy giảm hiệu năng bằng số liệu
+
+Sử dụng:
+    python benchmark.py --invoices 20000 --latency 0.02
+    python benchmark.py --json bench_results.json
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from mock_kiotviet_server import create_server
+
+
+def configure_environment(server, work_dir, args):
+    """Trỏ cấu hình tới mock server (phải chạy trước khi import config)"""
+    os.environ.update({
+        'KIOTVIET_RETAILER': 'benchmark',
+        'KIOTVIET_CLIENT_ID': 'benchmark-client',
+        'KIOTVIET_CLIENT_SECRET': 'benchmark-secret',
+        'KIOTVIET_BASE_URL': server.base_url,
+        'KIOTVIET_AUTH_URL': f"{server.base_url}/connect/token",
+        'CACHE_ENABLED': str(args.cache),
+        'CACHE_DB_PATH': os.path.join(work_dir, 'benchmark_cache.db'),
+        'TOKEN_CACHE_PATH': '',
+        'RATE_LIMIT_PER_SECOND': str(args.rate_limit),
+        'RATE_LIMIT_STATE_PATH': '',
+        'FETCH_CONCURRENCY': str(args.concurrency),
+        'HTTP_BACKOFF_FACTOR': '0.05',
+        'DEBUG': 'False'
+    })
+
+
+def build_scenarios():
+    """Các kịch bản đo: (tên, hàm chạy, có xóa cache trước khi chạy hay không)"""
+    from API_kiotviet_NTV import KiotVietAPI
+    from comprehensive_analysis_2024 import comprehensive_analysis_2024
+    from marketing_potential_analysis import analyze_marketing_potential
+
+    return [
+        ('get_top_selling_products (cold)',
+         lambda: KiotVietAPI().get_top_selling_products(year=2024, top_n=10), True),
+        ('get_top_selling_products (warm store)',
+         lambda: KiotVietAPI().get_top_selling_products(year=2024, top_n=10), False),
+        ('get_top_products_by_revenue (cold)',
+         lambda: KiotVietAPI().get_top_products_by_revenue(year=2024, top_n=10), True),
+        ('comprehensive_analysis_2024 (cold)', comprehensive_analysis_2024, True),
+        ('analyze_marketing_potential (cold)', analyze_marketing_potential, True),
+    ]
+
+
+def reset_caches(work_dir, cold, index):
+    """Xóa cache kết quả; kịch bản cold dùng kho hóa đơn mới để chạy từ đầu
+
+    Không xóa file kho cũ: các KiotVietAPI của kịch bản trước có thể vẫn giữ kết nối SQLite
+    tới nó (trên Windows xóa file đang mở sẽ lỗi PermissionError).
+    """
+    from config import Config
+    from query_cache import get_shared_result_cache
+
+    get_shared_result_cache().clear()
+    if cold:
+        Config.CACHE_DB_PATH = os.path.join(work_dir, f'benchmark_cache_{index}.db')
+
+
+def run_scenario(name, func, server, invoice_count):
+    """Chạy một kịch bản và thu thập số liệu"""
+    server.stats.reset()
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    # Ẩn output báo cáo để không ảnh hưởng tới thời gian đo
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+
+    wall_time = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = server.stats.snapshot()
+    return {
+        'scenario': name,
+        'wall_time_s': round(wall_time, 3),
+        'requests': stats['requests'],
+        'bytes': stats['bytes_sent'],
+        'peak_memory_mb': round(peak_memory / 1024 / 1024, 2),
+        'invoices_per_s': round(invoice_count / wall_time, 1) if wall_time > 0 else 0,
+        'errors': stats['errors'],
+        'throttled': stats['throttled']
+    }
+
+
+def print_results(results):
+    """In bảng kết quả"""
+    print(f"\n{'Kịch bản':<42} {'Thời gian':>10} {'Request':>8} {'MB tải':>8} {'RAM đỉnh':>9} {'HĐ/giây':>10}")
+    print("=" * 92)
+    for r in results:
+        print(f"{r['scenario']:<42} {r['wall_time_s']:>9.2f}s {r['requests']:>8} "
+              f"{r['bytes'] / 1024 / 1024:>8.2f} {r['peak_memory_mb']:>7.1f}MB {r['invoices_per_s']:>10,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark KiotViet API Tool với mock server")
+    parser.add_argument('--invoices', type=int, default=5000)
+    parser.add_argument('--products', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency', type=float, default=0.02, help="Độ trễ mỗi request (giây)")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=4, help="FETCH_CONCURRENCY")
+    parser.add_argument('--rate-limit', type=float, default=0, help="RATE_LIMIT_PER_SECOND (0: tắt)")
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help="Tắt kho hóa đơn SQLite")
+    parser.add_argument('--json', help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    print(f"🏗️ Tạo cửa hàng mẫu: {args.invoices:,} hóa đơn, {args.products:,} sản phẩm (seed {args.seed})")
+    server = create_server(
+        invoices=args.invoices, products=args.products, seed=args.seed,
+        latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate
+    )
+    server.start()
+    print(f"🚀 Mock server: {server.base_url}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_environment(server, work_dir, args)
+
+        for index, (name, func, cold) in enumerate(build_scenarios()):
+            reset_caches(work_dir, cold, index)
+            print(f"⏱️ {name}...")
+            results.append(run_scenario(name, func, server, args.invoices))
+
+        # Đóng các kết nối SQLite còn sót trước khi xóa thư mục tạm
+        gc.collect()
+
+    server.shutdown()
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Đã ghi kết quả vào {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Columnar Invoice Lines
+Biểu diễn các dòng hóa đơn dạng cột (mảng song song) thay cho dict lồng nhau
+Tổng hợp số lượng, doanh thu, số đơn hàng bằng group-by vector hóa (np.bincount)
+"""
+
+from array import array
+from datetime import datetime
+
+from aggregation import ProductSalesTable, as_number
+
+try:
+    import numpy as np
+except ImportError:  # numpy là tùy chọn, không có thì tổng hợp bằng vòng lặp Python
+    np = None
+
+
+def invoice_timestamp(invoice):
+    """Thời điểm bán của hóa đơn (epoch giây), 0 nếu không có"""
+    value = invoice.get('purchaseDate') or invoice.get('createdDate')
+    if not value:
+        return 0
+    try:
+        return int(datetime.fromisoformat(value[:19]).timestamp())
+    except ValueError:
+        return 0
+
+
+class InvoiceLines:
+    """Các dòng chi tiết hóa đơn lưu theo cột
+
+    product_index: chỉ số sản phẩm liên tục (0..n-1), tra ngược qua product_ids / product_names
+    quantity, price: số lượng và đơn giá
+    invoice_id, timestamp: hóa đơn chứa dòng và thời điểm bán (epoch giây)
+    """
+
+    def __init__(self):
+        self.product_ids = []
+        self.product_names = []
+        self._product_index = {}
+
+        self.product_index = array('l')
+        self.quantity = array('d')
+        self.price = array('d')
+        self.invoice_id = array('q')
+        self.timestamp = array('q')
+        self.invoice_total = 0
+
+    def _intern_product(self, product_id, product_name):
+        """Lấy chỉ số liên tục của sản phẩm, thêm mới nếu chưa có (giữ tên xuất hiện đầu tiên)"""
+        index = self._product_index.get(product_id)
+        if index is None:
+            index = self._product_index[product_id] = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self.product_names.append(product_name)
+        return index
+
+    def add_invoice(self, invoice):
+        """Thêm các dòng chi tiết của một hóa đơn"""
+        self.invoice_total += 1
+        details = invoice.get('invoiceDetails')
+        if not details:
+            return
+
+        invoice_id = invoice.get('id') or 0
+        timestamp = invoice_timestamp(invoice)
+        for detail in details:
+            self.product_index.append(self._intern_product(
+                detail.get('productId'),
+                detail.get('productName', 'Không xác định')
+            ))
+            self.quantity.append(detail.get('quantity', 0))
+            self.price.append(detail.get('price', 0))
+            self.invoice_id.append(invoice_id)
+            self.timestamp.append(timestamp)
+
+    @classmethod
+    def from_columns(cls, product_ids, product_names, columns, invoice_total):
+        """Tạo bảng cột từ các cột có sẵn (array.array hoặc memoryview, vd. trỏ vào file snapshot đã mmap)"""
+        lines = cls()
+        lines.product_ids = list(product_ids)
+        lines.product_names = list(product_names)
+        lines._product_index = {product_id: index for index, product_id in enumerate(lines.product_ids)}
+        for name, values in columns.items():
+            setattr(lines, name, values)
+        lines.invoice_total = invoice_total
+        return lines
+
+    @classmethod
+    def from_invoices(cls, invoices):
+        """Tạo bảng cột từ danh sách (hoặc generator) hóa đơn của API"""
+        lines = cls()
+        for invoice in invoices:
+            lines.add_invoice(invoice)
+        return lines
+
+    def __len__(self):
+        return len(self.product_index)
+
+    @property
+    def product_count(self):
+        return len(self.product_ids)
+
+    def column(self, name):
+        """Lấy một cột dạng numpy array (không sao chép) hoặc array.array/memoryview nếu không có numpy"""
+        values = getattr(self, name)
+        if np is None:
+            return values
+        typecode = getattr(values, 'typecode', None) or values.format
+        return np.frombuffer(values, dtype=np.dtype(typecode)) if len(values) else np.array([], dtype=typecode)
+
+    def group_totals(self):
+        """Tổng số lượng, doanh thu, số dòng (đơn hàng) theo sản phẩm, trả về 3 danh sách theo product_index"""
+        size = self.product_count
+        if np is not None:
+            product_index = self.column('product_index')
+            quantity = self.column('quantity')
+            revenue = quantity * self.column('price')
+            return (
+                np.bincount(product_index, weights=quantity, minlength=size).tolist(),
+                np.bincount(product_index, weights=revenue, minlength=size).tolist(),
+                np.bincount(product_index, minlength=size).tolist()
+            )
+
+        total_quantity = [0.0] * size
+        total_revenue = [0.0] * size
+        invoice_count = [0] * size
+        for index, quantity, price in zip(self.product_index, self.quantity, self.price):
+            total_quantity[index] += quantity
+            total_revenue[index] += quantity * price
+            invoice_count[index] += 1
+        return total_quantity, total_revenue, invoice_count
+
+    def to_sales_table(self):
+        """Chuyển kết quả group-by thành ProductSalesTable để dùng cho các bảng xếp hạng"""
+        total_quantity, total_revenue, invoice_count = self.group_totals()
+
+        table = ProductSalesTable()
+        table.invoice_total = self.invoice_total
+        for index, product_id in enumerate(self.product_ids):
+            table.products[product_id] = {
+                'name': self.product_names[index],
+                'total_quantity': as_number(total_quantity[index]),
+                'total_revenue': as_number(total_revenue[index]),
+                'invoice_count': invoice_count[index]
+            }
+        return table
@@ -23,7 +23,7 @@ def comprehensive_analysis_2024():
     # 2. Top 10 sản phẩm mang lại doanh thu cao nhất
     print("\n\n💰 2. TOP 10 SẢN PHẨM MANG LẠI DOANH THU CAO NHẤT:")
     print("-" * 60)
-    revenue_result = api.answer_question("top 10 sản phẩm mang lại lợi nhuận cao nhất năm 2024")
+    revenue_result = api.answer_question("top 10 sản phẩm mang lại doanh thu cao nhất năm 2024")
     
     # 3. Phân tích tổng hợp
     print("\n\n📊 3. PHÂN TÍCH TỔNG HỢP VÀ SO SÁNH:")
@@ -21,7 +21,52 @@ class Config:
     # App Settings
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
     CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'True').lower() == 'true'
+    CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', 'kiotviet_cache.db')
+    PRODUCT_CATALOG_TTL = int(os.getenv('PRODUCT_CATALOG_TTL', '3600'))
+    AGGREGATION_PROCESSES = int(os.getenv('AGGREGATION_PROCESSES', '0'))
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    METRICS_EXPORT_PATH = os.getenv('METRICS_EXPORT_PATH', '')
+    
+    # Performance Settings
+    FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', '4'))
+    SYNC_WINDOW = os.getenv('SYNC_WINDOW', 'month')
+    SYNC_WINDOW_CONCURRENCY = int(os.getenv('SYNC_WINDOW_CONCURRENCY', '3'))
+    DRIFT_MAX_PASSES = int(os.getenv('DRIFT_MAX_PASSES', '2'))
+    ASYNC_MAX_CONCURRENCY = int(os.getenv('ASYNC_MAX_CONCURRENCY', '10'))
+    HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '30'))
+    HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '5'))
+    HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.5'))
+    FAST_JSON_ENABLED = os.getenv('FAST_JSON_ENABLED', 'True').lower() == 'true'
+    INVOICE_PROJECTION = os.getenv('INVOICE_PROJECTION', 'True').lower() == 'true'
+    
+    # Multi-retailer Settings (báo cáo chuỗi, xem retailers.example.json)
+    RETAILERS_CONFIG_PATH = os.getenv('RETAILERS_CONFIG_PATH', 'retailers.json')
+    RETAILER_CONCURRENCY = int(os.getenv('RETAILER_CONCURRENCY', '3'))
+    
+    # Query Cache Settings (TTL chỉ áp dụng cho kỳ đang diễn ra)
+    QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '128'))
+    QUERY_CACHE_TTL = int(os.getenv('QUERY_CACHE_TTL', '300'))
+    
+    # Prefetch Settings (tool tương tác: luồng nền giữ sẵn tháng hiện tại và các kỳ vừa hỏi)
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'True').lower() == 'true'
+    PREFETCH_INTERVAL = int(os.getenv('PREFETCH_INTERVAL', '300'))
+    PREFETCH_MAX_PERIODS = int(os.getenv('PREFETCH_MAX_PERIODS', '4'))
+    
+    # Report Server Settings (dịch vụ HTTP/JSON cục bộ, xem report_server.py)
+    REPORT_SERVER_HOST = os.getenv('REPORT_SERVER_HOST', '127.0.0.1')
+    REPORT_SERVER_PORT = int(os.getenv('REPORT_SERVER_PORT', '8766'))
+    
+    # Approximate Top-N Settings (sai số tối đa = APPROX_TOP_EPSILON x tổng của chỉ số)
+    APPROX_TOP_EPSILON = float(os.getenv('APPROX_TOP_EPSILON', '0.001'))
+    
+    # Rate Limit Settings (RATE_LIMIT_PER_SECOND=0 để tắt)
+    RATE_LIMIT_PER_SECOND = float(os.getenv('RATE_LIMIT_PER_SECOND', '5'))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '10'))
+    RATE_LIMIT_STATE_PATH = os.getenv('RATE_LIMIT_STATE_PATH', '.kiotviet_ratelimit.json')
+    
+    # Token Settings
+    TOKEN_CACHE_PATH = os.getenv('TOKEN_CACHE_PATH', '.kiotviet_token.json')
+    TOKEN_REFRESH_MARGIN = int(os.getenv('TOKEN_REFRESH_MARGIN', '300'))
     
     @classmethod
     def validate(cls):
@@ -49,7 +94,18 @@ class Config:
         print(f"  Client Secret: {'*' * 20}")
         print(f"  Base URL: {cls.BASE_URL}")
         print(f"  Debug: {cls.DEBUG}")
-        print(f"  Cache: {cls.CACHE_ENABLED}")
+        print(f"  Log level: {cls.LOG_LEVEL} (metrics: {cls.METRICS_EXPORT_PATH or 'disabled'})")
+        print(f"  Rate limit: {cls.RATE_LIMIT_PER_SECOND} req/s (burst {cls.RATE_LIMIT_BURST})")
+        print(f"  Token cache: {cls.TOKEN_CACHE_PATH or 'disabled'} (refresh {cls.TOKEN_REFRESH_MARGIN}s before expiry)")
+        print(f"  Cache: {cls.CACHE_ENABLED} ({cls.CACHE_DB_PATH}, product catalog TTL {cls.PRODUCT_CATALOG_TTL}s)")
+        print(f"  Aggregation processes: {cls.AGGREGATION_PROCESSES or 'auto'}")
+        print(f"  Prefetch: {cls.PREFETCH_ENABLED} (every {cls.PREFETCH_INTERVAL}s, {cls.PREFETCH_MAX_PERIODS} recent periods)")
+        print(f"  Report server: {cls.REPORT_SERVER_HOST}:{cls.REPORT_SERVER_PORT}")
+        print(f"  Approximate top-N error: {cls.APPROX_TOP_EPSILON:.2%} of total")
+        print(f"  Fetch concurrency: {cls.FETCH_CONCURRENCY} (sync window: {cls.SYNC_WINDOW} x{cls.SYNC_WINDOW_CONCURRENCY})")
+        print(f"  Async max concurrency: {cls.ASYNC_MAX_CONCURRENCY}")
+        print(f"  HTTP retries: {cls.HTTP_MAX_RETRIES} (backoff {cls.HTTP_BACKOFF_FACTOR}s, timeout {cls.HTTP_TIMEOUT}s)")
+        print(f"  Fast JSON: {cls.FAST_JSON_ENABLED} (invoice projection: {cls.INVOICE_PROJECTION})")
 
 # Validate config on import
 try:
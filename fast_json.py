@@ -0,0 +1,76 @@
+"""
+Fast JSON
+Giải mã JSON nhanh bằng orjson nếu có (tùy chọn), không có thì dùng json chuẩn
+Kèm phép chiếu (projection) trang hóa đơn: chỉ giữ các trường mà báo cáo và kho hóa đơn dùng tới
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson là tùy chọn, không có thì dùng json chuẩn
+    orjson = None
+
+# Trường được giữ lại khi chiếu hóa đơn (id, mốc thời gian cho kho và snapshot, dòng chi tiết)
+INVOICE_FIELDS = ('id', 'code', 'purchaseDate', 'createdDate', 'modifiedDate')
+DETAIL_FIELDS = ('productId', 'productName', 'quantity', 'price')
+
+
+def loads(data, fast=True):
+    """Giải mã JSON từ bytes hoặc str; fast=False luôn dùng json chuẩn"""
+    if fast and orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value, fast=True):
+    """Mã hóa JSON thành str (giữ nguyên tiếng Việt, giống json.dumps(..., ensure_ascii=False))"""
+    if fast and orjson is not None:
+        return orjson.dumps(value).decode('utf-8')
+    return json.dumps(value, ensure_ascii=False)
+
+
+def project_invoice(invoice):
+    """Bản rút gọn của một hóa đơn chỉ gồm INVOICE_FIELDS và DETAIL_FIELDS của từng dòng"""
+    try:
+        # Đường nhanh: hóa đơn có đủ trường (trường hợp thường gặp), tạo dict bằng literal
+        return {
+            'id': invoice['id'],
+            'code': invoice['code'],
+            'purchaseDate': invoice['purchaseDate'],
+            'createdDate': invoice['createdDate'],
+            'modifiedDate': invoice['modifiedDate'],
+            'invoiceDetails': [
+                {
+                    'productId': detail['productId'],
+                    'productName': detail['productName'],
+                    'quantity': detail['quantity'],
+                    'price': detail['price']
+                }
+                for detail in invoice['invoiceDetails']
+            ]
+        }
+    except (KeyError, TypeError):
+        pass
+
+    # Thiếu trường nào thì bỏ trường đó, để các chỗ đọc .get(field, mặc định) vẫn dùng giá trị mặc định
+    projected = {field: invoice[field] for field in INVOICE_FIELDS if field in invoice}
+    details = invoice.get('invoiceDetails')
+    if details is not None:
+        projected['invoiceDetails'] = [
+            {field: detail[field] for field in DETAIL_FIELDS if field in detail}
+            for detail in details
+        ]
+    return projected
+
+
+def decode_invoice_page(data, fast=True, project=True):
+    """Giải mã một trang /invoices; project=True thay từng hóa đơn bằng bản rút gọn
+
+    Bản rút gọn làm nhẹ mọi bước sau: ghi kho (json nhỏ hơn), tính lại tổng hợp theo ngày
+    và bộ nhớ giữ các trang đang chờ xử lý.
+    """
+    page = loads(data, fast)
+    if project and page.get('data'):
+        page['data'] = [project_invoice(invoice) for invoice in page['data']]
+    return page
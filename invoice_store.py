@@ -0,0 +1,355 @@
+"""
+Invoice Store
+Kho lưu trữ hóa đơn KiotViet cục bộ (SQLite)
+Đồng bộ tăng dần theo mốc lastModified để không phải tải lại toàn bộ kỳ báo cáo
+Kèm bảng tổng hợp sẵn theo ngày và sản phẩm để báo cáo tháng/năm không phải duyệt lại hóa đơn
+Khi có nhiều ngày cần tính lại (lần đầu đồng bộ dữ liệu nhiều năm), các ngày được chia cho
+một process pool, mỗi tiến trình tự đọc hóa đơn của phần ngày được giao từ file SQLite
+"""
+
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import fast_json
+
+from aggregation import ProductSalesTable, as_number
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Chỉ dùng process pool khi số ngày cần tính lại đủ lớn để bù chi phí khởi động tiến trình
+PARALLEL_ROLLUP_MIN_DAYS = 60
+
+
+def invoice_modified_date(invoice):
+    """Lấy thời điểm sửa đổi cuối của hóa đơn dạng 'YYYY-MM-DDTHH:MM:SS'"""
+    value = invoice.get('modifiedDate') or invoice.get('createdDate') or ''
+    return value[:19]
+
+
+def compute_day_rollup(conn, day, fast=True):
+    """Tổng hợp theo sản phẩm của một ngày từ các hóa đơn đã lưu, trả về các dòng của daily_product_sales"""
+    rows = conn.execute(
+        "SELECT id, modified_date, data FROM invoices "
+        "WHERE modified_date BETWEEN ? AND ? ORDER BY modified_date, id",
+        (f"{day}T00:00:00", f"{day}T23:59:59")
+    ).fetchall()
+
+    products = {}
+    for invoice_id, modified_date, data in rows:
+        invoice = fast_json.loads(data, fast)
+        products_in_invoice = set()
+        for position, detail in enumerate(invoice.get('invoiceDetails') or []):
+            product_id = detail.get('productId')
+            quantity = detail.get('quantity', 0)
+            price = detail.get('price', 0)
+
+            product = products.get(product_id)
+            if product is None:
+                product = products[product_id] = {
+                    'name': detail.get('productName', 'Không xác định'),
+                    'total_quantity': 0,
+                    'total_revenue': 0,
+                    'invoice_count': 0,
+                    'line_count': 0,
+                    # Thứ tự xuất hiện đầu tiên, để xếp hạng giống hệt khi duyệt hóa đơn gốc
+                    'first_seen': f"{modified_date}|{invoice_id:020d}|{position:06d}"
+                }
+
+            product['total_quantity'] += quantity
+            product['total_revenue'] += quantity * price
+            product['line_count'] += 1
+            if product_id not in products_in_invoice:
+                products_in_invoice.add(product_id)
+                product['invoice_count'] += 1
+
+    return [
+        (day, product_id, p['name'], p['total_quantity'], p['total_revenue'],
+         p['invoice_count'], p['line_count'], p['first_seen'])
+        for product_id, p in products.items()
+    ]
+
+
+def _compute_rollups_worker(db_path, days, fast=True):
+    """Chạy trong tiến trình con: mở kết nối chỉ đọc và tổng hợp một nhóm ngày"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return [(day, compute_day_rollup(conn, day, fast)) for day in days]
+    finally:
+        conn.close()
+
+
+class InvoiceStore:
+    def __init__(self, db_path, processes=1, fast_json=True):
+        """processes: số tiến trình tính bảng tổng hợp theo ngày (0: theo số CPU, 1: tính tuần tự)
+        fast_json: mã hóa/giải mã hóa đơn lưu trong kho bằng orjson nếu có (FAST_JSON_ENABLED)
+        """
+        self.db_path = db_path
+        self.processes = processes or os.cpu_count() or 1
+        self.fast_json = fast_json
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._create_tables()
+
+    def _create_tables(self):
+        """Tạo bảng nếu chưa tồn tại"""
+        with self._lock:
+            has_rollup = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_product_sales'"
+            ).fetchone()
+
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    id INTEGER PRIMARY KEY,
+                    modified_date TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_invoices_modified_date
+                    ON invoices (modified_date);
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    from_date TEXT NOT NULL,
+                    to_date TEXT NOT NULL,
+                    watermark TEXT NOT NULL,
+                    synced_at TEXT NOT NULL,
+                    PRIMARY KEY (from_date, to_date)
+                );
+                CREATE TABLE IF NOT EXISTS daily_product_sales (
+                    day TEXT NOT NULL,
+                    product_id INTEGER,
+                    product_name TEXT,
+                    total_quantity REAL NOT NULL,
+                    total_revenue REAL NOT NULL,
+                    invoice_count INTEGER NOT NULL,
+                    line_count INTEGER NOT NULL,
+                    first_seen TEXT NOT NULL,
+                    PRIMARY KEY (day, product_id)
+                );
+                CREATE TABLE IF NOT EXISTS rollup_dirty_days (
+                    day TEXT PRIMARY KEY
+                );
+                CREATE TABLE IF NOT EXISTS rollup_day_versions (
+                    day TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                );
+            """)
+
+            # Kho tạo trước khi có bảng tổng hợp: đánh dấu mọi ngày cần tính lại
+            if not has_rollup:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO rollup_dirty_days (day) "
+                    "SELECT DISTINCT substr(modified_date, 1, 10) FROM invoices"
+                )
+            self.conn.commit()
+
+    @staticmethod
+    def _period_bounds(from_date, to_date):
+        """Chuyển khoảng thời gian thành cặp chuỗi giống tham số gửi lên API"""
+        return from_date.strftime(DATETIME_FORMAT), to_date.strftime("%Y-%m-%dT23:59:59")
+
+    def save_invoices(self, invoices):
+        """Ghi (hoặc cập nhật) danh sách hóa đơn vào kho"""
+        rows = [
+            (invoice['id'], invoice_modified_date(invoice), fast_json.dumps(invoice, self.fast_json))
+            for invoice in invoices
+            if invoice.get('id') is not None
+        ]
+        if not rows:
+            return 0
+
+        with self._lock:
+            # Ngày của bản cũ và bản mới đều phải tính lại bảng tổng hợp
+            ids = [row[0] for row in rows]
+            old_days = self.conn.execute(
+                f"SELECT DISTINCT substr(modified_date, 1, 10) FROM invoices "
+                f"WHERE id IN ({','.join('?' * len(ids))})",
+                ids
+            ).fetchall()
+            dirty_days = [(day,) for day in {day for (day,) in old_days} | {row[1][:10] for row in rows}]
+
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO invoices (id, modified_date, data) VALUES (?, ?, ?)",
+                rows
+            )
+            self.conn.executemany("INSERT OR IGNORE INTO rollup_dirty_days (day) VALUES (?)", dirty_days)
+            # Phiên bản theo ngày lưu trong file (không bao giờ xóa) để mọi tiến trình dùng chung kho
+            # đều biết bảng tổng hợp đang tính có còn khớp dữ liệu hay không
+            self.conn.executemany("INSERT OR IGNORE INTO rollup_day_versions (day, version) VALUES (?, 0)", dirty_days)
+            self.conn.executemany("UPDATE rollup_day_versions SET version = version + 1 WHERE day = ?", dirty_days)
+            self.conn.commit()
+        return len(rows)
+
+    def iter_invoices(self, from_date, to_date, batch_size=500):
+        """Duyệt các hóa đơn có lastModified nằm trong khoảng thời gian, đọc theo từng lô"""
+        start, end = self._period_bounds(from_date, to_date)
+        last_key = (start, -1)
+
+        while True:
+            # Phân trang theo khóa (modified_date, id) để không giữ cursor mở giữa các lô
+            with self._lock:
+                rows = self.conn.execute(
+                    "SELECT id, modified_date, data FROM invoices "
+                    "WHERE (modified_date, id) > (?, ?) AND modified_date <= ? "
+                    "ORDER BY modified_date, id LIMIT ?",
+                    (last_key[0], last_key[1], end, batch_size)
+                ).fetchall()
+
+            for _, _, data in rows:
+                yield fast_json.loads(data, self.fast_json)
+
+            if len(rows) < batch_size:
+                break
+            last_key = (rows[-1][1], rows[-1][0])
+
+    def load_invoices(self, from_date, to_date):
+        """Đọc các hóa đơn có lastModified nằm trong khoảng thời gian"""
+        return list(self.iter_invoices(from_date, to_date))
+
+    def _write_day_rollup(self, day, rows, version):
+        """Thay bảng tổng hợp của một ngày và bỏ đánh dấu cần tính lại (gọi khi đang giữ khóa)
+
+        Chỉ ghi nếu phiên bản của ngày vẫn là `version` lúc bắt đầu tính: lệnh DELETE đầu tiên
+        giành khóa ghi của file nên việc so sánh, bỏ đánh dấu và ghi bảng tổng hợp nằm trong cùng
+        một transaction. Ngày vừa có hóa đơn mới (từ tiến trình khác) vẫn được đánh dấu, lần sau tính lại.
+        """
+        cleared = self.conn.execute(
+            "DELETE FROM rollup_dirty_days WHERE day = ? "
+            "AND IFNULL((SELECT version FROM rollup_day_versions WHERE day = ?), 0) = ?",
+            (day, day, version)
+        ).rowcount
+        if not cleared:
+            return
+        self.conn.execute("DELETE FROM daily_product_sales WHERE day = ?", (day,))
+        self.conn.executemany(
+            "INSERT INTO daily_product_sales (day, product_id, product_name, total_quantity, "
+            "total_revenue, invoice_count, line_count, first_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    def _compute_rollups_parallel(self, days):
+        """Chia các ngày thành nhiều nhóm liên tiếp, tính song song trên process pool
+
+        Mỗi ngày vẫn được tính bằng đúng compute_day_rollup như khi chạy tuần tự nên kết quả
+        giống hệt; các tiến trình con chỉ trả về các dòng tổng hợp (nhỏ) cho tiến trình chính ghi.
+        Trả về khi mọi tiến trình con đã đọc xong, để lúc ghi không còn kết nối nào đang đọc file.
+        """
+        chunk_count = min(len(days), self.processes * 4)
+        chunk_size = -(-len(days) // chunk_count)
+        chunks = [days[i:i + chunk_size] for i in range(0, len(days), chunk_size)]
+
+        with ProcessPoolExecutor(max_workers=min(self.processes, len(chunks))) as executor:
+            return [
+                rollup
+                for results in executor.map(
+                    _compute_rollups_worker, [self.db_path] * len(chunks), chunks, [self.fast_json] * len(chunks)
+                )
+                for rollup in results
+            ]
+
+    def refresh_rollups(self, from_date, to_date):
+        """Tính lại các ngày trong khoảng đã thay đổi kể từ lần tổng hợp trước"""
+        start, end = from_date.strftime("%Y-%m-%d"), to_date.strftime("%Y-%m-%d")
+        with self._lock:
+            versions = dict(self.conn.execute(
+                "SELECT d.day, IFNULL(v.version, 0) FROM rollup_dirty_days d "
+                "LEFT JOIN rollup_day_versions v ON v.day = d.day "
+                "WHERE d.day BETWEEN ? AND ? ORDER BY d.day",
+                (start, end)
+            ).fetchall())
+            dirty_days = list(versions)
+
+            if self.processes <= 1 or len(dirty_days) < PARALLEL_ROLLUP_MIN_DAYS:
+                for day in dirty_days:
+                    self._write_day_rollup(day, compute_day_rollup(self.conn, day, self.fast_json), versions[day])
+                self.conn.commit()
+                return len(dirty_days)
+
+        # Process pool chạy khi không giữ khóa: các luồng khác vẫn đọc/ghi kho được trong lúc chờ
+        rollups = self._compute_rollups_parallel(dirty_days)
+
+        with self._lock:
+            for day, rows in rollups:
+                self._write_day_rollup(day, rows, versions[day])
+            self.conn.commit()
+        return len(dirty_days)
+
+    def get_sales_table(self, from_date, to_date):
+        """Cộng các tổng hợp theo ngày thành bảng tổng hợp theo sản phẩm của cả kỳ
+
+        Ngày được tính theo lastModified, cùng tiêu chí lọc với tham số gửi lên API.
+        invoice_count giữ cách đếm của báo cáo (mỗi dòng chi tiết là một lần xuất hiện).
+        """
+        self.refresh_rollups(from_date, to_date)
+
+        start, end = from_date.strftime("%Y-%m-%d"), to_date.strftime("%Y-%m-%d")
+        period_start, period_end = self._period_bounds(from_date, to_date)
+        with self._lock:
+            # Cột product_name lấy theo dòng có MIN(first_seen) (tên xuất hiện đầu tiên)
+            rows = self.conn.execute(
+                "SELECT product_id, product_name, MIN(first_seen), SUM(total_quantity), "
+                "SUM(total_revenue), SUM(line_count) FROM daily_product_sales "
+                "WHERE day BETWEEN ? AND ? GROUP BY product_id ORDER BY MIN(first_seen)",
+                (start, end)
+            ).fetchall()
+            invoice_total = self.conn.execute(
+                "SELECT COUNT(*) FROM invoices WHERE modified_date BETWEEN ? AND ?",
+                (period_start, period_end)
+            ).fetchone()[0]
+
+        table = ProductSalesTable()
+        table.invoice_total = invoice_total
+        for product_id, product_name, _, total_quantity, total_revenue, line_count in rows:
+            table.products[product_id] = {
+                'name': product_name,
+                'total_quantity': as_number(total_quantity),
+                'total_revenue': as_number(total_revenue),
+                'invoice_count': line_count
+            }
+        return table
+
+    def get_daily_sales(self, from_date, to_date):
+        """Tổng hợp theo ngày của cả khoảng: (day, product_id, product_name, quantity, revenue, line_count)
+
+        Dùng cho chuỗi thời gian: một truy vấn thay cho một get_sales_table mỗi kỳ.
+        """
+        self.refresh_rollups(from_date, to_date)
+
+        start, end = from_date.strftime("%Y-%m-%d"), to_date.strftime("%Y-%m-%d")
+        with self._lock:
+            return self.conn.execute(
+                "SELECT day, product_id, product_name, total_quantity, total_revenue, line_count "
+                "FROM daily_product_sales WHERE day BETWEEN ? AND ? ORDER BY day, first_seen",
+                (start, end)
+            ).fetchall()
+
+    def get_sync_state(self, from_date, to_date):
+        """Lấy mốc đồng bộ của một kỳ (None nếu chưa từng đồng bộ)"""
+        start, end = self._period_bounds(from_date, to_date)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT watermark, synced_at FROM sync_state WHERE from_date = ? AND to_date = ?",
+                (start, end)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            'watermark': datetime.strptime(row[0], DATETIME_FORMAT),
+            'synced_at': datetime.strptime(row[1], DATETIME_FORMAT)
+        }
+
+    def set_sync_state(self, from_date, to_date, watermark, synced_at):
+        """Lưu mốc đồng bộ của một kỳ"""
+        start, end = self._period_bounds(from_date, to_date)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sync_state (from_date, to_date, watermark, synced_at) "
+                "VALUES (?, ?, ?, ?)",
+                (start, end, watermark.strftime(DATETIME_FORMAT), synced_at.strftime(DATETIME_FORMAT))
+            )
+            self.conn.commit()
+
+    def close(self):
+        """Đóng kết nối SQLite"""
+        with self._lock:
+            self.conn.close()
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 from API_kiotviet_NTV import KiotVietAPI
+from aggregation import top_n_by_keys
 
 def analyze_marketing_potential():
     """Phân tích sản phẩm tiềm năng cần đẩy mạnh marketing"""
@@ -15,65 +16,24 @@ def analyze_marketing_potential():
     print("🎯 PHÂN TÍCH SẢN PHẨM TIỀM NĂNG CHO MARKETING NĂM 2024")
     print("=" * 80)
     
-    # Lấy dữ liệu từ API
-    from datetime import datetime
-    
-    # Lấy tất cả hóa đơn năm 2024
-    all_invoices = []
-    current_item = 0
-    page_size = 100
-    
-    from_date = datetime(2024, 1, 1)
-    to_date = datetime(2024, 12, 31)
+    # Lấy bảng tổng hợp theo sản phẩm năm 2024
+    from_date, to_date = api.get_period(month=None, year=2024)
     
     print("📊 Đang thu thập dữ liệu...")
-    while True:
-        print(f"📄 Đang tải hóa đơn... (trang {current_item//page_size + 1})")
-        invoices_data = api.get_invoices(from_date, to_date, page_size, current_item)
-        
-        if not invoices_data or not invoices_data.get('data'):
-            break
-        
-        all_invoices.extend(invoices_data['data'])
-        
-        if len(invoices_data['data']) < page_size:
-            break
-        
-        current_item += page_size
+    sales_table = api.get_product_sales(from_date, to_date)
     
-    print(f"✅ Đã thu thập {len(all_invoices)} hóa đơn")
+    print(f"✅ Đã thu thập {sales_table.invoice_total} hóa đơn")
     
-    # Phân tích dữ liệu
+    # Tính toán các chỉ số bổ sung (trên bản sao, không sửa bảng tổng hợp dùng chung)
     product_metrics = {}
     
-    for invoice in all_invoices:
-        if invoice.get('invoiceDetails'):
-            for detail in invoice['invoiceDetails']:
-                product_id = detail.get('productId')
-                product_name = detail.get('productName', 'Không xác định')
-                quantity = detail.get('quantity', 0)
-                price = detail.get('price', 0)
-                
-                if product_id not in product_metrics:
-                    product_metrics[product_id] = {
-                        'name': product_name,
-                        'total_quantity': 0,
-                        'total_revenue': 0,
-                        'invoice_count': 0,
-                        'avg_price': 0,
-                        'avg_quantity_per_order': 0
-                    }
-                
-                product_metrics[product_id]['total_quantity'] += quantity
-                product_metrics[product_id]['total_revenue'] += quantity * price
-                product_metrics[product_id]['invoice_count'] += 1
-    
-    # Tính toán các chỉ số bổ sung
-    for product_id, metrics in product_metrics.items():
+    for product_id, data in sales_table.products.items():
+        metrics = dict(data, avg_price=0, avg_quantity_per_order=0)
         if metrics['total_quantity'] > 0:
             metrics['avg_price'] = metrics['total_revenue'] / metrics['total_quantity']
         if metrics['invoice_count'] > 0:
             metrics['avg_quantity_per_order'] = metrics['total_quantity'] / metrics['invoice_count']
+        product_metrics[product_id] = metrics
     
     # Lọc sản phẩm có tiềm năng marketing
     # Tiêu chí: Doanh thu cao (>100M) nhưng ít đơn hàng (<20)
@@ -101,11 +61,12 @@ def analyze_marketing_potential():
             
             marketing_candidates.append((product_id, metrics))
     
-    # Sắp xếp theo điểm tiềm năng
-    marketing_candidates.sort(key=lambda x: x[1]['potential_score'], reverse=True)
-    
-    # Hiển thị TOP 10
-    top_10_candidates = marketing_candidates[:10]
+    # Lấy TOP 10 theo điểm tiềm năng
+    top_10_candidates = top_n_by_keys(
+        marketing_candidates,
+        {'potential_score': lambda x: x[1]['potential_score']},
+        10
+    )['potential_score']
     
     print(f"\n🎯 TOP 10 SẢN PHẨM TIỀM NĂNG CẦN ĐẨY MẠNH QUẢNG CÁO")
     print("💡 Tiêu chí: Doanh thu cao (≥50M) + Ít đơn hàng (≤30) + Giá cao (≥200k)")
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mock KiotViet Server
+Server giả lập KiotViet API chạy cục bộ để đo hiệu năng mà không đụng tới API thật
+Hỗ trợ /connect/token, /invoices, /products với dữ liệu cửa hàng tổng hợp (tái lập theo seed),
+độ trễ, tỷ lệ lỗi 5xx và 429 có thể điều chỉnh
+
+Sử dụng:
+    python mock_kiotviet_server.py --invoices 20000 --products 500 --latency 0.05
+"""
+
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MAX_PAGE_SIZE = 100
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class MockShop:
+    """Dữ liệu cửa hàng tổng hợp: danh mục sản phẩm và hóa đơn trong một khoảng thời gian"""
+
+    def __init__(self, invoice_count=5000, product_count=300, seed=42,
+                 start_date=datetime(2024, 1, 1), end_date=datetime(2024, 12, 31)):
+        rnd = random.Random(seed)
+        self.start_date = start_date
+        self.end_date = end_date
+
+        self.products = []
+        for product_id in range(1, product_count + 1):
+            base_price = rnd.choice([50_000, 120_000, 250_000, 800_000, 1_500_000, 12_000_000])
+            base_price = int(base_price * rnd.uniform(0.5, 1.5)) // 1000 * 1000
+            self.products.append({
+                'id': product_id,
+                'code': f"SP{product_id:06d}",
+                'name': f"Sản phẩm mẫu {product_id}",
+                'basePrice': base_price,
+                'modifiedDate': self._random_time(rnd, start_date, end_date),
+                'inventories': [{
+                    'branchId': 1,
+                    'cost': int(base_price * rnd.uniform(0.55, 0.85)),
+                    'onHand': rnd.randint(0, 500)
+                }]
+            })
+
+        # Phân bố bán hàng lệch (vài sản phẩm bán rất chạy) giống cửa hàng thật
+        weights = [1 / (rank ** 0.9) for rank in range(1, product_count + 1)]
+        rnd.shuffle(weights)
+
+        self.invoices = []
+        for invoice_id in range(1, invoice_count + 1):
+            created = self._random_time(rnd, start_date, end_date)
+            modified = created
+            if rnd.random() < 0.05:
+                # Một phần hóa đơn được sửa sau khi tạo
+                modified_dt = datetime.strptime(created, DATETIME_FORMAT) + timedelta(hours=rnd.randint(1, 72))
+                modified = min(modified_dt, end_date.replace(hour=23, minute=59, second=59)).strftime(DATETIME_FORMAT)
+
+            details = []
+            for product in rnd.choices(self.products, weights=weights, k=rnd.randint(1, 5)):
+                details.append({
+                    'productId': product['id'],
+                    'productCode': product['code'],
+                    'productName': product['name'],
+                    'quantity': rnd.randint(1, 10),
+                    'price': product['basePrice'],
+                    'discount': 0
+                })
+
+            self.invoices.append({
+                'id': invoice_id,
+                'code': f"HD{invoice_id:08d}",
+                'purchaseDate': created,
+                'createdDate': created,
+                'modifiedDate': modified,
+                'branchId': 1,
+                'customerName': f"Khách hàng {rnd.randint(1, 2000)}",
+                'total': sum(d['quantity'] * d['price'] for d in details),
+                'status': 1,
+                'statusValue': 'Hoàn thành',
+                'invoiceDetails': details
+            })
+
+        # Thứ tự trả về ổn định: theo (modifiedDate, id)
+        self.invoices.sort(key=lambda invoice: (invoice['modifiedDate'], invoice['id']))
+        self._modified_dates = [invoice['modifiedDate'] for invoice in self.invoices]
+
+    @staticmethod
+    def _random_time(rnd, start_date, end_date):
+        seconds = int((end_date - start_date).total_seconds()) + 86399
+        return (start_date + timedelta(seconds=rnd.randint(0, seconds))).strftime(DATETIME_FORMAT)
+
+    def query_invoices(self, modified_from, modified_to):
+        start = bisect.bisect_left(self._modified_dates, modified_from)
+        end = bisect.bisect_right(self._modified_dates, modified_to)
+        return self.invoices[start:end]
+
+    def query_products(self, modified_from=None):
+        if not modified_from:
+            return self.products
+        return [product for product in self.products if product['modifiedDate'] >= modified_from]
+
+
+class MockStats:
+    """Thống kê request phía server (dùng cho benchmark)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.token_requests = 0
+            self.bytes_sent = 0
+            self.errors = 0
+            self.throttled = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'token_requests': self.token_requests,
+                'bytes_sent': self.bytes_sent,
+                'errors': self.errors,
+                'throttled': self.throttled
+            }
+
+
+class MockKiotVietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, shop, latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                 token_expires_in=86400, seed=42):
+        super().__init__(address, MockRequestHandler)
+        self.shop = shop
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.token_expires_in = token_expires_in
+        self.stats = MockStats()
+        self.tokens = set()
+        self._rnd = random.Random(seed)
+        self._rnd_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def random(self):
+        with self._rnd_lock:
+            return self._rnd.random()
+
+    def start(self):
+        """Chạy server trong luồng nền"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats.add(bytes_sent=len(body))
+
+    def _simulate_network(self):
+        """Độ trễ, lỗi 5xx và 429 ngẫu nhiên; trả về True nếu đã trả lỗi"""
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.throttle_rate and server.random() < server.throttle_rate:
+            server.stats.add(throttled=1)
+            self._send_json(429, {'message': 'Too Many Requests'}, {'Retry-After': '0'})
+            return True
+
+        if server.error_rate and server.random() < server.error_rate:
+            server.stats.add(errors=1)
+            self._send_json(500, {'message': 'Internal Server Error'})
+            return True
+
+        return False
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.server.stats.add(requests=1, token_requests=1)
+
+        if urlparse(self.path).path != '/connect/token':
+            self._send_json(404, {'message': 'Not Found'})
+            return
+        if self._simulate_network():
+            return
+
+        access_token = uuid.uuid4().hex
+        self.server.tokens.add(access_token)
+        self._send_json(200, {
+            'access_token': access_token,
+            'expires_in': self.server.token_expires_in,
+            'token_type': 'Bearer'
+        })
+
+    def do_GET(self):
+        self.server.stats.add(requests=1)
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        if self._simulate_network():
+            return
+
+        access_token = self.headers.get('Authorization', '').replace('Bearer ', '', 1)
+        if access_token not in self.server.tokens:
+            self._send_json(401, {'message': 'Unauthorized'})
+            return
+
+        page_size = min(int(params.get('pageSize', 20)), MAX_PAGE_SIZE)
+        current_item = int(params.get('currentItem', 0))
+
+        if url.path == '/invoices':
+            rows = self.server.shop.query_invoices(
+                params.get('lastModifiedFrom', '0000'),
+                params.get('lastModifiedTo', '9999')
+            )
+            page = rows[current_item:current_item + page_size]
+            if params.get('includeInvoiceDetail', '').lower() != 'true':
+                page = [{k: v for k, v in invoice.items() if k != 'invoiceDetails'} for invoice in page]
+        elif url.path == '/products':
+            rows = self.server.shop.query_products(params.get('lastModifiedFrom'))
+            page = rows[current_item:current_item + page_size]
+            if params.get('includeInventory', '').lower() != 'true':
+                page = [{k: v for k, v in product.items() if k != 'inventories'} for product in page]
+        else:
+            self._send_json(404, {'message': 'Not Found'})
+            return
+
+        self._send_json(200, {'total': len(rows), 'pageSize': page_size, 'data': page})
+
+
+def create_server(host='127.0.0.1', port=0, invoices=5000, products=300, seed=42,
+                  latency=0.0, error_rate=0.0, throttle_rate=0.0):
+    """Tạo server giả lập (port=0 để hệ điều hành tự chọn cổng trống)"""
+    shop = MockShop(invoice_count=invoices, product_count=products, seed=seed)
+    return MockKiotVietServer(
+        (host, port), shop,
+        latency=latency, error_rate=error_rate, throttle_rate=throttle_rate, seed=seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock KiotViet API server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--invoices', type=int, default=5000, help="Số hóa đơn tổng hợp")
+    parser.add_argument('--products', type=int, default=300, help="Số sản phẩm tổng hợp")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency', type=float, default=0.0, help="Độ trễ mỗi request (giây)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Tỷ lệ trả lỗi 500")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Tỷ lệ trả lỗi 429")
+    args = parser.parse_args()
+
+    print("🏗️ Đang tạo dữ liệu cửa hàng mẫu...")
+    server = create_server(
+        host=args.host, port=args.port, invoices=args.invoices, products=args.products,
+        seed=args.seed, latency=args.latency, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate
+    )
+    print(f"🚀 Mock KiotViet API đang chạy tại {server.base_url}")
+    print("💡 Cấu hình .env để dùng server này:")
+    print(f"   KIOTVIET_BASE_URL={server.base_url}")
+    print(f"   KIOTVIET_AUTH_URL={server.base_url}/connect/token")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Dừng server")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi Retailer
+Báo cáo cho cả chuỗi: tải hóa đơn của nhiều retailer song song (mỗi retailer có rate limit,
+token cache và kho hóa đơn riêng), gộp bảng tổng hợp theo sản phẩm và xếp hạng chung
+kèm số liệu từng cửa hàng
+
+Danh sách retailer đọc từ file JSON (RETAILERS_CONFIG_PATH), xem retailers.example.json
+
+Sử dụng:
+    python multi_retailer.py --metric total_revenue --year 2024 --top 10
+"""
+
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from API_kiotviet_NTV import KiotVietAPI
+from aggregation import METRICS, merge_sales_tables
+from config import Config
+
+METRIC_LABELS = {
+    'total_quantity': 'SỐ LƯỢNG BÁN',
+    'total_revenue': 'DOANH THU',
+    'invoice_count': 'SỐ ĐƠN HÀNG'
+}
+
+
+def load_retailers(path=None):
+    """Đọc danh sách retailer: [{name, retailer, client_id, client_secret | client_secret_env}]
+
+    client_secret_env là tên biến môi trường chứa secret, để không phải ghi secret vào file.
+    """
+    path = path or Config.RETAILERS_CONFIG_PATH
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+
+    retailers = []
+    for entry in entries:
+        client_secret = entry.get('client_secret') or os.getenv(entry.get('client_secret_env') or '', '')
+        missing = [
+            field for field, value in (
+                ('retailer', entry.get('retailer')),
+                ('client_id', entry.get('client_id')),
+                ('client_secret', client_secret)
+            ) if not value
+        ]
+        if missing:
+            raise ValueError(f"Retailer {entry.get('name') or entry.get('retailer')}: thiếu {', '.join(missing)}")
+
+        retailers.append({
+            'name': entry.get('name') or entry['retailer'],
+            'retailer': entry['retailer'],
+            'client_id': entry['client_id'],
+            'client_secret': client_secret
+        })
+    return retailers
+
+
+def cache_db_path_for(retailer):
+    """File kho hóa đơn riêng cho từng retailer (id hóa đơn chỉ duy nhất trong một retailer)"""
+    root, ext = os.path.splitext(Config.CACHE_DB_PATH)
+    safe_name = re.sub(r'[^\w.-]', '_', retailer)
+    return f"{root}_{safe_name}{ext or '.db'}"
+
+
+def format_metric(metric, value):
+    """Hiển thị giá trị một chỉ số"""
+    if metric == 'total_revenue':
+        return f"{value:,.0f} VNĐ"
+    return f"{value:,}"
+
+
+class MultiRetailerReport:
+    def __init__(self, retailers, max_workers=None):
+        """
+        retailers: danh sách từ load_retailers
+        max_workers: số retailer tải song song (mặc định RETAILER_CONCURRENCY)
+        """
+        self.retailers = retailers
+        self.max_workers = max_workers or Config.RETAILER_CONCURRENCY
+
+        # Mỗi cửa hàng một client: rate limit theo retailer, token cache theo client_id
+        self.apis = {
+            shop['name']: KiotVietAPI(
+                retailer=shop['retailer'],
+                client_id=shop['client_id'],
+                client_secret=shop['client_secret'],
+                cache_db_path=cache_db_path_for(shop['retailer'])
+            )
+            for shop in retailers
+        }
+
+    def _shop_sales(self, name, from_date, to_date):
+        """Bảng tổng hợp của một cửa hàng, None nếu không kết nối được"""
+        api = self.apis[name]
+        if not api.get_access_token():
+            print(f"❌ {name}: không thể xác thực với KiotViet API")
+            return None
+        return api.get_product_sales(from_date, to_date)
+
+    def get_product_sales(self, from_date, to_date):
+        """Tải song song bảng tổng hợp của các cửa hàng
+
+        Trả về (bảng gộp toàn chuỗi, {cửa hàng: bảng tổng hợp}, [cửa hàng không lấy được dữ liệu]).
+        """
+        names = list(self.apis)
+        print(f"🏪 Đang tải dữ liệu {len(names)} cửa hàng ({min(self.max_workers, len(names))} song song)...")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            tables = list(executor.map(lambda name: self._shop_sales(name, from_date, to_date), names))
+
+        shop_tables = {name: table for name, table in zip(names, tables) if table is not None}
+        failed = [name for name, table in zip(names, tables) if table is None]
+        return merge_sales_tables(shop_tables), shop_tables, failed
+
+    def get_top_products(self, metric='total_revenue', month=None, year=2025, top_n=10):
+        """Top N sản phẩm toàn chuỗi theo một chỉ số, kèm top N của từng cửa hàng"""
+        if metric not in METRICS:
+            raise ValueError(f"Chỉ số không hợp lệ: {metric}")
+
+        from_date, to_date = KiotVietAPI.get_period(month, year)
+        merged, shop_tables, failed = self.get_product_sales(from_date, to_date)
+
+        top_products = merged.top(metric, top_n)
+        shop_tops = {name: table.top(metric, top_n) for name, table in shop_tables.items()}
+
+        self._print_chain_report(top_products, shop_tops, shop_tables, failed, metric, month, year, top_n)
+        return top_products, shop_tops
+
+    def _print_chain_report(self, top_products, shop_tops, shop_tables, failed, metric, month, year, top_n):
+        """Hiển thị top toàn chuỗi và top từng cửa hàng"""
+        period_text = KiotVietAPI.get_period_text(month, year)
+        label = METRIC_LABELS[metric]
+        invoice_total = sum(table.invoice_total for table in shop_tables.values())
+
+        print(f"\n🏆 TOP {top_n} SẢN PHẨM TOÀN CHUỖI THEO {label} {period_text}")
+        print(f"🏪 {len(shop_tables)} cửa hàng, {invoice_total:,} hóa đơn")
+        print("=" * 80)
+
+        for i, (_, data) in enumerate(top_products, 1):
+            print(f"{i:2d}. {data['name'][:50]}")
+            print(f"    📦 Số lượng bán: {data['total_quantity']:,}")
+            print(f"    💰 Doanh thu: {data['total_revenue']:,.0f} VNĐ")
+            print(f"    📋 Số đơn hàng: {data['invoice_count']}")
+
+            total = data[metric]
+            shops = sorted(data['shops'].items(), key=lambda item: item[1][metric], reverse=True)
+            for shop, shop_data in shops:
+                share = shop_data[metric] / total * 100 if total else 0
+                print(f"       🏪 {shop}: {format_metric(metric, shop_data[metric])} ({share:.1f}%)")
+            print("-" * 60)
+
+        for name, shop_top in shop_tops.items():
+            print(f"\n🏪 {name.upper()} - TOP {top_n} THEO {label} ({shop_tables[name].invoice_total:,} hóa đơn)")
+            print("-" * 60)
+            for i, (_, data) in enumerate(shop_top, 1):
+                print(f"{i:2d}. {data['name'][:50]} - {format_metric(metric, data[metric])}")
+
+        if failed:
+            print(f"\n⚠️ Không lấy được dữ liệu của: {', '.join(failed)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Báo cáo top sản phẩm cho nhiều retailer KiotViet")
+    parser.add_argument('--config', help="File JSON danh sách retailer (mặc định RETAILERS_CONFIG_PATH)")
+    parser.add_argument('--metric', choices=METRICS, default='total_revenue')
+    parser.add_argument('--month', type=int)
+    parser.add_argument('--year', type=int, default=2024)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    try:
+        retailers = load_retailers(args.config)
+    except (OSError, ValueError) as e:
+        print(f"❌ Không đọc được danh sách retailer: {e}")
+        return
+
+    report = MultiRetailerReport(retailers)
+    report.get_top_products(args.metric, args.month, args.year, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Pagination
+Chống lệch phân trang theo currentItem, dùng chung cho client đồng bộ và client asyncio
+
+Hóa đơn bị sửa trong lúc đang phân trang làm các bản ghi dịch chỗ: có hóa đơn bị trả về
+hai lần, có hóa đơn bị bỏ sót. Hóa đơn mới thêm vào cuối chỉ làm `total` tăng, các bản ghi
+đã tải không dịch chỗ nên chỉ cần đi tiếp tới cuối mới. Ngược lại khi một hóa đơn ở trang
+đã tải rời khỏi cửa sổ lastModified, `total` giảm và các bản ghi phía sau dịch lên: hóa đơn
+ngay trước trang đầu tiên thấy `total` mới bị đẩy lên trang đã tải và bị bỏ sót, trong khi
+số id đã gặp vẫn bằng `total` mới. Vì vậy chỗ `total` giảm giữa hai trang liền nhau được
+ghi lại để tải lại riêng vài trang quanh đó, không phải duyệt lại cả cửa sổ.
+"""
+
+
+class DriftGuard:
+    """Bỏ hóa đơn trùng giữa các trang và các lượt duyệt, ghi lại các currentItem cần tải lại"""
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+        self.seen_ids = set()
+        self.total = None
+        self.first_total = None
+        # Có lúc nào `total` giảm giữa hai trang liền nhau hay không (để ghi log)
+        self.shrunk = False
+        # currentItem của trang tiếp theo nếu trang vừa duyệt còn đầy (None: đã tới trang cuối)
+        self.next_offset = None
+        self._gaps = set()
+        self._previous_total = None
+
+    def start_pass(self):
+        """Bắt đầu một lượt duyệt mới từ trang đầu"""
+        self._previous_total = None
+        self.next_offset = None
+
+    def filter(self, page, offset=None):
+        """Trang đã bỏ các hóa đơn gặp rồi; ghi nhận `total` của trang
+
+        offset: currentItem của trang trong lượt duyệt (các trang phải được đưa vào theo đúng
+        thứ tự); None với trang tải lại để lấp chỗ trống.
+        """
+        total = page.get('total')
+        if total is not None:
+            if self.first_total is None:
+                self.first_total = total
+            if offset is not None:
+                if self._previous_total is not None and total < self._previous_total:
+                    # Các bản ghi dịch lên tối đa (độ giảm) vị trí: chúng nằm ngay trước trang này
+                    self.shrunk = True
+                    start = max(0, offset - (self._previous_total - total))
+                    self._gaps.update(range(start, offset, self.page_size))
+                self._previous_total = total
+            self.total = total
+
+        if offset is not None:
+            self.next_offset = None if is_last_page(page, self.page_size) else offset + self.page_size
+
+        fresh = []
+        for invoice in page.get('data') or []:
+            invoice_id = invoice.get('id')
+            if invoice_id in self.seen_ids:
+                continue
+            if invoice_id is not None:
+                self.seen_ids.add(invoice_id)
+            fresh.append(invoice)
+        return dict(page, data=fresh)
+
+    def take_gaps(self):
+        """Các currentItem cần tải lại (mỗi giá trị một trang), theo thứ tự tăng dần"""
+        gaps, self._gaps = sorted(self._gaps), set()
+        return gaps
+
+    def complete(self):
+        """Đã đủ: không còn chỗ trống chờ tải lại và đã gặp không ít hơn `total` mới nhất"""
+        return self.total is None or (not self._gaps and len(self.seen_ids) >= self.total)
+
+    def describe(self):
+        """Mô tả tình trạng thiếu/lệch để ghi log"""
+        described = f"mới có {len(self.seen_ids)}/{self.total} hóa đơn"
+        if self.shrunk:
+            return f"số hóa đơn giảm trong lúc phân trang ({self.first_total} → {self.total}), {described}"
+        return described
+
+
+def is_last_page(page, page_size):
+    """Trang lỗi hoặc không đủ page_size bản ghi là trang cuối"""
+    return page is None or len(page.get('data') or []) < page_size
+
+
+def remaining_page_offsets(first_page, page_size):
+    """currentItem của các trang còn lại sau trang đầu, dùng chung cho iter_pages của hai client
+
+    Trả về range rỗng nếu trang đầu đã là trang cuối, None nếu API không trả về `total`
+    (khi đó phải tải tuần tự cho đến trang cuối).
+    """
+    if is_last_page(first_page, page_size):
+        return range(0)
+    total = first_page.get('total')
+    if total is None:
+        return None
+    return range(page_size, total, page_size)
@@ -0,0 +1,90 @@
+"""
+Prefetch Worker
+Luồng chạy nền cho tool tương tác: định kỳ tải và tổng hợp sẵn tháng hiện tại và các kỳ vừa được hỏi
+để câu hỏi tiếp theo được trả lời từ dữ liệu đã có, không phải chờ tải lại từ API
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from config import Config
+from telemetry import BACKGROUND_THREAD_PREFIX, get_logger
+
+logger = get_logger(Config.LOG_LEVEL)
+
+
+class PrefetchWorker:
+    def __init__(self, api, interval=300, max_periods=4):
+        """
+        api: KiotVietAPI dùng để tải và giữ bảng tổng hợp
+        interval: số giây giữa hai lần làm mới
+        max_periods: số kỳ vừa hỏi được giữ sẵn (ngoài tháng hiện tại)
+        """
+        self.api = api
+        self.interval = interval
+        self.max_periods = max_periods
+
+        # Kỳ vừa hỏi theo thứ tự LRU: (month, year) -> có cần danh mục sản phẩm (lợi nhuận) không
+        self._periods = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_refresh = None
+
+    def track(self, month, year, catalog=False):
+        """Ghi nhận một kỳ vừa được hỏi để lần làm mới sau giữ sẵn"""
+        with self._lock:
+            key = (month, year)
+            self._periods[key] = self._periods.pop(key, False) or catalog
+            while len(self._periods) > self.max_periods:
+                self._periods.popitem(last=False)
+
+    def periods(self):
+        """Các kỳ cần giữ sẵn: tháng hiện tại trước, rồi các kỳ vừa hỏi (mới nhất trước)"""
+        now = datetime.now()
+        with self._lock:
+            recent = list(reversed(self._periods.items()))
+        periods = OrderedDict([((now.month, now.year), False)])
+        for key, catalog in recent:
+            periods[key] = periods.get(key, False) or catalog
+        return list(periods.items())
+
+    def refresh(self):
+        """Làm mới một lượt; kỳ đã kết thúc chỉ tính một lần, kỳ đang diễn ra tính lại mỗi lượt"""
+        started = time.perf_counter()
+        periods = self.periods()
+        for (month, year), catalog in periods:
+            if self._stop.is_set():
+                return
+            try:
+                from_date, to_date = self.api.get_period(month, year)
+                closed = to_date.date() < datetime.now().date()
+                self.api.get_product_sales(from_date, to_date, refresh=not closed)
+                if catalog:
+                    self.api.sync_products()
+            except Exception as e:
+                # Lỗi mạng tạm thời không được làm dừng luồng nền, lượt sau thử lại
+                logger.warning(f"⚠️ Không làm mới được dữ liệu {self.api.get_period_text(month, year)}: {e}")
+
+        self.last_refresh = time.time()
+        logger.debug(f"🔄 Đã làm mới {len(periods)} kỳ trong {time.perf_counter() - started:.2f}s")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Chạy luồng nền (daemon, tự dừng khi thoát chương trình)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{BACKGROUND_THREAD_PREFIX}prefetch", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Dừng luồng nền sau khi xong kỳ đang làm mới"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
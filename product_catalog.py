@@ -0,0 +1,194 @@
+"""
+Product Catalog
+Danh mục sản phẩm KiotViet lưu cục bộ (SQLite) kèm giá vốn và tồn kho từ inventories
+Đồng bộ tăng dần theo mốc modifiedDate, chỉ ghi lại sản phẩm có nội dung thay đổi (so hash)
+Bảng tổng hợp bán hàng được ghép với danh mục trong bộ nhớ để tính lợi nhuận và tồn kho
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from aggregation import METRICS, ProductSalesTable, as_number
+from invoice_store import DATETIME_FORMAT
+
+# Chỉ số có thêm sau khi ghép với danh mục
+CATALOG_METRICS = ('total_profit', 'on_hand')
+
+
+class CatalogSalesTable(ProductSalesTable):
+    """Bảng tổng hợp đã ghép danh mục: có thêm giá vốn, lợi nhuận, tồn kho"""
+
+    metrics = METRICS + CATALOG_METRICS
+
+    def rank_key(self, metric):
+        """Xếp hạng lợi nhuận: sản phẩm chưa có giá vốn (lợi nhuận = doanh thu) đứng sau mọi sản phẩm có giá vốn"""
+        if metric == 'total_profit':
+            return lambda item: (item[1]['cost'] is not None, item[1]['total_profit'])
+        return super().rank_key(metric)
+
+
+def product_cost(product):
+    """Giá vốn và tồn kho của sản phẩm từ inventories các chi nhánh
+
+    Giá vốn là trung bình có trọng số theo tồn kho (trung bình thường nếu không còn hàng),
+    None nếu KiotViet không trả về giá vốn.
+    """
+    inventories = product.get('inventories') or []
+    on_hand = sum(inventory.get('onHand') or 0 for inventory in inventories)
+
+    costs = [
+        (inventory['cost'], max(inventory.get('onHand') or 0, 0))
+        for inventory in inventories
+        if inventory.get('cost') is not None
+    ]
+    if not costs:
+        return None, on_hand
+
+    stock = sum(weight for _, weight in costs)
+    if stock > 0:
+        return sum(cost * weight for cost, weight in costs) / stock, on_hand
+    return sum(cost for cost, _ in costs) / len(costs), on_hand
+
+
+class ProductCatalog:
+    def __init__(self, db_path=None):
+        """db_path=None: chỉ giữ trong bộ nhớ (khi tắt CACHE_ENABLED)"""
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path or ':memory:', check_same_thread=False)
+        self._create_tables()
+        self._products = self._load_products()
+
+    def _create_tables(self):
+        """Tạo bảng nếu chưa tồn tại"""
+        with self._lock:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS catalog_products (
+                    id INTEGER PRIMARY KEY,
+                    code TEXT,
+                    name TEXT,
+                    cost REAL,
+                    on_hand REAL NOT NULL,
+                    modified_date TEXT,
+                    content_hash TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS catalog_sync_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    watermark TEXT NOT NULL,
+                    synced_at TEXT NOT NULL
+                );
+            """)
+            self.conn.commit()
+
+    def _load_products(self):
+        """Nạp toàn bộ danh mục vào bộ nhớ (dict theo id) để ghép với báo cáo"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, code, name, cost, on_hand, content_hash FROM catalog_products"
+            ).fetchall()
+        return {
+            product_id: {'code': code, 'name': name, 'cost': cost, 'on_hand': as_number(on_hand), 'hash': content_hash}
+            for product_id, code, name, cost, on_hand, content_hash in rows
+        }
+
+    def __len__(self):
+        return len(self._products)
+
+    def get(self, product_id):
+        """Thông tin sản phẩm (code, name, cost, on_hand), None nếu không có trong danh mục"""
+        return self._products.get(product_id)
+
+    def save_products(self, products, removed_ids=()):
+        """Ghi các sản phẩm vừa tải, bỏ qua sản phẩm không đổi nội dung; trả về số sản phẩm thay đổi"""
+        rows = []
+        for product in products:
+            product_id = product.get('id')
+            if product_id is None:
+                continue
+
+            cost, on_hand = product_cost(product)
+            entry = {
+                'code': product.get('code'),
+                'name': product.get('fullName') or product.get('name'),
+                'cost': cost,
+                'on_hand': as_number(on_hand)
+            }
+            content_hash = hashlib.md5(json.dumps(entry, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+            current = self._products.get(product_id)
+            if current is not None and current['hash'] == content_hash:
+                continue
+
+            rows.append((product_id, entry['code'], entry['name'], cost, on_hand,
+                         (product.get('modifiedDate') or product.get('createdDate') or '')[:19], content_hash))
+            self._products[product_id] = dict(entry, hash=content_hash)
+
+        removed_ids = [product_id for product_id in removed_ids if product_id in self._products]
+        for product_id in removed_ids:
+            del self._products[product_id]
+
+        if rows or removed_ids:
+            with self._lock:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO catalog_products "
+                    "(id, code, name, cost, on_hand, modified_date, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                self.conn.executemany(
+                    "DELETE FROM catalog_products WHERE id = ?",
+                    [(product_id,) for product_id in removed_ids]
+                )
+                self.conn.commit()
+        return len(rows) + len(removed_ids)
+
+    def get_sync_state(self):
+        """Lấy mốc đồng bộ của danh mục (None nếu chưa từng đồng bộ)"""
+        with self._lock:
+            row = self.conn.execute("SELECT watermark, synced_at FROM catalog_sync_state WHERE id = 1").fetchone()
+        if not row:
+            return None
+        return {
+            'watermark': datetime.strptime(row[0], DATETIME_FORMAT),
+            'synced_at': datetime.strptime(row[1], DATETIME_FORMAT)
+        }
+
+    def set_sync_state(self, watermark, synced_at):
+        """Lưu mốc đồng bộ của danh mục"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO catalog_sync_state (id, watermark, synced_at) VALUES (1, ?, ?)",
+                (watermark.strftime(DATETIME_FORMAT), synced_at.strftime(DATETIME_FORMAT))
+            )
+            self.conn.commit()
+
+    def join_sales_table(self, table):
+        """Ghép bảng tổng hợp bán hàng với danh mục, trả về bảng mới có lợi nhuận và tồn kho
+
+        Lợi nhuận = doanh thu - số lượng bán x giá vốn hiện tại. Sản phẩm không có giá vốn
+        (đã xóa khỏi danh mục hoặc KiotViet không trả cost) được tính giá vốn 0, cost=None
+        và xếp sau các sản phẩm có giá vốn khi xếp hạng theo lợi nhuận.
+        Không sửa bảng gốc (có thể đang được cache cho kỳ đã kết thúc).
+        """
+        joined = CatalogSalesTable()
+        joined.invoice_total = table.invoice_total
+
+        for product_id, data in table.products.items():
+            product = self._products.get(product_id)
+            cost = product['cost'] if product else None
+            total_cost = data['total_quantity'] * cost if cost is not None else 0
+            joined.products[product_id] = dict(
+                data,
+                cost=cost,
+                total_cost=as_number(total_cost),
+                total_profit=as_number(data['total_revenue'] - total_cost),
+                on_hand=product['on_hand'] if product else 0
+            )
+        return joined
+
+    def close(self):
+        """Đóng kết nối SQLite"""
+        with self._lock:
+            self.conn.close()
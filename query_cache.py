@@ -0,0 +1,102 @@
+"""
+Query Cache
+Câu hỏi dạng chuẩn hóa (ReportQuery) và cache kết quả LRU cho answer_question
+Kỳ đã kết thúc không hết hạn, kỳ đang diễn ra có TTL ngắn
+SingleFlight gộp các lần tính trùng khóa đang chạy đồng thời thành một
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Câu hỏi sau khi phân tích: metric là một trong aggregation.METRICS, month=None nghĩa là cả năm,
+# approximate=True là xếp hạng gần đúng bằng sketch (xem sketches.py)
+ReportQuery = namedtuple('ReportQuery', ['metric', 'month', 'year', 'top_n', 'approximate'], defaults=(False,))
+
+
+class ResultCache:
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Lấy kết quả còn hạn (None nếu không có hoặc đã hết hạn)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at is not None and time.time() >= expires_at:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Lưu kết quả; ttl=None nghĩa là không bao giờ hết hạn"""
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            # Bỏ các kết quả ít dùng nhất khi vượt quá kích thước
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight:
+    """Gộp các lời gọi cùng khóa đang chạy đồng thời: chỉ luồng đầu tiên tính, các luồng khác chờ kết quả"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """Gọi func() cho khóa; trả về (kết quả, True nếu dùng chung kết quả của luồng khác)
+
+        Lỗi của luồng tính được ném lại cho mọi luồng đang chờ.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+        else:
+            try:
+                call['result'] = func()
+            except Exception as e:
+                call['error'] = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call['done'].set()
+
+        if call['error'] is not None:
+            raise call['error']
+        return call['result'], not leader
+
+
+_shared_result_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_result_cache(max_entries=128):
+    """Cache dùng chung trong tiến trình (các script phân tích chạy cùng tiến trình dùng lại kết quả)"""
+    global _shared_result_cache
+    with _shared_lock:
+        if _shared_result_cache is None:
+            _shared_result_cache = ResultCache(max_entries)
+        return _shared_result_cache
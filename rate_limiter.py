@@ -0,0 +1,153 @@
+"""
+Rate Limiter
+Token bucket giới hạn tốc độ gọi KiotViet API
+Dùng chung giữa các luồng trong một tiến trình và, qua một file trạng thái có khóa,
+giữa các tiến trình trên cùng một máy (các script phân tích chạy song song)
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def locked_file(path):
+    """Mở file trạng thái và giữ khóa độc quyền giữa các tiến trình (dùng chung với token cache)"""
+    with open(path, 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.01)
+        try:
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class RateLimiter:
+    def __init__(self, rate, burst=None, state_path=None, key='default'):
+        """
+        rate: số request tối đa mỗi giây (<= 0 để tắt giới hạn)
+        burst: số request được phép dồn một lúc (mặc định bằng rate)
+        state_path: file trạng thái dùng chung giữa các tiến trình (None: chỉ trong tiến trình)
+        key: tên bucket trong file trạng thái (mỗi retailer một quota)
+        """
+        self.rate = rate
+        self.burst = max(burst or rate, 1)
+        self.state_path = state_path
+        self.key = key
+        self._lock = threading.Lock()
+
+        self._tokens = self.burst
+        self._updated_at = time.time()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def acquire(self):
+        """Chờ cho đến khi được phép gửi thêm một request"""
+        if not self.enabled:
+            return
+
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self):
+        """Thử lấy một token không chờ, trả về số giây cần chờ (0 nếu đã lấy được)
+
+        Dùng cho code asyncio: tự await asyncio.sleep(wait) thay vì chặn cả event loop.
+        """
+        if not self.enabled:
+            return 0
+
+        with self._lock:
+            if self.state_path:
+                return self._try_acquire_shared()
+            return self._try_acquire_local()
+
+    def _take(self, tokens, updated_at, now):
+        """Nạp thêm token theo thời gian đã trôi qua và thử lấy một token
+
+        Trả về (tokens, updated_at, thời gian cần chờ).
+        """
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, now, 0
+        return tokens, now, (1 - tokens) / self.rate
+
+    def _try_acquire_local(self):
+        """Lấy token từ bucket trong bộ nhớ"""
+        self._tokens, self._updated_at, wait = self._take(self._tokens, self._updated_at, time.time())
+        return wait
+
+    def _try_acquire_shared(self):
+        """Lấy token từ bucket lưu trong file trạng thái dùng chung"""
+        with locked_file(self.state_path) as f:
+            f.seek(0)
+            try:
+                state = json.loads(f.read().decode('utf-8') or '{}')
+            except ValueError:
+                state = {}
+
+            now = time.time()
+            tokens, updated_at = state.get(self.key, (self.burst, now))
+            tokens, updated_at, wait = self._take(tokens, updated_at, now)
+            state[self.key] = (tokens, updated_at)
+
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state).encode('utf-8'))
+            f.flush()
+        return wait
+
+
+class RateLimitedRetry(Retry):
+    """Retry của urllib3, mỗi lần thử lại cũng phải xin token từ rate limiter"""
+
+    rate_limiter = None
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.rate_limiter = self.rate_limiter
+        return retry
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """HTTPAdapter xin token từ rate limiter trước mỗi request"""
+
+    def __init__(self, rate_limiter, **kwargs):
+        self.rate_limiter = rate_limiter
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        self.rate_limiter.acquire()
+        return super().send(request, **kwargs)
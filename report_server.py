@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Report Server
+Dịch vụ HTTP/JSON chạy lâu dài trên máy cục bộ, bọc một KiotVietAPI dùng chung:
+dashboard và các script phân tích hỏi qua HTTP thay vì mỗi lần tự xác thực và tải lại hóa đơn
+Các request giống nhau đến cùng lúc được gộp thành một lần tải (single-flight)
+
+Endpoint (GET):
+    /top?metric=total_revenue&year=2024&month=5&top_n=10&approximate=false
+    /ask?q=top 10 sản phẩm bán chạy nhất năm 2024
+    /sales?year=2024&month=5&catalog=false   (bảng tổng hợp đầy đủ theo sản phẩm)
+    /health
+    /metrics                                  (Prometheus text)
+
+Sử dụng:
+    python report_server.py --port 8766
+"""
+
+import argparse
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from API_kiotviet_NTV import KiotVietAPI
+from aggregation import METRICS
+from config import Config
+from query_cache import ReportQuery, SingleFlight
+
+# Chỉ số /top nhận được: các chỉ số của bảng tổng hợp và lợi nhuận (ghép danh mục sản phẩm)
+QUERY_METRICS = METRICS + ('total_profit',)
+
+
+def parse_bool(value):
+    """Đọc tham số true/false trên URL"""
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def products_to_json(products):
+    """Danh sách (product_id, data) -> danh sách dict để trả về JSON"""
+    return [dict(data, product_id=product_id) for product_id, data in products]
+
+
+class ReportServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, api):
+        super().__init__(address, ReportRequestHandler)
+        self.api = api
+        self.single_flight = SingleFlight()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Chạy server trong luồng nền"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def run_query(self, query):
+        """Top N của một ReportQuery: từ cache kết quả, hoặc tính một lần cho mọi request đang chờ
+
+        Trả về (danh sách sản phẩm, nguồn: 'cache' | 'computed' | 'shared').
+        """
+        api = self.api
+        if api.prefetcher:
+            api.prefetcher.track(query.month, query.year, catalog=query.metric == 'total_profit')
+
+        key = api.query_cache_key(query)
+        top_products = api.result_cache.get(key)
+        if top_products is not None:
+            return top_products, 'cache'
+
+        def compute():
+            # Request vừa chờ xong lượt tính trước có thể đã có sẵn kết quả
+            cached = api.result_cache.get(key)
+            if cached is not None:
+                return cached
+            failures = api.fetch_failures()
+            result = api.get_ranking(query)
+            api.result_cache.set(key, result, api.query_cache_ttl_for(query, complete=api.fetch_failures() == failures))
+            return result
+
+        top_products, shared = self.single_flight.do(key, compute)
+        return top_products, 'shared' if shared else 'computed'
+
+    def get_sales(self, month, year, catalog=False):
+        """Bảng tổng hợp đầy đủ của một kỳ (single-flight theo kỳ)"""
+        api = self.api
+        from_date, to_date = api.get_period(month, year)
+        if catalog:
+            compute = lambda: api.get_product_sales_with_catalog(from_date, to_date)
+        else:
+            compute = lambda: api.get_product_sales(from_date, to_date)
+        table, shared = self.single_flight.do(('sales', from_date, to_date, catalog), compute)
+        return table, 'shared' if shared else 'computed'
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, ensure_ascii=False), 'application/json; charset=utf-8')
+
+    def _period_params(self, params):
+        """(month, year) từ tham số URL, mặc định cả năm hiện tại"""
+        month = int(params['month']) if params.get('month') else None
+        year = int(params.get('year') or datetime.now().year)
+        if month is not None and not 1 <= month <= 12:
+            raise ValueError(f"Tháng không hợp lệ: {month}")
+        return month, year
+
+    def _query_params(self, params):
+        """ReportQuery từ tham số URL của /top"""
+        metric = params.get('metric', 'total_revenue')
+        if metric not in QUERY_METRICS:
+            raise ValueError(f"Chỉ số không hợp lệ: {metric}")
+        month, year = self._period_params(params)
+        approximate = parse_bool(params.get('approximate', 'false')) and metric in METRICS
+        top_n = params.get('top_n', '10')
+        if not top_n.isdigit() or int(top_n) < 1:
+            raise ValueError(f"top_n không hợp lệ: {top_n}")
+        return ReportQuery(metric, month, year, int(top_n), approximate)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        server = self.server
+        started = time.perf_counter()
+
+        try:
+            if url.path == '/health':
+                self._send_json(200, {
+                    'status': 'ok',
+                    'retailer': server.api.retailer,
+                    'cached_results': len(server.api.result_cache)
+                })
+                return
+
+            if url.path == '/metrics':
+                self._send(200, server.api.telemetry.to_prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+                return
+
+            if url.path in ('/top', '/ask'):
+                if url.path == '/ask':
+                    query = server.api.parse_question(params.get('q', ''))
+                    if query is None:
+                        self._send_json(400, {'error': "Không hiểu câu hỏi", 'question': params.get('q', '')})
+                        return
+                else:
+                    query = self._query_params(params)
+
+                top_products, source = server.run_query(query)
+                self._send_json(200, {
+                    'query': query._asdict(),
+                    'source': source,
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+                    'products': products_to_json(top_products)
+                })
+                return
+
+            if url.path == '/sales':
+                month, year = self._period_params(params)
+                table, source = server.get_sales(month, year, parse_bool(params.get('catalog', 'false')))
+                self._send_json(200, {
+                    'month': month,
+                    'year': year,
+                    'source': source,
+                    'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+                    'invoice_total': table.invoice_total,
+                    'products': products_to_json(table.products.items())
+                })
+                return
+
+            self._send_json(404, {'error': 'Not Found'})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            # Lỗi khi tải từ KiotViet (mạng, xác thực...): báo cho client, server vẫn chạy tiếp
+            self._send_json(502, {'error': f"{type(e).__name__}: {e}"})
+
+
+def create_server(api=None, host=None, port=None):
+    """Tạo report server (port=0 để hệ điều hành tự chọn cổng trống)"""
+    api = api or KiotVietAPI()
+    # Bảng tổng hợp của kỳ đang diễn ra được dùng chung giữa các request trong QUERY_CACHE_TTL giây
+    api.warm_table_max_age = max(api.warm_table_max_age, api.query_cache_ttl)
+    return ReportServer(
+        (host or Config.REPORT_SERVER_HOST, Config.REPORT_SERVER_PORT if port is None else port),
+        api
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report server cho KiotViet API Tool")
+    parser.add_argument('--host', help="Mặc định REPORT_SERVER_HOST")
+    parser.add_argument('--port', type=int, help="Mặc định REPORT_SERVER_PORT")
+    args = parser.parse_args()
+
+    api = KiotVietAPI()
+    if not api.get_access_token():
+        print("❌ Không thể kết nối. Vui lòng kiểm tra thông tin kết nối.")
+        return
+
+    if Config.PREFETCH_ENABLED:
+        api.start_prefetch()
+    server = create_server(api, args.host, args.port)
+    print(f"🚀 Report server đang chạy tại {server.base_url}")
+    print(f"💡 Thử: {server.base_url}/ask?q=top 10 sản phẩm bán chạy nhất năm 2024")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Dừng server")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Heavy-hitter Sketches
+Xếp hạng top N gần đúng trong bộ nhớ cố định bằng thuật toán Space-Saving (có trọng số)
+Duyệt luồng hóa đơn một lần, không giữ bảng tổng hợp của mọi sản phẩm, mỗi kết quả kèm sai số tối đa
+"""
+
+import heapq
+import math
+
+# Chỉ số xếp hạng gần đúng được (lợi nhuận cần ghép danh mục sản phẩm nên chỉ có bản chính xác)
+APPROX_METRICS = ('total_quantity', 'total_revenue', 'invoice_count')
+
+
+class SpaceSaving:
+    """Space-Saving có trọng số với tối đa `capacity` bộ đếm
+
+    Mỗi khóa đang được theo dõi có (count, error): giá trị thật nằm trong [count - error, count].
+    Với tổng trọng số N, error luôn <= N / capacity, và mọi khóa có giá trị thật > N / capacity
+    chắc chắn đang được theo dõi. Trọng số <= 0 (hàng trả lại) bị bỏ qua.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counters = {}
+        self.total = 0
+
+        # Heap (count, thứ tự, khóa) để tìm bộ đếm nhỏ nhất; mục cũ bị bỏ qua khi lấy ra
+        self._heap = []
+        self._sequence = 0
+
+    def _push(self, key, count):
+        self._sequence += 1
+        heapq.heappush(self._heap, (count, self._sequence, key))
+        # Dọn các mục cũ để heap không lớn quá vài lần số bộ đếm
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [
+                (counter[0], self._sequence, key) for key, counter in self.counters.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        """Lấy ra khóa có count nhỏ nhất đang theo dõi"""
+        while True:
+            count, _, key = heapq.heappop(self._heap)
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == count:
+                return key
+
+    def update(self, key, weight=1):
+        """Cộng trọng số cho một khóa, trả về khóa bị loại khỏi danh sách theo dõi (nếu có)"""
+        if weight <= 0:
+            return None
+        self.total += weight
+
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+            self._push(key, counter[0])
+            return None
+
+        evicted = None
+        error = 0
+        if len(self.counters) >= self.capacity:
+            # Khóa mới thay khóa nhỏ nhất và kế thừa count của nó làm sai số
+            evicted = self._pop_min()
+            error = self.counters.pop(evicted)[0]
+
+        self.counters[key] = [error + weight, error]
+        self._push(key, error + weight)
+        return evicted
+
+    def min_count(self):
+        """Count nhỏ nhất khi đã đầy (cận trên giá trị thật của mọi khóa không được theo dõi)"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    def top(self, top_n):
+        """Top N khóa theo count: [(khóa, count, error, chắc chắn thuộc top N)]
+
+        Một khóa chắc chắn thuộc top N khi cận dưới (count - error) của nó không nhỏ hơn
+        count của khóa đứng thứ N+1 và của mọi khóa không được theo dõi.
+        """
+        ranked = heapq.nlargest(top_n + 1, self.counters.items(), key=lambda item: item[1][0])
+        threshold = max(ranked[top_n][1][0] if len(ranked) > top_n else 0, self.min_count())
+        return [
+            (key, count, error, count - error >= threshold)
+            for key, (count, error) in ranked[:top_n]
+        ]
+
+
+class ApproximateProductRanking:
+    """Xếp hạng sản phẩm gần đúng theo một chỉ số trên luồng hóa đơn
+
+    Bộ đếm của mỗi sản phẩm còn cộng các chỉ số khác trong lúc sản phẩm được theo dõi,
+    nên các chỉ số phụ là cận dưới (chính xác khi error của chỉ số xếp hạng bằng 0).
+    """
+
+    def __init__(self, metric, epsilon):
+        """epsilon: sai số tối đa tính theo tỷ lệ tổng của chỉ số (0.001 = 0,1%)"""
+        if metric not in APPROX_METRICS:
+            raise ValueError(f"Chỉ số không hỗ trợ xếp hạng gần đúng: {metric}")
+        self.metric = metric
+        self.epsilon = epsilon
+        self.sketch = SpaceSaving(math.ceil(1 / epsilon))
+        self.products = {}
+        self.invoice_total = 0
+
+    def add_invoice(self, invoice):
+        """Cộng các dòng chi tiết của một hóa đơn vào sketch"""
+        self.invoice_total += 1
+
+        # Gom theo sản phẩm trong hóa đơn (một lần cập nhật sketch mỗi sản phẩm); invoice_count đếm
+        # số dòng chi tiết giống bảng tổng hợp chính xác, để sai số báo ra đúng cho cả chỉ số này
+        lines = {}
+        for detail in invoice.get('invoiceDetails') or []:
+            product_id = detail.get('productId')
+            quantity = detail.get('quantity', 0)
+            line = lines.get(product_id)
+            if line is None:
+                line = lines[product_id] = [detail.get('productName', 'Không xác định'), 0, 0, 0]
+            line[1] += quantity
+            line[2] += quantity * detail.get('price', 0)
+            line[3] += 1
+
+        for product_id, (name, quantity, revenue, line_count) in lines.items():
+            weight = {'total_quantity': quantity, 'total_revenue': revenue, 'invoice_count': line_count}[self.metric]
+            evicted = self.sketch.update(product_id, weight)
+            if evicted is not None:
+                del self.products[evicted]
+
+            if product_id not in self.sketch.counters:
+                continue
+            product = self.products.get(product_id)
+            if product is None:
+                product = self.products[product_id] = {
+                    'name': name, 'total_quantity': 0, 'total_revenue': 0, 'invoice_count': 0
+                }
+            product['total_quantity'] += quantity
+            product['total_revenue'] += revenue
+            product['invoice_count'] += line_count
+
+    def add_invoices(self, invoices):
+        """Cộng nhiều hóa đơn (có thể là generator) vào sketch"""
+        for invoice in invoices:
+            self.add_invoice(invoice)
+        return self
+
+    def error_bound(self):
+        """Sai số tối đa được bảo đảm cho mọi sản phẩm: epsilon x tổng của chỉ số"""
+        return self.sketch.total / self.sketch.capacity
+
+    def top(self, top_n=10):
+        """Top N sản phẩm, trả về danh sách (product_id, data) như ProductSalesTable.top
+
+        data có thêm 'error' (giá trị thật của chỉ số nằm trong [data[metric] - error, data[metric]])
+        và 'guaranteed' (chắc chắn thuộc top N dù có sai số).
+        """
+        result = []
+        for product_id, count, error, guaranteed in self.sketch.top(top_n):
+            data = dict(self.products[product_id], error=error, guaranteed=guaranteed)
+            data[self.metric] = count
+            result.append((product_id, data))
+        return result
+
+    def __len__(self):
+        return len(self.sketch.counters)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Invoice Snapshot
+Lưu các dòng hóa đơn của một kỳ đã kết thúc ra file nhị phân dạng cột (.kvsnap) để lưu trữ và phân tích lại
+Cột số có độ rộng cố định, tên sản phẩm lưu thành một từ điển chuỗi; file không nén được mmap khi mở
+nên tổng hợp chạy thẳng trên vùng nhớ của file, không phải parse lại JSON
+
+Cấu trúc file (little-endian):
+    header   magic 'KVSNAP01', version, flags (bit 0: nén zlib), độ dài metadata
+    metadata JSON: kỳ, retailer, số hóa đơn, vị trí và kiểu từng cột
+    data     các cột nối tiếp nhau, mỗi cột bắt đầu ở vị trí chia hết cho 8
+
+Sử dụng:
+    python snapshot.py export --year 2024 kiotviet_2024.kvsnap
+    python snapshot.py export --year 2024 --month 5 --compress kiotviet_2024_05.kvsnap
+    python snapshot.py top kiotviet_2024.kvsnap --metric total_revenue --top 10
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from aggregation import METRICS
+from columnar import InvoiceLines
+
+MAGIC = b'KVSNAP01'
+VERSION = 1
+FLAG_COMPRESSED = 1
+HEADER = struct.Struct('<8sIII')
+
+# Cột dòng hóa đơn: tên -> typecode (độ rộng cố định, giống nhau trên mọi nền tảng)
+LINE_COLUMNS = {
+    'product_index': 'i',
+    'quantity': 'd',
+    'price': 'd',
+    'invoice_id': 'q',
+    'timestamp': 'q'
+}
+
+
+def _align(offset, alignment=8):
+    return -(-offset // alignment) * alignment
+
+
+def write_snapshot(path, lines, metadata=None, compress=False):
+    """Ghi InvoiceLines ra file snapshot, trả về số byte đã ghi
+
+    metadata: thông tin thêm lưu kèm (kỳ, retailer...). compress=True nén zlib phần dữ liệu:
+    file nhỏ hơn nhưng khi mở phải giải nén vào bộ nhớ thay vì mmap.
+    """
+    names = [str(name).encode('utf-8') for name in lines.product_names]
+    name_offsets = array('q', [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+
+    columns = {name: array(typecode, getattr(lines, name)) for name, typecode in LINE_COLUMNS.items()}
+    columns['product_ids'] = array('q', lines.product_ids)
+    columns['name_offsets'] = name_offsets
+    if sys.byteorder != 'little':
+        for values in columns.values():
+            values.byteswap()
+
+    # Ghép các cột, mỗi cột căn theo 8 byte để mmap xong có thể ép kiểu trực tiếp
+    data = bytearray()
+    layout = {}
+    for name, values in columns.items():
+        data.extend(b'\0' * (_align(len(data)) - len(data)))
+        layout[name] = [len(data), len(values), values.typecode]
+        data.extend(values.tobytes())
+    data.extend(b'\0' * (_align(len(data)) - len(data)))
+    layout['names'] = [len(data), sum(len(name) for name in names), 'B']
+    data.extend(b''.join(names))
+
+    meta = dict(metadata or {}, invoice_total=lines.invoice_total, line_count=len(lines),
+                product_count=len(names), columns=layout, data_size=len(data))
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    meta_bytes += b' ' * (_align(HEADER.size + len(meta_bytes)) - HEADER.size - len(meta_bytes))
+
+    flags = FLAG_COMPRESSED if compress else 0
+    payload = zlib.compress(bytes(data), 6) if compress else data
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, flags, len(meta_bytes)))
+        f.write(meta_bytes)
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return HEADER.size + len(meta_bytes) + len(payload)
+
+
+def read_snapshot(path):
+    """Mở file snapshot, trả về (InvoiceLines chỉ đọc, metadata)
+
+    File không nén được mmap: các cột là memoryview trỏ thẳng vào file, chỉ trang nào được
+    đọc mới nạp vào bộ nhớ. Vùng mmap được giữ bởi các cột và tự đóng khi không còn dùng.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path}: không phải file snapshot")
+        magic, version, flags, meta_size = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: không phải file snapshot")
+        if version > VERSION:
+            raise ValueError(f"{path}: snapshot phiên bản {version} mới hơn phiên bản hỗ trợ ({VERSION})")
+
+        meta = json.loads(f.read(meta_size).decode('utf-8'))
+        data_start = HEADER.size + meta_size
+        if flags & FLAG_COMPRESSED:
+            data = memoryview(zlib.decompress(f.read()))
+        else:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))[data_start:]
+
+    def column(name):
+        offset, count, typecode = meta['columns'][name]
+        values = data[offset:offset + count * struct.calcsize(typecode)]
+        if typecode == 'B':
+            return values
+        if sys.byteorder != 'little':
+            # Máy big-endian: phải sao chép để đổi thứ tự byte
+            values = array(typecode, values.tobytes())
+            values.byteswap()
+            return values
+        return values.cast(typecode)
+
+    name_offsets = column('name_offsets')
+    names = column('names')
+    product_names = [
+        names[name_offsets[i]:name_offsets[i + 1]].tobytes().decode('utf-8')
+        for i in range(meta['product_count'])
+    ]
+
+    lines = InvoiceLines.from_columns(
+        column('product_ids').tolist(),
+        product_names,
+        {name: column(name) for name in LINE_COLUMNS},
+        meta['invoice_total']
+    )
+    return lines, meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lưu/đọc snapshot hóa đơn dạng cột")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Tải hóa đơn của một kỳ và ghi ra file snapshot")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--year', type=int, required=True)
+    export_parser.add_argument('--month', type=int)
+    export_parser.add_argument('--compress', action='store_true', help="Nén zlib (nhỏ hơn, không mmap được)")
+
+    top_parser = subparsers.add_parser('top', help="Xếp hạng sản phẩm từ file snapshot")
+    top_parser.add_argument('path')
+    top_parser.add_argument('--metric', choices=METRICS, default='total_revenue')
+    top_parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        from API_kiotviet_NTV import KiotVietAPI
+
+        api = KiotVietAPI()
+        size = api.export_snapshot(args.path, args.month, args.year, compress=args.compress)
+        print(f"💾 Đã ghi {args.path} ({size / 1024 / 1024:.2f} MB)")
+        return
+
+    started = time.perf_counter()
+    lines, meta = read_snapshot(args.path)
+    opened = time.perf_counter()
+    table = lines.to_sales_table()
+    aggregated = time.perf_counter()
+
+    print(f"📂 {args.path}: {meta.get('period', '')} - {meta['invoice_total']:,} hóa đơn, {meta['line_count']:,} dòng")
+    print(f"⏱️ Mở file {(opened - started) * 1000:.1f}ms, tổng hợp {(aggregated - opened) * 1000:.1f}ms")
+    print("=" * 80)
+    for i, (_, data) in enumerate(table.top(args.metric, args.top), 1):
+        print(f"{i:2d}. {data['name'][:50]}")
+        print(f"    📦 Số lượng bán: {data['total_quantity']:,}")
+        print(f"    💰 Doanh thu: {data['total_revenue']:,.0f} VNĐ")
+        print(f"    📋 Số hóa đơn: {data['invoice_count']}")
+        print("-" * 60)
+
+
+if __name__ == "__main__":
+    main()
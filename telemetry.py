@@ -0,0 +1,302 @@
+"""
+Telemetry
+Đo từng HTTP request (độ trễ, status, dung lượng, số lần thử lại, trang) và thời gian theo
+giai đoạn (auth, fetch, wait, decode, store, aggregate, render) của một lần chạy
+Xuất ra file Prometheus text hoặc JSON, log tiến trình qua logging theo LOG_LEVEL
+"""
+
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Ngưỡng histogram (giây / byte)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1_024, 10_240, 102_400, 512_000, 1_048_576, 5_242_880, 10_485_760)
+
+# Số request chậm nhất được giữ lại để xem trong bản JSON
+SLOWEST_REQUESTS = 10
+
+# wait: thời gian luồng gọi phải chờ các trang đang tải song song
+PHASES = ('auth', 'fetch', 'wait', 'decode', 'store', 'aggregate', 'render')
+
+# Tên luồng chạy nền (và các luồng con của nó): chỉ hiện cảnh báo để không chen vào màn hình tương tác
+BACKGROUND_THREAD_PREFIX = 'kiotviet-background-'
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Ghi ra sys.stdout hiện tại (như print) để vẫn theo được khi stdout bị chuyển hướng"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class _BackgroundThreadFilter(logging.Filter):
+    """Ẩn log tiến trình (dưới WARNING) của các luồng chạy nền"""
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or not record.threadName.startswith(BACKGROUND_THREAD_PREFIX)
+
+
+def get_logger(level='INFO'):
+    """Logger của tool: in message như print cũ, ẩn/hiện theo LOG_LEVEL"""
+    logger = logging.getLogger('kiotviet')
+    if not logger.handlers:
+        handler = _StdoutHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler.addFilter(_BackgroundThreadFilter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    return logger
+
+
+class Histogram:
+    """Histogram tích lũy kiểu Prometheus (đếm theo ngưỡng le, kèm tổng và max)"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self):
+        """Số quan sát <= từng ngưỡng (theo quy ước bucket của Prometheus)"""
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def quantile(self, q):
+        """Phân vị ước lượng bằng cận trên của bucket chứa nó"""
+        if not self.count:
+            return 0
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative()):
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'max': round(self.max, 6),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': dict(zip((str(b) for b in self.buckets), self.cumulative()))
+        }
+
+
+class Telemetry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started_at = time.time()
+
+        # Theo endpoint
+        self.latency = {}
+        self.size = {}
+        self.retries = {}
+        self.status_counts = {}
+        self.slowest = []
+        self._sequence = itertools.count()
+
+        # Theo giai đoạn: [số lần, giây thực, giây CPU]
+        self.phases = {phase: [0, 0.0, 0.0] for phase in PHASES}
+
+    def record_request(self, endpoint, status, latency, size, retries=0, page=None):
+        """Ghi nhận một HTTP request (status=None nếu lỗi kết nối)"""
+        with self._lock:
+            if endpoint not in self.latency:
+                self.latency[endpoint] = Histogram(LATENCY_BUCKETS)
+                self.size[endpoint] = Histogram(SIZE_BUCKETS)
+                self.retries[endpoint] = 0
+            self.latency[endpoint].observe(latency)
+            self.size[endpoint].observe(size)
+            self.retries[endpoint] += retries
+
+            key = (endpoint, str(status) if status is not None else 'error')
+            self.status_counts[key] = self.status_counts.get(key, 0) + 1
+
+            entry = (latency, next(self._sequence), endpoint, page, status, retries)
+            if len(self.slowest) < SLOWEST_REQUESTS:
+                heapq.heappush(self.slowest, entry)
+            elif latency > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    @contextmanager
+    def phase(self, name):
+        """Đo thời gian một giai đoạn trên luồng hiện tại
+
+        Thời gian chỉ tính riêng (exclusive): giai đoạn lồng bên trong tạm dừng giai đoạn
+        bên ngoài trên cùng luồng. Các luồng tải song song cộng dồn nên tổng giây thực của
+        fetch có thể lớn hơn thời gian chạy; giây CPU cho biết phần việc tính toán thực sự.
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        now = (time.perf_counter(), time.thread_time())
+        if stack:
+            self._add_phase_time(stack[-1], now)
+        stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = (time.perf_counter(), time.thread_time())
+            self._add_phase_time(stack.pop(), now, count=True)
+            if stack:
+                stack[-1][1] = now
+
+    def _add_phase_time(self, frame, now, count=False):
+        name, (wall_started, cpu_started) = frame
+        with self._lock:
+            totals = self.phases.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1 if count else 0
+            totals[1] += now[0] - wall_started
+            totals[2] += now[1] - cpu_started
+
+    def phase_totals(self):
+        """Bản sao thời gian theo giai đoạn (dùng làm mốc để tính riêng cho một báo cáo)"""
+        with self._lock:
+            return {name: list(totals) for name, totals in self.phases.items()}
+
+    def start_report(self):
+        """Mốc bắt đầu một báo cáo: (thời điểm, thời gian theo giai đoạn)"""
+        return time.perf_counter(), self.phase_totals()
+
+    def format_breakdown(self, started):
+        """Bảng thời gian theo giai đoạn kể từ mốc start_report"""
+        started_at, before = started
+        wall_time = time.perf_counter() - started_at
+        lines = [f"⏱️ Thời gian theo giai đoạn (tổng {wall_time:.2f}s):"]
+        for name, (calls, wall, cpu) in self.phase_totals().items():
+            prev_calls, prev_wall, prev_cpu = before.get(name, (0, 0.0, 0.0))
+            if calls == prev_calls:
+                continue
+            lines.append(f"   {name:<10} {wall - prev_wall:>8.2f}s thực  {cpu - prev_cpu:>8.2f}s CPU  ({calls - prev_calls} lần)")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        """Tóm tắt dạng JSON"""
+        with self._lock:
+            endpoints = {}
+            for endpoint, histogram in self.latency.items():
+                endpoints[endpoint] = {
+                    'status': {status: count for (ep, status), count in self.status_counts.items() if ep == endpoint},
+                    'retries': self.retries[endpoint],
+                    'latency_seconds': histogram.to_dict(),
+                    'response_bytes': self.size[endpoint].to_dict()
+                }
+            return {
+                'started_at': self.started_at,
+                'duration_seconds': round(time.time() - self.started_at, 3),
+                'endpoints': endpoints,
+                'phases': {
+                    name: {'calls': calls, 'wall_seconds': round(wall, 6), 'cpu_seconds': round(cpu, 6)}
+                    for name, (calls, wall, cpu) in self.phases.items()
+                },
+                'slowest_requests': [
+                    {'endpoint': endpoint, 'page': page, 'status': status,
+                     'latency_seconds': round(latency, 6), 'retries': retries}
+                    for latency, _, endpoint, page, status, retries in sorted(self.slowest, reverse=True)
+                ]
+            }
+
+    def to_prometheus(self):
+        """Xuất dạng Prometheus text exposition (dùng cho node_exporter textfile collector)"""
+        lines = []
+        with self._lock:
+            for metric, histograms, help_text in (
+                ('kiotviet_http_request_duration_seconds', self.latency, 'Độ trễ HTTP request theo endpoint'),
+                ('kiotviet_http_response_bytes', self.size, 'Dung lượng response theo endpoint'),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for endpoint, histogram in sorted(histograms.items()):
+                    for bound, total in zip(histogram.buckets, histogram.cumulative()):
+                        lines.append(f'{metric}_bucket{{endpoint="{endpoint}",le="{bound}"}} {total}')
+                    lines.append(f'{metric}_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{endpoint="{endpoint}"}} {histogram.sum:.6f}')
+                    lines.append(f'{metric}_count{{endpoint="{endpoint}"}} {histogram.count}')
+
+            lines.append("# HELP kiotviet_http_requests_total Số HTTP request theo endpoint và status")
+            lines.append("# TYPE kiotviet_http_requests_total counter")
+            for (endpoint, status), count in sorted(self.status_counts.items()):
+                lines.append(f'kiotviet_http_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+            lines.append("# HELP kiotviet_http_retries_total Số lần thử lại theo endpoint")
+            lines.append("# TYPE kiotviet_http_retries_total counter")
+            for endpoint, retries in sorted(self.retries.items()):
+                lines.append(f'kiotviet_http_retries_total{{endpoint="{endpoint}"}} {retries}')
+
+            for metric, index, help_text in (
+                ('kiotviet_phase_calls_total', 0, 'Số lần chạy theo giai đoạn'),
+                ('kiotviet_phase_seconds_total', 1, 'Thời gian thực theo giai đoạn (cộng dồn các luồng)'),
+                ('kiotviet_phase_cpu_seconds_total', 2, 'Thời gian CPU theo giai đoạn'),
+            ):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for name, totals in self.phases.items():
+                    value = totals[index]
+                    lines.append(f'{metric}{{phase="{name}"}} {value if index == 0 else f"{value:.6f}"}')
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """Ghi số liệu ra file: .json là bản tóm tắt JSON, còn lại là Prometheus text"""
+        if path.endswith('.json'):
+            content = json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+        else:
+            content = self.to_prometheus()
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+_shared_telemetry = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_telemetry(export_path=None):
+    """Telemetry dùng chung trong tiến trình; nếu có export_path thì ghi file khi tiến trình kết thúc"""
+    global _shared_telemetry
+    with _shared_lock:
+        if _shared_telemetry is None:
+            _shared_telemetry = Telemetry()
+            if export_path:
+                atexit.register(_export_at_exit, _shared_telemetry, export_path)
+        return _shared_telemetry
+
+
+def _export_at_exit(telemetry, path):
+    try:
+        telemetry.export(path)
+    except OSError as e:
+        print(f"⚠️ Không thể ghi số liệu telemetry: {e}")
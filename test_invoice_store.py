@@ -0,0 +1,86 @@
+"""
+Test Invoice Store
+Kiểm tra bảng tổng hợp theo ngày tính trên process pool giống hệt khi tính tuần tự
+Chạy: python -m pytest -q test_invoice_store.py
+"""
+
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from invoice_store import PARALLEL_ROLLUP_MIN_DAYS, InvoiceStore
+
+
+def make_invoices(days, per_day=20, seed=42):
+    """Hóa đơn tổng hợp trải đều trên `days` ngày của năm 2024"""
+    rnd = random.Random(seed)
+    invoices = []
+    start = datetime(2024, 1, 1)
+    for day in range(days):
+        for i in range(per_day):
+            modified = start + timedelta(days=day, seconds=rnd.randint(0, 86399))
+            invoices.append({
+                'id': day * per_day + i + 1,
+                'code': f"HD{day * per_day + i + 1:06d}",
+                'modifiedDate': modified.strftime("%Y-%m-%dT%H:%M:%S"),
+                'invoiceDetails': [
+                    {
+                        'productId': product_id,
+                        'productName': f"Sản phẩm {product_id}",
+                        'quantity': rnd.randint(1, 5),
+                        'price': rnd.choice([10000, 25000, 99000])
+                    }
+                    for product_id in rnd.sample(range(1, 40), rnd.randint(1, 4))
+                ]
+            })
+    return invoices
+
+
+def rollup_rows(store):
+    return store.conn.execute("SELECT * FROM daily_product_sales ORDER BY day, product_id").fetchall()
+
+
+@pytest.mark.parametrize('fast_json', [True, False])
+def test_parallel_rollups_match_serial(tmp_path, fast_json):
+    days = PARALLEL_ROLLUP_MIN_DAYS + 30
+    invoices = make_invoices(days)
+    from_date, to_date = datetime(2024, 1, 1), datetime(2024, 12, 31)
+
+    serial = InvoiceStore(str(tmp_path / 'serial.db'), processes=1, fast_json=fast_json)
+    parallel = InvoiceStore(str(tmp_path / 'parallel.db'), processes=4, fast_json=fast_json)
+    for store in (serial, parallel):
+        store.save_invoices(invoices)
+        assert store.refresh_rollups(from_date, to_date) == days
+
+    assert rollup_rows(parallel) == rollup_rows(serial)
+    assert parallel.conn.execute("SELECT COUNT(*) FROM rollup_dirty_days").fetchone()[0] == 0
+
+    table = parallel.get_sales_table(from_date, to_date)
+    assert table.products == serial.get_sales_table(from_date, to_date).products
+    assert table.invoice_total == len(invoices)
+
+
+def test_rollup_from_another_instance_does_not_clear_newer_dirty_day(tmp_path, monkeypatch):
+    import invoice_store
+
+    db_path = str(tmp_path / 'shared.db')
+    reporter, syncer = InvoiceStore(db_path), InvoiceStore(db_path)
+    invoices = make_invoices(1)
+    reporter.save_invoices(invoices[:-1])
+    day = datetime(2024, 1, 1)
+
+    compute = invoice_store.compute_day_rollup
+
+    def compute_then_sync(conn, rollup_day, fast=True):
+        # Tiến trình khác ghi thêm hóa đơn của ngày đang tính, sau khi đã đọc xong dữ liệu cũ
+        rows = compute(conn, rollup_day, fast)
+        syncer.save_invoices(invoices[-1:])
+        return rows
+
+    monkeypatch.setattr(invoice_store, 'compute_day_rollup', compute_then_sync)
+    reporter.refresh_rollups(day, day)
+    assert reporter.conn.execute("SELECT COUNT(*) FROM rollup_dirty_days").fetchone()[0] == 1
+
+    monkeypatch.setattr(invoice_store, 'compute_day_rollup', compute)
+    assert reporter.get_sales_table(day, day).invoice_total == len(invoices)
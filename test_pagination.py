@@ -0,0 +1,124 @@
+"""
+Test Pagination
+Kiểm tra DriftGuard và việc duyệt trang hóa đơn khi dữ liệu thay đổi giữa lúc phân trang
+Chạy: python -m pytest -q test_pagination.py
+"""
+
+from API_kiotviet_NTV import KiotVietAPI
+from pagination import DriftGuard
+from telemetry import Telemetry
+
+PAGE_SIZE = 100
+
+
+def make_page(ids, total):
+    return {'total': total, 'data': [{'id': invoice_id} for invoice_id in ids]}
+
+
+def test_growth_is_not_a_gap():
+    guard = DriftGuard(PAGE_SIZE)
+    guard.start_pass()
+    guard.filter(make_page(range(1, 101), 150), 0)
+    guard.filter(make_page(range(101, 153), 152), 100)
+
+    assert guard.take_gaps() == []
+    assert guard.next_offset is None
+    assert guard.complete()
+
+
+def test_full_last_page_continues_to_new_end():
+    guard = DriftGuard(PAGE_SIZE)
+    guard.start_pass()
+    guard.filter(make_page(range(1, 101), 200), 0)
+    guard.filter(make_page(range(101, 201), 201), 100)
+
+    assert guard.next_offset == 200
+    assert not guard.complete()
+
+
+def test_shrink_marks_pages_before_the_boundary():
+    guard = DriftGuard(PAGE_SIZE)
+    guard.start_pass()
+    guard.filter(make_page(range(1, 101), 250), 0)
+    # Hai hóa đơn ở trang đầu rời cửa sổ: id 101, 102 dịch lên trang đã tải
+    guard.filter(make_page(range(103, 203), 248), 100)
+    guard.filter(make_page(range(203, 251), 248), 200)
+
+    assert guard.shrunk
+    # Đã gặp đủ 248 id nhưng vẫn thiếu 101, 102: chưa được coi là đủ
+    assert not guard.complete()
+    assert guard.take_gaps() == [98]
+    guard.filter(make_page(range(99, 199), 248))
+    assert guard.complete()
+    assert {101, 102} <= guard.seen_ids
+
+
+def test_duplicates_are_dropped():
+    guard = DriftGuard(PAGE_SIZE)
+    guard.start_pass()
+    guard.filter(make_page(range(1, 101), 201), 0)
+    # Một hóa đơn mới chen vào đầu: id 100 bị đẩy sang trang sau
+    page = guard.filter(make_page(range(100, 200), 201), 100)
+
+    assert [invoice['id'] for invoice in page['data']] == list(range(101, 200))
+    assert len(guard.seen_ids) == 199
+
+
+def test_missing_rows_without_shrink_are_a_gap():
+    guard = DriftGuard(PAGE_SIZE)
+    guard.start_pass()
+    guard.filter(make_page(range(1, 101), 150), 0)
+    guard.filter(make_page(range(102, 151), 150), 100)
+
+    assert guard.take_gaps() == []
+    assert not guard.complete()
+    assert 'mới có 149/150' in guard.describe()
+
+
+class ShopClient(KiotVietAPI):
+    """KiotVietAPI đọc hóa đơn từ danh sách trong bộ nhớ, `on_request` sửa dữ liệu trước mỗi request"""
+
+    def __init__(self, invoice_ids, on_request=None):
+        self.rows = list(invoice_ids)
+        self.on_request = on_request
+        self.requests = 0
+        self.fetch_concurrency = 1
+        self.drift_max_passes = 2
+        self.telemetry = Telemetry()
+
+    def get_invoices(self, from_date, to_date, page_size=100, current_item=0):
+        self.requests += 1
+        if self.on_request:
+            self.on_request(self)
+        return make_page(self.rows[current_item:current_item + page_size], len(self.rows))
+
+
+def walk(client):
+    pages = list(client._iter_invoice_pages(None, None, PAGE_SIZE))
+    ids = [invoice['id'] for page in pages if page for invoice in page['data']]
+    return pages, ids
+
+
+def test_walk_follows_new_invoices_without_rewalking():
+    def add_invoice(client):
+        client.rows.append(client.rows[-1] + 1)
+
+    client = ShopClient(range(1, 502), add_invoice)
+    pages, ids = walk(client)
+
+    assert None not in pages
+    assert client.requests == 6
+    assert sorted(ids) == client.rows
+
+
+def test_walk_refetches_only_around_a_shrink():
+    def remove_fetched_invoice(client):
+        if client.requests == 2:
+            client.rows.remove(5)
+
+    client = ShopClient(range(1, 251), remove_fetched_invoice)
+    pages, ids = walk(client)
+
+    assert None not in pages
+    assert client.requests == 4
+    assert sorted(ids) == list(range(1, 251))
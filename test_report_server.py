@@ -0,0 +1,25 @@
+"""
+Test Report Server
+Kiểm tra tham số URL của /top bị từ chối (400) thay vì gây lỗi khi chạy truy vấn
+Chạy: python -m pytest -q test_report_server.py
+"""
+
+import pytest
+
+from report_server import ReportRequestHandler
+
+
+def query_params(**params):
+    handler = ReportRequestHandler.__new__(ReportRequestHandler)
+    return handler._query_params(params)
+
+
+@pytest.mark.parametrize('top_n', ['0', '-3', '2.5', 'abc', ''])
+def test_invalid_top_n_is_rejected(top_n):
+    with pytest.raises(ValueError, match='top_n'):
+        query_params(top_n=top_n, approximate='true', year='2024')
+
+
+def test_top_n_is_parsed():
+    assert query_params(top_n='5', year='2024').top_n == 5
+    assert query_params(year='2024').top_n == 10
@@ -0,0 +1,162 @@
+"""
+Time Series
+Chuỗi thời gian theo sản phẩm (theo ngày, tuần ISO cắt theo năm hoặc tháng) dựng trong một lần duyệt
+từ tổng hợp theo ngày của kho hóa đơn hoặc trực tiếp từ luồng hóa đơn
+Kèm tăng trưởng so với kỳ trước và so với cùng kỳ năm trước (YoY) tính trên cùng dữ liệu
+"""
+
+from datetime import date, timedelta
+
+from aggregation import METRICS, as_number, top_n_by_keys
+from invoice_store import invoice_modified_date
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def bucket_key(day, bucket):
+    """Khóa bucket của một ngày 'YYYY-MM-DD': cùng ngày, 'YYYY-Www' (tuần ISO) hoặc 'YYYY-MM'
+
+    Tuần ISO được cắt theo năm dương lịch để tổng các tuần của một năm đúng bằng tổng của năm:
+    những ngày đầu tháng 1 thuộc tuần cuối năm trước là 'YYYY-W00', những ngày cuối tháng 12
+    thuộc tuần 1 năm sau là tuần cuối cộng một của năm đó (vd. 30-31/12/2024 là '2024-W53').
+    """
+    if bucket == 'day':
+        return day
+    if bucket == 'month':
+        return day[:7]
+    value = date.fromisoformat(day)
+    iso_year, iso_week, _ = value.isocalendar()
+    if iso_year < value.year:
+        iso_week = 0
+    elif iso_year > value.year:
+        # 28/12 luôn thuộc tuần ISO cuối cùng của năm
+        iso_week = date(value.year, 12, 28).isocalendar()[1] + 1
+    return f"{value.year}-W{iso_week:02d}"
+
+
+def bucket_keys(from_date, to_date, bucket):
+    """Các bucket trong khoảng theo thứ tự thời gian (kể cả bucket không có hóa đơn)"""
+    keys = []
+    day = from_date.date() if hasattr(from_date, 'date') else from_date
+    end = to_date.date() if hasattr(to_date, 'date') else to_date
+    while day <= end:
+        key = bucket_key(day.isoformat(), bucket)
+        if not keys or keys[-1] != key:
+            keys.append(key)
+        day += timedelta(days=1)
+    return keys
+
+
+def previous_year_key(key, bucket):
+    """Bucket cùng kỳ năm trước (None với ngày 29/2)"""
+    year = int(key[:4]) - 1
+    if bucket == 'day':
+        try:
+            return date(year, int(key[5:7]), int(key[8:10])).isoformat()
+        except ValueError:
+            return None
+    return f"{year}{key[4:]}"
+
+
+def percent_change(current, previous):
+    """Phần trăm thay đổi so với giá trị trước, None nếu giá trị trước bằng 0"""
+    if not previous:
+        return None
+    return (current - previous) / previous * 100
+
+
+class ProductTimeSeries:
+    """Chuỗi thời gian theo sản phẩm cho cả khoảng đã tải
+
+    products: {product_id: {'name', 'total_quantity': [..], 'total_revenue': [..], 'invoice_count': [..]}}
+    với mỗi danh sách có một giá trị cho mỗi bucket trong `keys`. invoice_count đếm số dòng
+    chi tiết giống ProductSalesTable, nên tổng các bucket khớp với bảng tổng hợp của cùng khoảng.
+    """
+
+    def __init__(self, from_date, to_date, bucket='month'):
+        if bucket not in BUCKETS:
+            raise ValueError(f"Bucket không hợp lệ: {bucket} (chọn một trong {', '.join(BUCKETS)})")
+        self.bucket = bucket
+        self.keys = bucket_keys(from_date, to_date, bucket)
+        self._index = {key: i for i, key in enumerate(self.keys)}
+        self._day_index = {}
+        self.products = {}
+        self.totals = {metric: [0] * len(self.keys) for metric in METRICS}
+
+    def _bucket_index(self, day):
+        """Vị trí bucket của một ngày (nhớ lại theo ngày vì mỗi ngày có nhiều dòng)"""
+        index = self._day_index.get(day)
+        if index is None and day not in self._day_index:
+            # Hóa đơn không có mốc thời gian không thuộc bucket nào (kho hóa đơn cũng bỏ qua)
+            index = self._day_index[day] = self._index.get(bucket_key(day, self.bucket)) if day else None
+        return index
+
+    def add(self, day, product_id, name, quantity, revenue, line_count=1):
+        """Cộng số liệu của một sản phẩm trong một ngày vào bucket tương ứng"""
+        index = self._bucket_index(day)
+        if index is None:
+            return
+
+        product = self.products.get(product_id)
+        if product is None:
+            size = len(self.keys)
+            product = self.products[product_id] = {
+                'name': name, 'total_quantity': [0] * size, 'total_revenue': [0] * size, 'invoice_count': [0] * size
+            }
+        for metric, value in (('total_quantity', quantity), ('total_revenue', revenue), ('invoice_count', line_count)):
+            product[metric][index] += value
+            self.totals[metric][index] += value
+
+    @classmethod
+    def from_daily_rows(cls, rows, from_date, to_date, bucket='month'):
+        """Dựng từ tổng hợp theo ngày của kho: (day, product_id, product_name, quantity, revenue, line_count)"""
+        series = cls(from_date, to_date, bucket)
+        for day, product_id, product_name, quantity, revenue, line_count in rows:
+            series.add(day, product_id, product_name, as_number(quantity), as_number(revenue), line_count)
+        return series
+
+    @classmethod
+    def from_invoices(cls, invoices, from_date, to_date, bucket='month'):
+        """Dựng trong một lần duyệt luồng hóa đơn (ngày theo lastModified, cùng tiêu chí lọc với API)"""
+        series = cls(from_date, to_date, bucket)
+        for invoice in invoices:
+            day = invoice_modified_date(invoice)[:10]
+            for detail in invoice.get('invoiceDetails') or []:
+                quantity = detail.get('quantity', 0)
+                series.add(day, detail.get('productId'), detail.get('productName', 'Không xác định'),
+                           quantity, quantity * detail.get('price', 0))
+        return series
+
+    def index_of(self, day):
+        """Vị trí bucket chứa một ngày (datetime/date), None nếu ngoài khoảng"""
+        return self._index.get(bucket_key(day.strftime('%Y-%m-%d'), self.bucket))
+
+    def series(self, product_id, metric):
+        """Giá trị theo từng bucket của một sản phẩm"""
+        return self.products[product_id][metric]
+
+    def growth(self, values):
+        """Phần trăm thay đổi của từng bucket so với bucket liền trước (None cho bucket đầu)"""
+        return [None] + [percent_change(current, previous) for previous, current in zip(values, values[1:])]
+
+    def yoy(self, values):
+        """(chênh lệch, phần trăm) của từng bucket so với cùng kỳ năm trước, None nếu năm trước ngoài khoảng"""
+        result = []
+        for key, value in zip(self.keys, values):
+            previous_index = self._index.get(previous_year_key(key, self.bucket))
+            if previous_index is None:
+                result.append(None)
+            else:
+                previous = values[previous_index]
+                result.append((as_number(value - previous), percent_change(value, previous)))
+        return result
+
+    def top(self, metric, top_n=10, start=0, end=None):
+        """Top N sản phẩm theo tổng của các bucket [start, end), trả về danh sách (product_id, data)"""
+        if metric not in METRICS:
+            raise ValueError(f"Chỉ số không hợp lệ: {metric}")
+        return top_n_by_keys(
+            self.products.items(),
+            {metric: lambda item: sum(item[1][metric][start:end])},
+            top_n
+        )[metric]
@@ -0,0 +1,147 @@
+"""
+Token Manager
+Quản lý vòng đời Access Token KiotViet: lưu hạn dùng, làm mới trước khi hết hạn,
+xác thực lại khi gặp 401 và lưu token ra đĩa để các lần chạy sau dùng lại
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from config import Config
+from rate_limiter import locked_file
+from telemetry import get_logger
+
+logger = get_logger(Config.LOG_LEVEL)
+
+# Hạn dùng mặc định nếu response không có expires_in (giây)
+DEFAULT_EXPIRES_IN = 3600
+
+# Khóa theo file cache: nhiều TokenManager trong cùng tiến trình (fan-out nhiều cửa hàng) dùng chung một file
+_cache_file_locks = {}
+_cache_file_locks_lock = threading.Lock()
+
+
+def _cache_file_lock(path):
+    """Khóa trong tiến trình cho một file cache token"""
+    with _cache_file_locks_lock:
+        return _cache_file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class TokenManager:
+    def __init__(self, fetch_token, cache_path=None, cache_key='default', refresh_margin=300):
+        """
+        fetch_token: hàm gọi OAuth, trả về (access_token, expires_in) hoặc None nếu thất bại
+                     (None nếu token luôn được nạp qua set_token)
+        cache_path: file lưu token (None để không lưu ra đĩa)
+        refresh_margin: số giây làm mới token trước khi hết hạn
+        """
+        self._fetch_token = fetch_token
+        self.cache_path = cache_path
+        self.cache_key = cache_key
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+
+        self.access_token = None
+        self.expires_at = 0
+        self._load()
+
+    def is_valid(self):
+        """Token hiện tại còn dùng được (chưa tới ngưỡng cần làm mới)"""
+        return bool(self.access_token) and time.time() < self.expires_at - self.refresh_margin
+
+    def get_token(self):
+        """Trả về token còn hạn, tự lấy token mới nếu sắp hết hạn"""
+        with self._lock:
+            if self.is_valid():
+                return self.access_token
+
+            result = self._fetch_token() if self._fetch_token else None
+            if not result:
+                return None
+
+            self._set_token(*result)
+            return self.access_token
+
+    def set_token(self, access_token, expires_in=None):
+        """Nạp token vừa lấy từ bên ngoài (client async tự gọi OAuth rồi lưu qua đây)"""
+        with self._lock:
+            self._set_token(access_token, expires_in)
+
+    def _set_token(self, access_token, expires_in):
+        self.access_token = access_token
+        self.expires_at = time.time() + (expires_in or DEFAULT_EXPIRES_IN)
+        self._save()
+
+    def invalidate(self, access_token=None):
+        """Bỏ token bị server từ chối (chỉ bỏ nếu nó vẫn là token hiện tại)"""
+        with self._lock:
+            if access_token is None or access_token == self.access_token:
+                self.access_token = None
+                self.expires_at = 0
+                self._save()
+
+    def _read_cache_file(self):
+        """Đọc toàn bộ file cache token"""
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _load(self):
+        """Nạp token đã lưu trên đĩa (nếu còn hạn)"""
+        if not self.cache_path:
+            return
+
+        entry = self._read_cache_file().get(self.cache_key)
+        if not entry:
+            return
+
+        self.access_token = entry.get('access_token')
+        self.expires_at = entry.get('expires_at', 0)
+        if self.is_valid():
+            expires_text = datetime.fromtimestamp(self.expires_at).strftime('%H:%M %d/%m/%Y')
+            logger.info(f"🎫 Dùng lại token đã lưu (hết hạn lúc {expires_text})")
+
+    def _save(self):
+        """Ghi token ra đĩa
+
+        Đọc - sửa - ghi lại cả file trong khóa (giữa các luồng và qua file .lock giữa các tiến trình)
+        để không làm mất token của client khác; ghi file tạm riêng rồi đổi tên để file không bị hỏng.
+        """
+        if not self.cache_path:
+            return
+
+        tmp_path = None
+        try:
+            with _cache_file_lock(self.cache_path), locked_file(f"{self.cache_path}.lock"):
+                cache = self._read_cache_file()
+                if self.access_token:
+                    cache[self.cache_key] = {
+                        'access_token': self.access_token,
+                        'expires_at': self.expires_at
+                    }
+                else:
+                    cache.pop(self.cache_key, None)
+
+                # mkstemp tạo file tên riêng với quyền 0600 ngay từ đầu, token không lúc nào đọc được bởi người khác
+                fd, tmp_path = tempfile.mkstemp(
+                    prefix=f"{os.path.basename(self.cache_path)}.", suffix='.tmp',
+                    dir=os.path.dirname(os.path.abspath(self.cache_path))
+                )
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(cache, f)
+                os.replace(tmp_path, self.cache_path)
+                tmp_path = None
+        except OSError as e:
+            logger.warning(f"⚠️ Không thể lưu token ra đĩa: {e}")
+        finally:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass